@@ -0,0 +1,5 @@
+"""
+Benchmark and load-test suite for the LaTeX to PDF converter
+
+Run with ``python -m benchmarks.run --help`` from the repository root.
+"""
@@ -0,0 +1,111 @@
+"""
+Local stand-in HTTP server for image URLs
+
+Serves deterministic PNG images so benchmarks run offline and image sizes
+are controlled. ``/img/<seed>-<width>x<height>.png`` returns a noisy image
+of the given size; noise keeps the PNG from compressing to nothing, so the
+transfer and decode cost resembles real photographs.
+"""
+
+import random
+import re
+import struct
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+IMAGE_PATH_PATTERN = re.compile(r"^/img/(\d+)-(\d+)x(\d+)\.png$")
+MAX_DIMENSION = 8000
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    chunk = kind + data
+    return struct.pack(">I", len(data)) + chunk + struct.pack(">I", zlib.crc32(chunk) & 0xFFFFFFFF)
+
+
+def make_png(width: int, height: int, seed: int) -> bytes:
+    """
+    Build an RGB PNG of the given size with seeded noise
+
+    Args:
+        width: Width in pixels
+        height: Height in pixels
+        seed: Seed of the noise pattern
+
+    Returns:
+        PNG file bytes
+    """
+    rng = random.Random(seed)
+    # One noisy row repeated with a shift: realistic size, cheap to generate
+    row = rng.randbytes(width * 3)
+    rows = []
+    for y in range(height):
+        shift = (y * 3 * 7) % len(row)
+        rows.append(b"\x00" + row[shift:] + row[:shift])
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", header),
+        _png_chunk(b"IDAT", zlib.compress(b"".join(rows), 6)),
+        _png_chunk(b"IEND", b""),
+    ])
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    cache: Dict[str, bytes] = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        match = IMAGE_PATH_PATTERN.match(self.path)
+        if match is None:
+            self.send_error(404)
+            return
+        seed, width, height = (int(value) for value in match.groups())
+        if not (0 < width <= MAX_DIMENSION and 0 < height <= MAX_DIMENSION):
+            self.send_error(400)
+            return
+
+        with self.lock:
+            body = self.cache.get(self.path)
+            if body is None:
+                body = self.cache[self.path] = make_png(width, height, seed)
+
+        etag = f'"{seed}-{width}x{height}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ImageServer:
+    """
+    Image server on a free localhost port, running in a background thread
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = ThreadingHTTPServer((host, port), _ImageHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "ImageServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
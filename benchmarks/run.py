@@ -0,0 +1,270 @@
+"""
+Benchmark runner: single-compile latency breakdown and concurrent throughput
+
+The application runs in-process (lifespan included) behind an httpx ASGI
+client, images come from a local ImageServer, and the result is a JSON
+document meant to be stored and compared across commits:
+
+    python -m benchmarks.run --images 4 --concurrency 4 --requests 32 -o bench.json
+
+Every request uses a fresh synthetic paper, so the PDF cache is bypassed
+unless --pdf-cache is given. Caches and formats live in a temporary data
+directory unless --data-dir points at a persistent one.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from .image_server import ImageServer
+from .synthetic import SCRIPTS, PaperSpec, build_paper
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    Linearly interpolated percentile, q in [0, 100]
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    """
+    Count, mean and p50/p95/p99 of a list of durations in seconds
+    """
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4),
+        "min": round(min(values), 4),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """
+    Turn a Server-Timing header into stage -> seconds
+    """
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if name and key == "dur":
+                stages[name] = float(value) / 1000
+    return stages
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        proc = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+
+async def _convert(client, paper: Dict[str, Any]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    response = await client.post("/convert", json=paper)
+    elapsed = time.perf_counter() - start
+    return {
+        "status": response.status_code,
+        "seconds": elapsed,
+        "bytes": len(response.content),
+        "stages": parse_server_timing(response.headers.get("server-timing")),
+        "passes": int(response.headers.get("x-latex-passes", 0) or 0),
+    }
+
+
+async def run_single(client, papers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Compile papers one at a time and break the latency down by stage
+    """
+    results = [await _convert(client, paper) for paper in papers]
+    ok = [result for result in results if result["status"] == 200]
+    stage_names = list(dict.fromkeys(name for result in ok for name in result["stages"]))
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "latency": summarize([result["seconds"] for result in ok]),
+        "stages": {
+            name: summarize([result["stages"][name] for result in ok if name in result["stages"]])
+            for name in stage_names
+        },
+        "pdf_bytes": summarize([float(result["bytes"]) for result in ok]),
+        "passes": summarize([float(result["passes"]) for result in ok]),
+    }
+
+
+async def run_concurrent(client, papers: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    """
+    Compile papers with a fixed number of requests in flight
+    """
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def limited(paper):
+        async with limiter:
+            return await _convert(client, paper)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(limited(paper) for paper in papers))
+    wall = time.perf_counter() - start
+    ok = [result for result in results if result["status"] == 200]
+    statuses: Dict[str, int] = {}
+    for result in results:
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "statuses": statuses,
+        "wall_seconds": round(wall, 4),
+        "throughput_per_second": round(len(ok) / wall, 4) if wall else None,
+        "latency": summarize([result["seconds"] for result in ok]),
+    }
+
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    # Imported late so the environment set up in main() is what config reads
+    import httpx
+    from src import config
+    from src.main import app
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    base = json.loads(pathlib.Path(args.base).read_text(encoding="utf-8"))
+    spec = PaperSpec(
+        parts=args.parts,
+        questions=args.questions,
+        scripts=args.scripts,
+        words=args.words,
+        tables=args.tables,
+        math=args.math,
+        images=args.images,
+        image_width=args.image_size[0],
+        image_height=args.image_size[1],
+    )
+
+    with ImageServer() as image_server:
+        def papers(count: int, offset: int) -> List[Dict[str, Any]]:
+            return [
+                build_paper(spec, base, args.seed + offset + i, image_server.base_url)
+                for i in range(count)
+            ]
+
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                # Untimed: builds the format and warms the font cache
+                for paper in papers(args.warmup, 10_000_000):
+                    await _convert(client, paper)
+
+                single = await run_single(client, papers(args.iterations, 0))
+                concurrent = None
+                if args.requests:
+                    concurrent = await run_concurrent(
+                        client, papers(args.requests, args.iterations), args.concurrency
+                    )
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "compile_concurrency": config.COMPILE_CONCURRENCY,
+            "pdf_cache": config.PDF_CACHE_ENABLED,
+            "image_cache": config.IMAGE_CACHE_ENABLED,
+            "data_dir": config.DATA_DIR,
+        },
+        "spec": spec.to_dict(),
+        "seed": args.seed,
+        "single": single,
+        "concurrent": concurrent,
+    }
+
+
+def _image_size(value: str) -> tuple:
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+
+def _scripts(value: str) -> List[str]:
+    scripts = [script.strip() for script in value.split(",") if script.strip()]
+    unknown = set(scripts) - set(SCRIPTS)
+    if unknown or not scripts:
+        raise argparse.ArgumentTypeError(f"scripts must be a subset of {', '.join(SCRIPTS)}")
+    return scripts
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", default=str(REPO_ROOT / "q.json"), help="Paper whose header fields are reused")
+    parser.add_argument("--parts", type=int, default=3)
+    parser.add_argument("--questions", type=int, default=10, help="Questions per part")
+    parser.add_argument("--scripts", type=_scripts, default=["latin", "malayalam"],
+                        help=f"Comma separated mix of: {', '.join(SCRIPTS)}")
+    parser.add_argument("--words", type=int, default=14, help="Words per question")
+    parser.add_argument("--tables", type=float, default=0.1, help="Share of questions with a table")
+    parser.add_argument("--math", type=float, default=0.2, help="Share of questions with a formula")
+    parser.add_argument("--images", type=int, default=0, help="Images per paper")
+    parser.add_argument("--image-size", type=_image_size, default=(1200, 900), help="WIDTHxHEIGHT in pixels")
+    parser.add_argument("--iterations", type=int, default=5, help="Sequential compiles for the stage breakdown")
+    parser.add_argument("--requests", type=int, default=0, help="Requests in the concurrent run (0 skips it)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight in the concurrent run")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed compiles before measuring")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pdf-cache", action="store_true", help="Leave the PDF cache enabled")
+    parser.add_argument("--no-image-cache", action="store_true", help="Download every image on every request")
+    parser.add_argument("--data-dir", help="Persistent data directory (default: a fresh temporary one)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Keep the application's INFO logging")
+    parser.add_argument("-o", "--output", help="Write the JSON result to this file instead of stdout")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="latextopdf-bench-")
+    os.environ["LATEXTOPDF_DATA_DIR"] = data_dir
+    os.environ["PDF_CACHE_ENABLED"] = "true" if args.pdf_cache else "false"
+    if args.no_image_cache:
+        os.environ["IMAGE_CACHE_ENABLED"] = "false"
+    # The runner drives compiles itself; no startup sample or job workers
+    os.environ.setdefault("WARMUP_ENABLED", "false")
+    os.environ.setdefault("JOB_EMBEDDED_WORKERS", "0")
+    sys.path.insert(0, str(REPO_ROOT))
+
+    result = asyncio.run(run_benchmark(args))
+    output = json.dumps(result, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
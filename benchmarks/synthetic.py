@@ -0,0 +1,138 @@
+"""
+Synthetic question papers for benchmarking
+
+Papers are derived from q.json (header fields) and filled with generated
+questions whose script mix, tables, math density and images are set by a
+PaperSpec. Generation is seeded, so the same spec always yields the same
+papers.
+"""
+
+import copy
+import random
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+SCRIPTS = ("latin", "malayalam", "devanagari", "arabic")
+
+_WORDS = {
+    "latin": (
+        "explain", "the", "significance", "of", "entropy", "in", "closed", "systems", "describe",
+        "state", "reason", "compare", "structure", "function", "analysis", "theory", "evidence",
+    ),
+    "malayalam": (
+        "ഗാന്ധിജി", "സത്യം", "ഈശ്വരൻ", "സാഹിത്യം", "മാനവികത", "എന്താണ്", "വിശദീകരിക്കുക",
+        "അർത്ഥം", "പുസ്തകം", "സമൂഹം", "ധാതു", "പ്രസ്താവന",
+    ),
+    "devanagari": (
+        "सत्य", "अहिंसा", "अर्थ", "बताइए", "समाज", "साहित्य", "विचार", "व्याख्या", "कीजिए", "प्रश्न",
+    ),
+    "arabic": (
+        "ما", "هو", "الحق", "اشرح", "المعنى", "الأدب", "المجتمع", "السؤال", "الفكرة", "النص",
+    ),
+}
+
+_SCRIPT_COMMANDS = {
+    "malayalam": "\\textmalayalam",
+    "devanagari": "\\texthindi",
+    "arabic": "\\textarabic",
+}
+
+_FORMULAS = (
+    "$S = k \\log W$",
+    "$\\int_0^\\infty e^{-x^2}\\,dx = \\frac{\\sqrt{\\pi}}{2}$",
+    "$\\sum_{n=1}^{\\infty} \\frac{1}{n^2} = \\frac{\\pi^2}{6}$",
+    "$\\nabla \\cdot \\mathbf{E} = \\frac{\\rho}{\\varepsilon_0}$",
+    "$x = \\frac{-b \\pm \\sqrt{b^2 - 4ac}}{2a}$",
+    "$\\begin{pmatrix} a & b \\\\ c & d \\end{pmatrix}$",
+)
+
+
+@dataclass
+class PaperSpec:
+    """
+    Shape of a synthetic question paper
+    """
+    parts: int = 3
+    questions: int = 10
+    scripts: List[str] = field(default_factory=lambda: ["latin", "malayalam"])
+    words: int = 14
+    tables: float = 0.1
+    math: float = 0.2
+    images: int = 0
+    image_width: int = 1200
+    image_height: int = 900
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _sentence(rng: random.Random, script: str, words: int) -> str:
+    chosen = [rng.choice(_WORDS[script]) for _ in range(words)]
+    command = _SCRIPT_COMMANDS.get(script)
+    if command is None:
+        return " ".join(chosen)
+    # The templates wrap every word, as the exam authoring tool does
+    return " ".join(f"{command}{{{word}}}" for word in chosen)
+
+
+def _table(rng: random.Random) -> str:
+    rows = " \\\\ ".join(f"{n} & {rng.randint(1, 99)} & {rng.randint(1, 99)}" for n in range(1, 5))
+    return (
+        "\\\\ \\begin{tabular}{|c|c|c|} \\hline $n$ & $a_n$ & $b_n$ \\\\ \\hline "
+        f"{rows} \\\\ \\hline \\end{{tabular}}"
+    )
+
+
+def build_paper(
+    spec: PaperSpec,
+    base: Dict[str, Any],
+    seed: int,
+    image_base_url: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Generate one question paper
+
+    Args:
+        spec: Shape of the paper
+        base: Paper whose header fields are reused (usually q.json)
+        seed: Seed for the generated content
+        image_base_url: Base URL of the image server, required if spec.images
+
+    Returns:
+        Question paper dictionary accepted by /convert
+    """
+    rng = random.Random(seed)
+    paper = copy.deepcopy(base)
+    paper["qp_code"] = f"BENCH {seed:06d}"
+    paper["images"] = None
+
+    total_questions = spec.parts * spec.questions
+    images_per_question = Counter(rng.randrange(total_questions) for _ in range(spec.images))
+
+    parts = []
+    number = 0
+    for part_index in range(spec.parts):
+        content = []
+        for _ in range(spec.questions):
+            script = rng.choice(spec.scripts)
+            question = f"{number + 1}. {_sentence(rng, script, spec.words)}?"
+            if rng.random() < spec.math:
+                question += f" {rng.choice(_FORMULAS)}"
+            if rng.random() < spec.tables:
+                question += f" {_table(rng)}"
+            for image_index in range(images_per_question[number]):
+                image_seed = (seed * total_questions + number) * 100 + image_index
+                url = f"{image_base_url}/img/{image_seed}-{spec.image_width}x{spec.image_height}.png"
+                question += f" \\\\ \\includegraphics[width=0.3\\textwidth]{{{url}}}"
+            content.append(question)
+            number += 1
+        parts.append({
+            "part_name": f"Section {chr(ord('A') + part_index % 26)}",
+            "part_title": "Synthetic",
+            "part_description": "[Answer All]",
+            "content": content,
+            "footer": f"Ceiling Marks: {spec.questions * 2}",
+        })
+    paper["qp_parts"] = parts
+    return paper
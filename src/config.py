@@ -0,0 +1,225 @@
+"""
+Runtime configuration for the LaTeX to PDF converter
+
+All settings are read from environment variables so the same image can be
+tuned per deployment without code changes.
+"""
+
+import os
+import tempfile
+
+
+def _env_int(name: str, default: int) -> int:
+    """
+    Read an integer setting from the environment
+
+    Args:
+        name: Environment variable name
+        default: Value used when the variable is unset or invalid
+
+    Returns:
+        Parsed integer value
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    """
+    Read a float setting from the environment
+
+    Args:
+        name: Environment variable name
+        default: Value used when the variable is unset or invalid
+
+    Returns:
+        Parsed float value
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """
+    Read a boolean setting from the environment
+
+    Args:
+        name: Environment variable name
+        default: Value used when the variable is unset
+
+    Returns:
+        True for 1/true/yes/on, False otherwise
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _env_path(name: str, default: str) -> str:
+    """
+    Read a filesystem path setting from the environment
+
+    Args:
+        name: Environment variable name
+        default: Path used when the variable is unset
+
+    Returns:
+        Absolute path
+    """
+    return os.path.abspath(os.environ.get(name) or default)
+
+
+DATA_DIR = _env_path("LATEXTOPDF_DATA_DIR", os.path.join(tempfile.gettempdir(), "latextopdf"))
+
+CPU_COUNT = os.cpu_count() or 1
+
+# Compile executor
+COMPILE_CONCURRENCY = max(1, _env_int("COMPILE_CONCURRENCY", CPU_COUNT))
+COMPILE_QUEUE_SIZE = max(0, _env_int("COMPILE_QUEUE_SIZE", COMPILE_CONCURRENCY * 4))
+COMPILE_RETRY_AFTER = max(1, _env_int("COMPILE_RETRY_AFTER", 10))
+
+# Question body renderer: "lua" (template reads question.json with dkjson)
+# or "python" (static TeX rendered before the compile)
+RENDER_ENGINE = (os.environ.get("RENDER_ENGINE") or "lua").strip().lower()
+
+# Upper bound on LaTeX passes when cross-references need reruns
+LATEX_MAX_PASSES = max(1, _env_int("LATEX_MAX_PASSES", 3))
+
+# Wall-clock budget of a whole compile, all passes together, scaled with the
+# size of the question text and images between the minimum and maximum
+LATEX_TIMEOUT_MIN = max(1.0, _env_float("LATEX_TIMEOUT_MIN", 30.0))
+LATEX_TIMEOUT_MAX = max(LATEX_TIMEOUT_MIN, _env_float("LATEX_TIMEOUT_MAX", 120.0))
+LATEX_TIMEOUT_PER_TEXT_KB = max(0.0, _env_float("LATEX_TIMEOUT_PER_TEXT_KB", 0.5))
+LATEX_TIMEOUT_PER_IMAGE_MB = max(0.0, _env_float("LATEX_TIMEOUT_PER_IMAGE_MB", 1.0))
+
+# Per-process limits of LuaLaTeX runs (0 disables a limit)
+LATEX_CPU_SECONDS = max(0, _env_int("LATEX_CPU_SECONDS", 90))
+LATEX_MEMORY_MB = max(0, _env_int("LATEX_MEMORY_MB", 4096))
+LATEX_OUTPUT_MB = max(0, _env_int("LATEX_OUTPUT_MB", 256))
+
+# Run LuaLaTeX over documents from requests with --safer: no Lua process or
+# environment access and read-only Lua io
+LATEX_SAFER = _env_bool("LATEX_SAFER", True)
+
+# Load only the languages and fonts of the scripts a paper uses
+SCRIPT_DETECTION_ENABLED = _env_bool("SCRIPT_DETECTION_ENABLED", True)
+
+# Check question text in Python before spawning LuaLaTeX
+LATEX_LINT_ENABLED = _env_bool("LATEX_LINT_ENABLED", True)
+
+# Kill LuaLaTeX at the first fatal error instead of finishing the pass
+LATEX_FAIL_FAST = _env_bool("LATEX_FAIL_FAST", True)
+
+# Reused compile workspaces; point WORKSPACE_DIR at a tmpfs mount to keep
+# compile I/O off the container filesystem
+WORKSPACE_POOL_ENABLED = _env_bool("WORKSPACE_POOL_ENABLED", True)
+WORKSPACE_DIR = _env_path("WORKSPACE_DIR", os.path.join(DATA_DIR, "workspaces"))
+WORKSPACE_POOL_SIZE = max(0, _env_int("WORKSPACE_POOL_SIZE", COMPILE_CONCURRENCY + COMPILE_QUEUE_SIZE))
+WORKSPACE_MAX_MB = max(1, _env_int("WORKSPACE_MAX_MB", 256))
+
+# Warm workspaces of /compile sessions, removed after SESSION_TTL seconds
+# idle and least recently used first beyond SESSION_MAX_MB in total
+SESSION_DIR = _env_path("SESSION_DIR", os.path.join(DATA_DIR, "sessions"))
+SESSION_TTL = max(1.0, _env_float("SESSION_TTL", 900.0))
+SESSION_MAX_MB = max(1, _env_int("SESSION_MAX_MB", 1024))
+
+# Managed output area for compiled PDFs awaiting delivery
+OUTPUT_DIR = _env_path("OUTPUT_DIR", os.path.join(DATA_DIR, "output"))
+
+# Request bodies of /convert, including multipart image uploads
+UPLOAD_DIR = _env_path("UPLOAD_DIR", os.path.join(DATA_DIR, "uploads"))
+UPLOAD_MAX_MB = max(1, _env_int("UPLOAD_MAX_MB", 64))
+UPLOAD_MAX_PART_MB = max(1, _env_int("UPLOAD_MAX_PART_MB", 20))
+UPLOAD_MAX_FILES = max(0, _env_int("UPLOAD_MAX_FILES", 200))
+
+# Prometheus metrics on /metrics (needs prometheus_client)
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", True)
+
+# Debug endpoints such as POST /debug/profile
+DEBUG_ENDPOINTS_ENABLED = _env_bool("DEBUG_ENDPOINTS_ENABLED", False)
+
+# POST /compile for raw LaTeX documents; Lua code in them can still read any
+# file the service user can, so only enable it for trusted clients
+RAW_COMPILE_ENABLED = _env_bool("RAW_COMPILE_ENABLED", False)
+
+# Password protection: auto picks pikepdf, then qpdf, then pdftk
+PDF_ENCRYPTION_BACKEND = (os.environ.get("PDF_ENCRYPTION_BACKEND") or "auto").strip().lower()
+PDF_ENCRYPTION_KEY_BITS = 128 if _env_int("PDF_ENCRYPTION_KEY_BITS", 256) == 128 else 256
+PDF_ENCRYPTION_REQUIRED = _env_bool("PDF_ENCRYPTION_REQUIRED", False)
+
+# Linearize compiled PDFs, pack objects into object streams and share
+# repeated images (in the same pass as encryption for protected PDFs)
+PDF_OPTIMIZE_ENABLED = _env_bool("PDF_OPTIMIZE_ENABLED", False)
+
+# PDF result cache
+PDF_CACHE_ENABLED = _env_bool("PDF_CACHE_ENABLED", True)
+PDF_CACHE_MEMORY_MB = max(0, _env_int("PDF_CACHE_MEMORY_MB", 64))
+PDF_CACHE_MEMORY_ITEM_KB = max(0, _env_int("PDF_CACHE_MEMORY_ITEM_KB", 512))
+PDF_CACHE_DISK_MB = max(0, _env_int("PDF_CACHE_DISK_MB", 1024))
+PDF_CACHE_DIR = _env_path("PDF_CACHE_DIR", os.path.join(DATA_DIR, "pdf-cache"))
+
+# Pre-rendered question fragments (requests with fragment_cache set)
+FRAGMENT_CACHE_ENABLED = _env_bool("FRAGMENT_CACHE_ENABLED", True)
+FRAGMENT_CACHE_DIR = _env_path("FRAGMENT_CACHE_DIR", os.path.join(DATA_DIR, "fragment-cache"))
+FRAGMENT_CACHE_MB = max(1, _env_int("FRAGMENT_CACHE_MB", 512))
+
+# Persistent TEXMFVAR/TEXMFCACHE so luaotfload font databases survive restarts
+TEX_CACHE_DIR = _env_path("TEX_CACHE_DIR", os.path.join(DATA_DIR, "texmf-var"))
+
+# Startup warm-up (font indexing, format build, sample compile)
+WARMUP_ENABLED = _env_bool("WARMUP_ENABLED", True)
+WARMUP_ATTEMPTS = max(1, _env_int("WARMUP_ATTEMPTS", 3))
+WARMUP_RETRY_DELAY = max(0.0, _env_float("WARMUP_RETRY_DELAY", 5.0))
+
+# Precompiled LuaLaTeX format
+TEX_FORMAT_ENABLED = _env_bool("TEX_FORMAT_ENABLED", True)
+TEX_FORMAT_DIR = _env_path("TEX_FORMAT_DIR", os.path.join(DATA_DIR, "formats"))
+
+# Shared HTTP client for image downloads
+HTTP_TIMEOUT = _env_float("HTTP_TIMEOUT", 10.0)
+HTTP_CONNECT_TIMEOUT = _env_float("HTTP_CONNECT_TIMEOUT", 5.0)
+HTTP_RETRIES = max(0, _env_int("HTTP_RETRIES", 2))
+HTTP_MAX_CONNECTIONS = max(1, _env_int("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = max(0, _env_int("HTTP_MAX_KEEPALIVE", 20))
+HTTP_MAX_PER_HOST = max(1, _env_int("HTTP_MAX_PER_HOST", 8))
+HTTP_HTTP2 = _env_bool("HTTP_HTTP2", True)
+HTTP_MAX_DOWNLOAD_MB = max(1, _env_int("HTTP_MAX_DOWNLOAD_MB", 20))
+DOWNLOAD_CONCURRENCY = max(1, _env_int("DOWNLOAD_CONCURRENCY", 32))
+
+# Persistent image cache
+IMAGE_CACHE_ENABLED = _env_bool("IMAGE_CACHE_ENABLED", True)
+IMAGE_CACHE_DIR = _env_path("IMAGE_CACHE_DIR", os.path.join(DATA_DIR, "image-cache"))
+IMAGE_CACHE_MB = max(1, _env_int("IMAGE_CACHE_MB", 2048))
+IMAGE_CACHE_TTL = max(0, _env_int("IMAGE_CACHE_TTL", 3600))
+
+# Image normalization (downscale/recompress/convert before embedding)
+IMAGE_NORMALIZE = _env_bool("IMAGE_NORMALIZE", False)
+IMAGE_NORMALIZE_DPI = max(72, _env_int("IMAGE_NORMALIZE_DPI", 300))
+IMAGE_JPEG_QUALITY = min(95, max(30, _env_int("IMAGE_JPEG_QUALITY", 85)))
+IMAGE_NORMALIZE_WORKERS = max(1, _env_int("IMAGE_NORMALIZE_WORKERS", CPU_COUNT))
+IMAGE_NORMALIZE_CACHE_DIR = _env_path(
+    "IMAGE_NORMALIZE_CACHE_DIR", os.path.join(DATA_DIR, "image-normalized")
+)
+IMAGE_NORMALIZE_CACHE_MB = max(1, _env_int("IMAGE_NORMALIZE_CACHE_MB", 512))
+
+# Asynchronous job API
+JOB_BACKEND = (os.environ.get("JOB_BACKEND") or "sqlite").strip().lower()
+JOB_SQLITE_PATH = _env_path("JOB_SQLITE_PATH", os.path.join(DATA_DIR, "jobs", "jobs.sqlite3"))
+JOB_RESULT_DIR = _env_path("JOB_RESULT_DIR", os.path.join(DATA_DIR, "jobs", "results"))
+JOB_REDIS_URL = os.environ.get("JOB_REDIS_URL") or "redis://localhost:6379/0"
+JOB_RESULT_TTL = max(60, _env_int("JOB_RESULT_TTL", 24 * 3600))
+JOB_STALE_SECONDS = max(60, _env_int("JOB_STALE_SECONDS", 15 * 60))
+JOB_POLL_INTERVAL = max(0.05, _env_float("JOB_POLL_INTERVAL", 0.5))
+JOB_EMBEDDED_WORKERS = max(0, _env_int("JOB_EMBEDDED_WORKERS", COMPILE_CONCURRENCY))
+JOB_WORKER_CONCURRENCY = max(1, _env_int("JOB_WORKER_CONCURRENCY", COMPILE_CONCURRENCY))
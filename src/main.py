@@ -2,19 +2,86 @@
 Main FastAPI application for LaTeX to PDF converter
 """
 
+import asyncio
 import logging
 import subprocess
-from fastapi import FastAPI, HTTPException
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import ValidationError
 
-from .models.schemas import QuestionPaperRequest
-from .services.latex_compiler import compile_question_paper
+from . import config
+from .models.schemas import BatchConvertRequest, LatexRequest, QuestionPaperRequest
+from .services.batch import stream_batch_zip
+from .services.compile_pool import CompilePoolFullError, ResourceLimitError, compile_pool
+from .services.compile_sessions import session_store
+from .services.latex_compiler import compile_latex, compile_question_paper
+from .services.format_cache import format_cache
+from .services.fragment_cache import fragment_cache
+from .services.image_cache import image_cache
+from .services.metrics import (
+    CONTENT_TYPE_LATEST,
+    StageTimings,
+    metrics_available,
+    observe_stage,
+    render_metrics,
+)
+from .services.pdf_cache import pdf_cache
+from .services.pdf_encryption import PdfEncryptionError, pdf_encryptor
+from .services.runtime import compile_runtime
+from .services.tex_log import LatexError
+from .services.uploads import PAPER_FIELD, PaperUpload, UploadError, read_paper_upload, sweep_stale_uploads
+from .services.job_queue import JOB_DONE, get_job_store, with_timings
+from .services.warmup import run_warmup, warmup_state
+from .services.workspace_pool import workspace_pool
+from .worker import start_embedded_workers, stop_embedded_workers
 from .utils.helpers import setup_logging, create_pdf_response
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="LaTeX to PDF Converter", version="1.0.0")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Application lifespan: output area cleanup, compile workspaces and
+    sessions, shared HTTP client and background TeX warm-up; embedded job
+    workers start with the first job and stop here
+    """
+    async with compile_runtime():
+        await asyncio.to_thread(sweep_stale_uploads)
+        await asyncio.to_thread(session_store.start)
+        warmup_task = asyncio.create_task(run_warmup())
+        session_task = asyncio.create_task(session_store.run())
+        yield
+        for task in [warmup_task, session_task]:
+            if not task.done():
+                task.cancel()
+        stop_embedded_workers()
+        await asyncio.to_thread(session_store.stop)
+
+
+class RequestStartMiddleware:
+    """
+    Stamp the arrival time of each request, so handlers can report how long
+    reading and validating the body took
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["request_start"] = time.perf_counter()
+        await self.app(scope, receive, send)
+
+
+app = FastAPI(title="LaTeX to PDF Converter", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,6 +91,7 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"]
 )
+app.add_middleware(RequestStartMiddleware)
 
 
 @app.get("/")
@@ -32,7 +100,10 @@ async def root():
     logger.info("Root endpoint accessed")
     return {
         "message": "LaTeX to PDF Converter API",
-        "endpoints": ["/convert", "/health"]
+        "endpoints": [
+            "/convert", "/convert/batch", *(["/compile"] if config.RAW_COMPILE_ENABLED else []),
+            "/jobs", "/health", "/ready", "/metrics",
+        ]
     }
 
 
@@ -40,28 +111,126 @@ async def root():
 async def health_check():
     """Health check endpoint"""
     logger.info("Health check endpoint accessed")
-    return {"status": "healthy"}
+    return {
+        # Protected papers cannot be produced without an encryption backend
+        "status": "healthy" if pdf_encryptor.available else "degraded",
+        "compile_pool": compile_pool.stats(),
+        "pdf_cache": pdf_cache.stats(),
+        "image_cache": image_cache.stats(),
+        "fragment_cache": fragment_cache.stats(),
+        "workspace_pool": workspace_pool.stats(),
+        "compile_sessions": session_store.stats(),
+        "tex_format": format_cache.stats(),
+        "pdf_encryption": pdf_encryptor.stats(),
+        "warmup": warmup_state.to_dict(),
+    }
+
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint: 200 once warm-up has finished, 503 before"""
+    state = warmup_state.to_dict()
+    if not warmup_state.ready:
+        return JSONResponse(status_code=503, content=state)
+    return state
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage histograms, PDF sizes, failures, pool and cache state"""
+    if not metrics_available():
+        raise HTTPException(status_code=503, detail="Metrics are disabled or prometheus_client is not installed")
+    body = await asyncio.to_thread(render_metrics)
+    return Response(content=body, media_type=CONTENT_TYPE_LATEST)
+
+
+# The body is read by the handler (JSON or multipart), so it is described here
+CONVERT_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"$ref": "#/components/schemas/QuestionPaperRequest"}},
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": [PAPER_FIELD],
+                    "properties": {
+                        PAPER_FIELD: {"type": "string", "description": "QuestionPaperRequest as JSON"},
+                        "images": {
+                            "type": "array",
+                            "items": {"type": "string", "format": "binary"},
+                            "description": "Image files, referenced by file name",
+                        },
+                    },
+                }
+            },
+        },
+    }
+}
+
+
+async def read_convert_request(http_request: Request) -> Tuple[QuestionPaperRequest, PaperUpload]:
+    """
+    Read and validate a /convert body, streaming uploaded images to disk
+    """
+    try:
+        upload = await read_paper_upload(
+            http_request.headers.get("content-type"),
+            http_request.headers.get("content-length"),
+            http_request.stream(),
+        )
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    try:
+        request = QuestionPaperRequest.model_validate_json(upload.body)
+    except ValidationError as e:
+        upload.cleanup()
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()])
+    if upload.images:
+        request.images = {**(request.images or {}), **{name: str(path) for name, path in upload.images.items()}}
+    return request, upload
 
 
-@app.post("/convert")
-async def convert_question_paper(request: QuestionPaperRequest):
+@app.post("/convert", openapi_extra=CONVERT_REQUEST_BODY)
+async def convert_question_paper(
+    http_request: Request,
+    if_none_match: Optional[str] = Header(None),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None)
+):
     """
     Convert question paper data to PDF
     
+    The paper is sent as a JSON body, or as multipart/form-data with the
+    JSON in a "paper" part and images as file parts.
+    
     Args:
-        request: QuestionPaperRequest containing paper data
+        http_request: Raw request, read as JSON or multipart
+        if_none_match: ETag from a previous response; answered with 304 if unchanged
+        range_header: Byte range to return (single range only)
+        if_range: ETag the range request is conditional on
         
     Returns:
         PDF file as streaming response
         
     Raises:
-        HTTPException: If compilation fails or times out
+        HTTPException: If the body is rejected, or compilation fails or times out
     """
+    request, upload = await read_convert_request(http_request)
     logger.info(f"Received PDF conversion request for: {request.qp_code}")
+    timings = StageTimings()
+    timings.add("parse", time.perf_counter() - http_request.state.request_start)
     
     try:
         question_data = request.model_dump()
-        pdf_bytes = await compile_question_paper(question_data)
+        # The ETag is the cache key, so a match is found before compiling
+        known_etags = {tag.strip().strip('"') for tag in if_none_match.split(",")} if if_none_match else None
+        result = await compile_question_paper(question_data, timings=timings, known_etags=known_etags)
+        etag = f'"{result.etag}"'
+        
+        if result.not_modified:
+            logger.info(f"PDF unchanged for {request.qp_code}, returning 304")
+            return Response(status_code=304, headers={"ETag": etag})
         
         filename = f"{request.qp_code}.pdf"
         if request.password:
@@ -69,17 +238,265 @@ async def convert_question_paper(request: QuestionPaperRequest):
         
         logger.info(f"Successfully generated PDF: {filename}")
         
-        return create_pdf_response(pdf_bytes, filename)
+        response_start = time.perf_counter()
+        
+        def on_close() -> None:
+            result.release()
+            observe_stage("response", time.perf_counter() - response_start)
+        
+        return create_pdf_response(
+            result.pdf,
+            filename,
+            headers={
+                "ETag": etag,
+                "X-Cache": "HIT" if result.cache_hit else "MISS",
+                "X-LaTeX-Passes": str(result.passes),
+                "X-Script-Set": result.script_set,
+                "Server-Timing": timings.server_timing(),
+            },
+            range_header=range_header,
+            if_range=if_range,
+            on_close=on_close
+        )
+    
+    except CompilePoolFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    except PdfEncryptionError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    except LatexError as e:
+        raise HTTPException(status_code=422, detail={"message": str(e), "stage": e.stage, "errors": e.errors})
+    
+    except ResourceLimitError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     
     except RuntimeError as e:
         raise HTTPException(status_code=422, detail=str(e))
     
-    except subprocess.TimeoutExpired:
-        raise HTTPException(status_code=408, detail="Compilation timed out")
+    except subprocess.TimeoutExpired as e:
+        raise HTTPException(status_code=408, detail=f"Compilation timed out after {e.timeout:.0f}s")
     
     except Exception as e:
         logger.error(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    finally:
+        # The images were linked into the compile workspace, which is gone too
+        upload.cleanup()
+
+
+@app.post("/compile")
+async def compile_latex_document(
+    request: LatexRequest,
+    http_request: Request,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Compile a raw LaTeX document to PDF
+    
+    With a session_id, the document is compiled in a workspace kept for that
+    session: the auxiliary files of the previous request are reused, so only
+    the passes the change needs are run, and none for an unchanged document.
+    
+    Args:
+        request: LatexRequest with the source, engine and optional session id
+        http_request: Raw request, for the parse time
+        if_none_match: ETag from a previous response; answered with 304 if unchanged
+        
+    Returns:
+        PDF file as streaming response
+        
+    Raises:
+        HTTPException: 404 unless RAW_COMPILE_ENABLED is set, or if
+            compilation fails or times out
+    """
+    if not config.RAW_COMPILE_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    timings = StageTimings()
+    timings.add("parse", time.perf_counter() - http_request.state.request_start)
+    
+    try:
+        result = await compile_latex(request.latex, request.engine, request.session_id, timings)
+    except CompilePoolFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except subprocess.TimeoutExpired as e:
+        raise HTTPException(status_code=408, detail=f"Compilation timed out after {e.timeout:.0f}s")
+    except LatexError as e:
+        raise HTTPException(status_code=422, detail={"message": str(e), "stage": e.stage, "errors": e.errors})
+    except ResourceLimitError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except (RuntimeError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    etag = f'"{result.etag}"'
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        result.release()
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    headers = {
+        "ETag": etag,
+        "X-LaTeX-Passes": str(result.passes),
+        "Server-Timing": timings.server_timing(),
+    }
+    if request.session_id:
+        headers["X-Session-Id"] = request.session_id
+    return create_pdf_response(result.pdf, "document.pdf", headers=headers, on_close=result.release)
+
+
+@app.post("/debug/profile")
+async def profile_question_paper(request: QuestionPaperRequest):
+    """
+    Compile a question paper with LuaTeX profiling and return the report
+    
+    The report lists the CPU and wall time of every part and question as
+    typeset by LuaTeX, the slowest questions, loaded fonts, memory statistics
+    and the files recorded by -recorder. The PDF itself is discarded.
+    
+    Args:
+        request: QuestionPaperRequest containing paper data
+        
+    Returns:
+        Profiling report with stage timings
+        
+    Raises:
+        HTTPException: 404 unless DEBUG_ENDPOINTS_ENABLED is set, or if
+            compilation fails
+    """
+    if not config.DEBUG_ENDPOINTS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    logger.info(f"Received profiling request for: {request.qp_code}")
+    
+    try:
+        result = await compile_question_paper(request.model_dump(), profile=True)
+    except CompilePoolFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except subprocess.TimeoutExpired as e:
+        raise HTTPException(status_code=408, detail=f"Compilation timed out after {e.timeout:.0f}s")
+    except LatexError as e:
+        raise HTTPException(status_code=422, detail={"message": str(e), "stage": e.stage, "errors": e.errors})
+    except ResourceLimitError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    try:
+        return {
+            "qp_code": request.qp_code,
+            "passes": result.passes,
+            "scripts": result.script_set,
+            "pdf_bytes": result.size,
+            "stages": {name: round(seconds, 4) for name, seconds in result.timings.stages.items()},
+            "profile": result.profile,
+        }
+    finally:
+        result.release()
+
+
+@app.post("/convert/batch")
+async def convert_question_paper_batch(request: BatchConvertRequest):
+    """
+    Convert many question papers in parallel into a ZIP archive
+    
+    PDFs are streamed into the archive as they finish; a manifest.json entry
+    at the end lists the status, file name and timing of every paper.
+    
+    Args:
+        request: BatchConvertRequest containing the papers
+        
+    Returns:
+        ZIP archive as streaming response
+    """
+    logger.info(f"Received batch conversion request for {len(request.papers)} papers")
+    papers = [paper.model_dump() for paper in request.papers]
+    
+    return StreamingResponse(
+        stream_batch_zip(papers),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=batch.zip"}
+    )
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: QuestionPaperRequest):
+    """
+    Queue a question paper for asynchronous compilation
+    
+    Args:
+        request: QuestionPaperRequest containing paper data
+        
+    Returns:
+        Job record with its id and status URLs
+    """
+    store = get_job_store()
+    job = await asyncio.to_thread(store.enqueue, request.model_dump())
+    start_embedded_workers()
+    logger.info(f"Queued job {job['id']} for: {request.qp_code}")
+    return {
+        **with_timings(job),
+        "status_url": f"/jobs/{job['id']}",
+        "pdf_url": f"/jobs/{job['id']}/pdf",
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Report the status and timings of a job
+    
+    Raises:
+        HTTPException: If the job does not exist
+    """
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return with_timings(job)
+
+
+@app.get("/jobs/{job_id}/pdf")
+async def get_job_pdf(
+    job_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None)
+):
+    """
+    Download the PDF of a finished job
+    
+    Raises:
+        HTTPException: 404 if the job does not exist, 409 if it is not done
+    """
+    store = get_job_store()
+    job = await asyncio.to_thread(store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != JOB_DONE:
+        detail = f"Job is {job['status']}"
+        if job.get("error"):
+            detail = f"{detail}: {job['error']}"
+        raise HTTPException(status_code=409, detail=detail)
+    
+    pdf = await asyncio.to_thread(store.get_result, job_id)
+    if pdf is None:
+        raise HTTPException(status_code=404, detail="Job result expired")
+    
+    filename = f"{job['qp_code']}.pdf"
+    if job.get("password"):
+        filename = f"{job['qp_code']}_protected.pdf"
+    return create_pdf_response(
+        pdf, filename, headers={"ETag": f'"{job_id}"'}, range_header=range_header, if_range=if_range
+    )
 
 
 if __name__ == "__main__":
@@ -2,6 +2,6 @@
 Data models and schemas for the LaTeX to PDF converter
 """
 
-from .schemas import LatexRequest, QuestionPart, QuestionPaperRequest
+from .schemas import BatchConvertRequest, LatexRequest, QuestionPart, QuestionPaperRequest
 
-__all__ = ["LatexRequest", "QuestionPart", "QuestionPaperRequest"]
+__all__ = ["BatchConvertRequest", "LatexRequest", "QuestionPart", "QuestionPaperRequest"]
@@ -2,7 +2,7 @@
 Pydantic models and data schemas for the LaTeX to PDF converter
 """
 
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
@@ -10,6 +10,15 @@ from datetime import datetime
 class LatexRequest(BaseModel):
     latex: str
     engine: str = "pdflatex"
+    # Recompile in the warm workspace kept for this id (editor tooling)
+    session_id: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_-]{1,64}$")
+    
+    @field_validator('engine')
+    @classmethod
+    def validate_engine(cls, v):
+        if v not in ("pdflatex", "lualatex", "xelatex"):
+            raise ValueError("engine must be one of pdflatex, lualatex, xelatex")
+        return v
 
 
 class QuestionPart(BaseModel):
@@ -31,6 +40,8 @@ class QuestionPaperRequest(BaseModel):
     qp_parts: List[QuestionPart]
     images: Optional[Dict[str, str]] = None
     password: Optional[bool] = False
+    # Assemble the paper from cached pre-rendered questions (question banks)
+    fragment_cache: Optional[bool] = False
     
     @field_validator('password', mode='before')
     @classmethod
@@ -38,3 +49,7 @@ class QuestionPaperRequest(BaseModel):
         if v is True:
             return True
         return False
+
+
+class BatchConvertRequest(BaseModel):
+    papers: List[QuestionPaperRequest] = Field(..., min_length=1, max_length=1000)
@@ -2,7 +2,20 @@
 Service layer for LaTeX compilation and image processing
 """
 
-from .latex_compiler import compile_latex, compile_question_paper
-from .image_processor import extract_and_download_urls
+from .compile_pool import CompilePoolFullError, compile_pool
+from .latex_compiler import CompileResult, compile_latex, compile_question_paper
+from .pdf_cache import pdf_cache
+from .image_processor import extract_and_download_urls, prefetch_document_assets
+from .tex_log import LatexError
 
-__all__ = ["compile_latex", "compile_question_paper", "extract_and_download_urls"]
+__all__ = [
+    "CompilePoolFullError",
+    "compile_pool",
+    "CompileResult",
+    "compile_latex",
+    "compile_question_paper",
+    "extract_and_download_urls",
+    "LatexError",
+    "pdf_cache",
+    "prefetch_document_assets",
+]
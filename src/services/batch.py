@@ -0,0 +1,201 @@
+"""
+Batch compilation of many question papers into a streamed ZIP archive
+
+All image URLs of the session are prefetched once into the image cache, the
+papers are compiled in parallel up to the compile pool size, and each PDF is
+appended to the archive as soon as it finishes. A manifest with the status
+of every item closes the archive.
+"""
+
+import asyncio
+import json
+import logging
+import pathlib
+import re
+import subprocess
+import time
+import zipfile
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .compile_pool import CompilePoolFullError, compile_pool
+from .image_cache import image_cache
+from .image_processor import collect_image_urls
+from .latex_compiler import compile_question_paper
+
+logger = logging.getLogger(__name__)
+
+# PDFs are copied into the archive in chunks of this size, off the event loop
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+
+# Longest an item waits in total for room in a full compile pool before it
+# is marked failed
+MAX_POOL_WAIT = 120.0
+
+
+class _ZipBuffer:
+    """
+    Write-only file object that hands written bytes to the response stream
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _entry_name(index: int, paper: Dict[str, Any]) -> str:
+    qp_code = re.sub(r"[^A-Za-z0-9._-]+", "_", str(paper.get("qp_code", "paper"))).strip("_")
+    suffix = "_protected" if paper.get("password") else ""
+    return f"{index + 1:04d}_{qp_code or 'paper'}{suffix}.pdf"
+
+
+async def _write_file(
+    archive: zipfile.ZipFile, buffer: _ZipBuffer, path: pathlib.Path, name: str
+) -> AsyncIterator[bytes]:
+    """
+    Copy a PDF file into the archive chunk by chunk in a worker thread,
+    yielding the archive bytes produced so far after every chunk
+    """
+    info = zipfile.ZipInfo.from_file(path, name)
+    info.compress_type = zipfile.ZIP_STORED
+    with open(path, "rb") as source, archive.open(info, mode="w") as entry:
+        def copy_chunk() -> int:
+            chunk = source.read(ARCHIVE_CHUNK_SIZE)
+            entry.write(chunk)
+            return len(chunk)
+
+        while await asyncio.to_thread(copy_chunk):
+            chunk = buffer.drain()
+            if chunk:
+                yield chunk
+
+
+async def prefetch_batch_images(papers: List[Dict[str, Any]]) -> None:
+    """
+    Download every distinct image URL of the batch once into the image cache
+
+    Args:
+        papers: Question paper dictionaries
+    """
+    if not image_cache.enabled:
+        return
+
+    contents = [
+        content
+        for paper in papers
+        for part in paper.get("qp_parts") or []
+        for content in part.get("content", [])
+    ]
+    urls = dict.fromkeys(collect_image_urls(contents))
+    for paper in papers:
+        for source in (paper.get("images") or {}).values():
+            if source.startswith("http://") or source.startswith("https://"):
+                urls[source] = None
+
+    if urls:
+        logger.info(f"Prefetching {len(urls)} unique image URLs for batch")
+        await asyncio.gather(*(image_cache.get(url) for url in urls), return_exceptions=True)
+
+
+async def _compile_item(index: int, paper: Dict[str, Any], limiter: asyncio.Semaphore) -> Dict[str, Any]:
+    item: Dict[str, Any] = {"index": index, "qp_code": paper.get("qp_code")}
+    start = time.perf_counter()
+    waited = 0.0
+    async with limiter:
+        while True:
+            try:
+                result = await compile_question_paper(paper)
+                item.update(status="done", file=_entry_name(index, paper), result=result)
+                break
+            except CompilePoolFullError as e:
+                # Other traffic filled the queue; batch items wait instead of
+                # failing, but not forever
+                if waited + e.retry_after > MAX_POOL_WAIT:
+                    logger.warning(f"Batch item {index} ({paper.get('qp_code')}) gave up on a full compile pool")
+                    item.update(status="failed", error=f"Compile pool full for {waited:.0f}s")
+                    break
+                await asyncio.sleep(e.retry_after)
+                waited += e.retry_after
+            except subprocess.TimeoutExpired:
+                item.update(status="failed", error="Compilation timed out")
+                break
+            except Exception as e:
+                logger.warning(f"Batch item {index} ({paper.get('qp_code')}) failed: {e}")
+                item.update(status="failed", error=str(e)[:2000])
+                break
+    item["seconds"] = round(time.perf_counter() - start, 3)
+    return item
+
+
+async def stream_batch_zip(papers: List[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """
+    Compile papers in parallel and stream a ZIP archive as PDFs complete
+
+    Args:
+        papers: Question paper dictionaries
+
+    Yields:
+        Chunks of the ZIP archive
+    """
+    batch_start = time.perf_counter()
+    await prefetch_batch_images(papers)
+
+    # Never have more items in flight than the pool can run at once
+    limiter = asyncio.Semaphore(compile_pool.concurrency)
+    tasks = [asyncio.create_task(_compile_item(i, paper, limiter)) for i, paper in enumerate(papers)]
+
+    buffer = _ZipBuffer()
+    manifest: List[Optional[Dict[str, Any]]] = [None] * len(papers)
+    try:
+        with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            for finished in asyncio.as_completed(tasks):
+                item = await finished
+                result = item.pop("result", None)
+                if result is not None:
+                    try:
+                        if result.pdf_bytes is not None:
+                            archive.writestr(item["file"], result.pdf_bytes)
+                        else:
+                            async for chunk in _write_file(archive, buffer, result.pdf_path, item["file"]):
+                                yield chunk
+                    finally:
+                        result.release()
+                manifest[item["index"]] = item
+                chunk = buffer.drain()
+                if chunk:
+                    yield chunk
+
+            summary = {
+                "total": len(papers),
+                "done": sum(1 for item in manifest if item and item["status"] == "done"),
+                "failed": sum(1 for item in manifest if item and item["status"] != "done"),
+                "seconds": round(time.perf_counter() - batch_start, 3),
+                "items": manifest,
+            }
+            archive.writestr("manifest.json", json.dumps(summary, ensure_ascii=False, indent=2))
+        yield buffer.drain()
+        logger.info(f"Batch finished: {summary['done']}/{summary['total']} papers in {summary['seconds']}s")
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None:
+                # Results the client never received still own output files
+                result = task.result().pop("result", None)
+                if result is not None:
+                    result.release()
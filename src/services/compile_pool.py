@@ -0,0 +1,413 @@
+"""
+Bounded compile executor for running LaTeX toolchain processes
+
+LuaLaTeX runs are CPU bound and take seconds, so they are spawned as asyncio
+subprocesses (never blocking the event loop) and gated by a pool with a fixed
+number of concurrent slots and a bounded wait queue.
+"""
+
+import asyncio
+import logging
+import os
+import pathlib
+import re
+import signal
+import subprocess
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+# How allocation failures under RLIMIT_AS show up in LuaTeX and kpathsea output
+MEMORY_PATTERN = re.compile(r"memory exhausted|not enough memory|out of memory|Cannot allocate memory")
+
+
+class CompilePoolFullError(RuntimeError):
+    """Raised when the compile queue is full and a request must be rejected"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Compile queue is full, retry later")
+        self.retry_after = retry_after
+
+
+@dataclass
+class ResourceLimits:
+    """
+    Per-process limits of a toolchain run; 0 disables a limit
+    """
+    cpu_seconds: int = 0
+    memory_bytes: int = 0
+    output_bytes: int = 0
+
+
+class ResourceLimitError(RuntimeError):
+    """Raised when a process is killed for exceeding one of its resource limits"""
+
+    # Response status per limit: CPU time is a timeout, the others a too large document
+    STATUS_CODES = {"cpu": 408, "memory": 413, "output": 413}
+
+    def __init__(self, limit: str, limits: ResourceLimits):
+        values = {
+            "cpu": f"{limits.cpu_seconds}s of CPU time",
+            "memory": f"{limits.memory_bytes // (1024 * 1024)} MB of memory",
+            "output": f"{limits.output_bytes // (1024 * 1024)} MB of output",
+        }
+        super().__init__(f"Compilation exceeded its limit of {values[limit]}")
+        self.limit = limit
+        self.status_code = self.STATUS_CODES[limit]
+
+
+class PoolReservation:
+    """
+    Place in the compile queue held by a request that is still preparing
+    """
+
+    def __init__(self):
+        self.held = True
+
+
+class CompilePool:
+    """
+    Limits concurrent compiles and rejects work once the wait queue is full
+
+    Requests holding a reservation count towards the queue while they fetch
+    images and build their source, so a full instance rejects them up front.
+    """
+
+    def __init__(self, concurrency: int, queue_size: int, retry_after: int):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.waiting = 0
+        self.reserved = 0
+        self.kills: Dict[str, int] = {}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so the semaphore binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def _check_full(self) -> None:
+        if self.active >= self.concurrency and self.waiting + self.reserved >= self.queue_size:
+            logger.warning(
+                f"Compile queue full ({self.active} active, {self.waiting} waiting, "
+                f"{self.reserved} reserved), rejecting request"
+            )
+            raise CompilePoolFullError(self.retry_after)
+
+    def _drop(self, reservation: PoolReservation) -> None:
+        if reservation.held:
+            reservation.held = False
+            self.reserved -= 1
+
+    @asynccontextmanager
+    async def reserve(self):
+        """
+        Hold a place in the queue while a request prepares its compile
+
+        Pass the reservation to slot() to wait for a slot in its place; it
+        is given back on exit if unused (cache hits, early errors).
+
+        Raises:
+            CompilePoolFullError: If all slots are busy and the queue is full
+        """
+        self._check_full()
+        reservation = PoolReservation()
+        self.reserved += 1
+        try:
+            yield reservation
+        finally:
+            self._drop(reservation)
+
+    @asynccontextmanager
+    async def slot(self, reservation: Optional[PoolReservation] = None):
+        """
+        Acquire a compile slot, waiting in the bounded queue if necessary
+
+        Args:
+            reservation: Place taken earlier with reserve(); skips the
+                queue check
+
+        Raises:
+            CompilePoolFullError: If all slots are busy and the queue is full
+        """
+        semaphore = self._get_semaphore()
+        if reservation is not None and reservation.held:
+            self._drop(reservation)
+        else:
+            self._check_full()
+
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            semaphore.release()
+
+    def record_kill(self, reason: str) -> None:
+        """
+        Count a process killed by run_command (timeout, cpu, memory, output
+        or fatal_error)
+        """
+        self.kills[reason] = self.kills.get(reason, 0) + 1
+
+    def stats(self) -> dict:
+        """
+        Return current pool utilisation
+        """
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "reserved": self.reserved,
+            "kills": dict(self.kills),
+        }
+
+
+compile_pool = CompilePool(
+    concurrency=config.COMPILE_CONCURRENCY,
+    queue_size=config.COMPILE_QUEUE_SIZE,
+    retry_after=config.COMPILE_RETRY_AFTER,
+)
+
+
+async def run_command(
+    cmd: List[str],
+    cwd: Union[str, pathlib.Path, None] = None,
+    timeout: float = 60,
+    env: Optional[Dict[str, str]] = None,
+    on_output: Optional[Callable[[str], bool]] = None,
+    limits: Optional[ResourceLimits] = None,
+) -> Tuple[int, str, str]:
+    """
+    Run an external command without blocking the event loop
+
+    The command runs in a process group of its own, which is killed as a
+    whole on timeout, cancellation or when on_output asks for it.
+
+    Args:
+        cmd: Command and arguments
+        cwd: Working directory for the process
+        timeout: Seconds before the process is killed
+        env: Environment for the process (defaults to the current one)
+        on_output: Called with every stdout line as it is printed; returning
+            True kills the process (e.g. at the first fatal TeX error)
+        limits: CPU time, memory and output limits of the process
+
+    Returns:
+        Tuple of (return code, stdout, stderr)
+
+    Raises:
+        FileNotFoundError: If the executable does not exist
+        subprocess.TimeoutExpired: If the process exceeds the timeout
+        ResourceLimitError: If the process exceeds one of the limits
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=str(cwd) if cwd is not None else None,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+        start_new_session=True,
+    )
+    if limits is not None:
+        _apply_limits(proc.pid, limits)
+    max_output = limits.output_bytes if limits is not None else 0
+    try:
+        if on_output is None and not max_output:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+            killed = None
+        else:
+            stdout, stderr, killed = await asyncio.wait_for(
+                _stream_output(proc, on_output, max_output), timeout=timeout
+            )
+            if killed is not None:
+                # Reaps the killed process; its pipes are left alone
+                await proc.wait()
+    except asyncio.TimeoutError:
+        logger.error(f"Command timed out after {timeout:.0f}s: {cmd[0]}")
+        _kill(proc)
+        compile_pool.record_kill("timeout")
+        await proc.wait()
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    except asyncio.CancelledError:
+        _kill(proc)
+        await proc.wait()
+        raise
+
+    # None right after the process was killed for its output
+    returncode = proc.returncode if proc.returncode is not None else -signal.SIGKILL
+    stdout = stdout.decode("utf-8", errors="replace")
+    stderr = stderr.decode("utf-8", errors="replace")
+    if killed is not None:
+        compile_pool.record_kill(killed)
+        limit = killed if killed == "output" else None
+    else:
+        limit = _exceeded_limit(returncode, stdout, stderr, limits)
+        if limit is not None:
+            compile_pool.record_kill(limit)
+    if limit is not None:
+        logger.error(f"Command exceeded its {limit} limit: {cmd[0]}")
+        raise ResourceLimitError(limit, limits)
+    return returncode, stdout, stderr
+
+
+async def _stream_output(
+    proc: asyncio.subprocess.Process,
+    on_output: Optional[Callable[[str], bool]],
+    max_bytes: int
+) -> Tuple[bytes, bytes, Optional[str]]:
+    """
+    Read stdout line by line until EOF, killing the process when asked to
+    or once it printed more than max_bytes (unless 0)
+
+    Returns:
+        Tuple of (stdout, stderr, kill reason or None)
+    """
+    stderr_task = asyncio.ensure_future(proc.stderr.read())
+    lines = []
+    received = 0
+    try:
+        async for line in proc.stdout:
+            lines.append(line)
+            received += len(line)
+            if max_bytes and received > max_bytes:
+                killed = "output"
+            elif on_output is not None and on_output(line.decode("utf-8", errors="replace").rstrip("\r\n")):
+                killed = "fatal_error"
+            else:
+                continue
+            _kill(proc)
+            # Not waiting for the pipes to close: a child that left the
+            # process group may hold them open
+            return b"".join(lines), b"", killed
+        await proc.wait()
+        return b"".join(lines), await stderr_task, None
+    finally:
+        stderr_task.cancel()
+
+
+def _kill(proc: asyncio.subprocess.Process) -> None:
+    """
+    Kill a process started by run_command together with its children
+    """
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+def _apply_limits(pid: int, limits: ResourceLimits) -> None:
+    """
+    Set the resource limits of a freshly started process
+
+    Applied with prlimit right after the spawn rather than in preexec_fn,
+    which is unsafe in a threaded server; the first milliseconds of the
+    process run unlimited.
+    """
+    if resource is None or not hasattr(resource, "prlimit"):
+        return
+    settings = []
+    if limits.cpu_seconds:
+        # SIGXCPU at the soft limit, SIGKILL a second later if it is ignored
+        settings.append((resource.RLIMIT_CPU, (limits.cpu_seconds, limits.cpu_seconds + 1)))
+    if limits.memory_bytes:
+        settings.append((resource.RLIMIT_AS, (limits.memory_bytes, limits.memory_bytes)))
+    if limits.output_bytes:
+        settings.append((resource.RLIMIT_FSIZE, (limits.output_bytes, limits.output_bytes)))
+    for limit, values in settings:
+        try:
+            resource.prlimit(pid, limit, values)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not set resource limit {limit} on process {pid}: {e}")
+
+
+def _exceeded_limit(
+    returncode: int,
+    stdout: str,
+    stderr: str,
+    limits: Optional[ResourceLimits]
+) -> Optional[str]:
+    """
+    Tell from how a process ended whether it hit one of its limits
+    """
+    if limits is None or returncode == 0:
+        return None
+    if limits.cpu_seconds and returncode == -signal.SIGXCPU:
+        return "cpu"
+    if limits.output_bytes and returncode == -signal.SIGXFSZ:
+        return "output"
+    if limits.memory_bytes and (MEMORY_PATTERN.search(stdout) or MEMORY_PATTERN.search(stderr)):
+        return "memory"
+    return None
+
+
+def tex_environment() -> Dict[str, str]:
+    """
+    Return the process environment for TeX toolchain runs
+
+    TEXMFVAR/TEXMFCACHE point at a persistent shared directory so the
+    luaotfload font database and font caches are built once, not per job.
+    The format directory is searched first for precompiled formats.
+    """
+    env = os.environ.copy()
+    env["TEXMFVAR"] = config.TEX_CACHE_DIR
+    env["TEXMFCACHE"] = config.TEX_CACHE_DIR
+    # The trailing separator keeps the default TeX Live search path
+    env["TEXFORMATS"] = f"{config.TEX_FORMAT_DIR}{os.pathsep}{env.get('TEXFORMATS', '')}"
+    # Unwrapped log lines and wide error context for services/tex_log.py
+    env.setdefault("max_print_line", "10000")
+    env.setdefault("error_line", "254")
+    env.setdefault("half_error_line", "238")
+    # TeX may only open files below the workspace: no absolute paths, parent
+    # directories or dot files for \input, \openin and \openout
+    env["openin_any"] = "p"
+    env["openout_any"] = "p"
+    return env
+
+
+def tex_restrictions(engine: str = "lualatex") -> List[str]:
+    """
+    Return the engine options for runs of documents from requests
+
+    Shell escape is always off. For LuaLaTeX, --safer also removes Lua's
+    process and environment functions and makes its io read-only; Lua code
+    can still read files, which openin_any does not cover.
+    """
+    options = ["-no-shell-escape"]
+    if engine == "lualatex" and config.LATEX_SAFER:
+        options.append("--safer")
+    return options
+
+
+def tex_limits() -> ResourceLimits:
+    """
+    Return the per-process resource limits for LuaLaTeX runs
+    """
+    return ResourceLimits(
+        cpu_seconds=config.LATEX_CPU_SECONDS,
+        memory_bytes=config.LATEX_MEMORY_MB * 1024 * 1024,
+        output_bytes=config.LATEX_OUTPUT_MB * 1024 * 1024,
+    )
@@ -0,0 +1,190 @@
+"""
+Warm compile sessions for the raw LaTeX path
+
+Editor tooling recompiles the same document after every pause in typing.
+A request with a session_id compiles in a workspace kept for that session,
+so the .aux, .toc and other files of the previous compile are in place:
+a document whose cross-references did not change needs a single pass, and
+an unchanged document none. Sessions expire after SESSION_TTL seconds
+idle, and the least recently used idle sessions are removed while all of
+them together hold more than SESSION_MAX_MB.
+"""
+
+import asyncio
+import logging
+import pathlib
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import IO, AsyncIterator, Dict, Optional
+
+from .. import config
+from .workspace_pool import clear_directory, create_process_dir, directory_usage, sweep_stale_workspaces
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CompileSession:
+    """
+    Workspace and state of one session
+    """
+    session_id: str
+    workdir: pathlib.Path
+    engine: Optional[str] = None
+    size: int = 0
+    compiles: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    # Requests holding or waiting for the lock
+    users: int = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def reset(self) -> None:
+        """
+        Empty the workspace, e.g. when the session switches engines
+        """
+        clear_directory(self.workdir)
+        self.engine = None
+
+
+class SessionStore:
+    """
+    Compile sessions by id, with idle expiry and a total size bound
+    """
+
+    def __init__(self, root: str, ttl: float, max_bytes: int):
+        self.root = pathlib.Path(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions: Dict[str, CompileSession] = {}
+        self._dir: Optional[pathlib.Path] = None
+        self._lock: Optional[IO] = None
+        self.created = 0
+        self.reused = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _process_dir(self) -> pathlib.Path:
+        if self._dir is None:
+            self._dir, self._lock = create_process_dir(self.root)
+        return self._dir
+
+    async def _remove(self, session: CompileSession) -> None:
+        # Unregistered first, so no request picks the session up while it is deleted
+        self._sessions.pop(session.session_id, None)
+        await asyncio.to_thread(shutil.rmtree, session.workdir, ignore_errors=True)
+
+    def _idle(self):
+        # Sessions not compiling right now, least recently used first
+        return sorted(
+            (session for session in self._sessions.values() if not session.users),
+            key=lambda session: session.last_used,
+        )
+
+    async def expire(self) -> None:
+        """
+        Remove sessions idle for longer than the TTL
+        """
+        cutoff = time.monotonic() - self.ttl
+        for session in self._idle():
+            if session.last_used >= cutoff:
+                break
+            if session.users or self._sessions.get(session.session_id) is not session:
+                continue
+            await self._remove(session)
+            self.expired += 1
+            logger.info(f"Compile session {session.session_id} expired")
+
+    async def _enforce_limit(self) -> None:
+        total = sum(session.size for session in self._sessions.values())
+        for session in self._idle():
+            if total <= self.max_bytes:
+                break
+            if session.users or self._sessions.get(session.session_id) is not session:
+                continue
+            await self._remove(session)
+            total -= session.size
+            self.evicted += 1
+            logger.info(f"Compile session {session.session_id} evicted, sessions hold {total} bytes")
+
+    @asynccontextmanager
+    async def session(self, session_id: str) -> AsyncIterator[CompileSession]:
+        """
+        Hold a session's workspace for one compile, creating it if needed
+
+        Compiles of the same session run one after another.
+        """
+        await self.expire()
+        session = self._sessions.get(session_id)
+        if session is None:
+            # Unique per session, as a removed session's files may still be deleted
+            workdir = self._process_dir() / f"{session_id}.{uuid.uuid4().hex[:8]}"
+            session = self._sessions[session_id] = CompileSession(session_id, workdir)
+            self.created += 1
+        else:
+            self.reused += 1
+
+        session.users += 1
+        try:
+            async with session.lock:
+                try:
+                    if not session.compiles:
+                        await asyncio.to_thread(session.workdir.mkdir, exist_ok=True)
+                    yield session
+                finally:
+                    session.compiles += 1
+                    session.last_used = time.monotonic()
+                    session.size = await asyncio.to_thread(directory_usage, session.workdir)
+        finally:
+            session.users -= 1
+        # Released first, so the session itself can go if it alone exceeds the bound
+        await self._enforce_limit()
+
+    async def run(self) -> None:
+        """
+        Expire idle sessions in the background
+        """
+        while True:
+            await asyncio.sleep(max(1.0, self.ttl / 4))
+            await self.expire()
+
+    def start(self) -> None:
+        """
+        Remove session directories of crashed processes
+        """
+        sweep_stale_workspaces(self.root)
+
+    def stop(self) -> None:
+        """
+        Remove this process's sessions at shutdown
+        """
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+        self._sessions.clear()
+
+    def stats(self) -> dict:
+        """
+        Return session counters
+        """
+        return {
+            "sessions": len(self._sessions),
+            "bytes": sum(session.size for session in self._sessions.values()),
+            "max_bytes": self.max_bytes,
+            "created": self.created,
+            "reused": self.reused,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+session_store = SessionStore(
+    root=config.SESSION_DIR,
+    ttl=config.SESSION_TTL,
+    max_bytes=config.SESSION_MAX_MB * 1024 * 1024,
+)
@@ -0,0 +1,150 @@
+"""
+Precompiled LuaLaTeX format for the question paper preamble
+
+The package-loading part of the template is dumped once into a .fmt file with
+mylatexformat and every compile then starts from that format instead of
+re-reading the preamble. Formats are keyed by the preamble hash and the TeX
+Live version, stored in a shared directory and rebuilt when either changes.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import pathlib
+import subprocess
+import tempfile
+import time
+from typing import Dict, Optional
+
+from .. import config
+from .compile_pool import run_command, tex_environment
+from ..templates.question_template import get_question_format_preamble, get_question_latex_template
+
+logger = logging.getLogger(__name__)
+
+
+class FormatCache:
+    """
+    Builds and locates the precompiled question paper format
+    """
+
+    def __init__(self, format_dir: str, enabled: bool = True):
+        # Must match the TEXFORMATS entry added by tex_environment()
+        self.format_dir = pathlib.Path(format_dir)
+        self.enabled = enabled
+        self._lock: Optional[asyncio.Lock] = None
+        self._tex_version: Optional[str] = None
+        self._failed: Dict[str, str] = {}
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _get_tex_version(self) -> str:
+        if self._tex_version is None:
+            returncode, stdout, _ = await run_command(
+                ["lualatex", "--version"], timeout=30, env=tex_environment()
+            )
+            if returncode != 0 or not stdout:
+                raise RuntimeError("Could not determine LuaLaTeX version")
+            self._tex_version = stdout.splitlines()[0].strip()
+        return self._tex_version
+
+    async def format_name(self) -> str:
+        """
+        Return the format name for the current template and TeX installation
+        """
+        digest = hashlib.sha256()
+        digest.update(get_question_format_preamble().encode("utf-8"))
+        digest.update((await self._get_tex_version()).encode("utf-8"))
+        return f"question-{digest.hexdigest()[:16]}"
+
+    async def ensure(self) -> Optional[str]:
+        """
+        Return the format name, building the format on first use
+
+        Returns:
+            Format name usable with ``lualatex -fmt``, or None when unavailable
+        """
+        if not self.enabled:
+            return None
+        try:
+            name = await self.format_name()
+        except (RuntimeError, FileNotFoundError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"Precompiled format unavailable: {e}")
+            return None
+
+        if name in self._failed:
+            return None
+        if (self.format_dir / f"{name}.fmt").exists():
+            return name
+
+        async with self._get_lock():
+            if (self.format_dir / f"{name}.fmt").exists():
+                return name
+            try:
+                await self._build(name)
+                return name
+            except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+                logger.warning(f"Failed to build format {name}, compiling without it: {e}")
+                self._failed[name] = str(e)
+                return None
+
+    async def _build(self, name: str) -> None:
+        logger.info(f"Building precompiled LuaLaTeX format: {name}")
+        self.format_dir.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.TemporaryDirectory(dir=self.format_dir) as builddir:
+            builddir = pathlib.Path(builddir)
+            (builddir / "question.tex").write_text(get_question_latex_template(), encoding="utf-8")
+            cmd = [
+                "lualatex",
+                "-ini",
+                "-interaction=nonstopmode",
+                f"-jobname={name}",
+                "&lualatex",
+                "mylatexformat.ltx",
+                "question.tex",
+            ]
+            returncode, stdout, stderr = await run_command(
+                cmd, cwd=builddir, timeout=300, env=tex_environment()
+            )
+
+            built = builddir / f"{name}.fmt"
+            if returncode != 0 or not built.exists():
+                raise RuntimeError(f"Format build failed:\n{stdout[-2000:]}\n{stderr[-2000:]}")
+
+            # Atomic rename so other workers never see a partial format
+            os.replace(built, self.format_dir / f"{name}.fmt")
+
+        self._prune(name)
+        logger.info(f"Precompiled format ready: {name}")
+
+    def _prune(self, current: str) -> None:
+        # Other instances may still run an older template during a rollout,
+        # so only formats that have not been touched for a day are removed
+        cutoff = time.time() - 24 * 3600
+        for old in self.format_dir.glob("question-*.fmt"):
+            if old.stem == current:
+                continue
+            try:
+                if old.stat().st_mtime < cutoff:
+                    old.unlink()
+                    logger.info(f"Removed stale format: {old.name}")
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        """
+        Return format cache state
+        """
+        return {
+            "enabled": self.enabled,
+            "format_dir": str(self.format_dir),
+            "failed": list(self._failed),
+        }
+
+
+format_cache = FormatCache(config.TEX_FORMAT_DIR, enabled=config.TEX_FORMAT_ENABLED)
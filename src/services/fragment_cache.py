@@ -0,0 +1,269 @@
+"""
+Pre-rendered question fragments for papers drawn from a question bank
+
+Question banks reuse the same questions across many papers. For requests
+with fragment_cache set, every self-contained question is typeset once, at
+the line width it has in the paper, into a single-page PDF cropped to the
+text. Snippets are stored by a hash of the question, the paper's font
+overrides and the renderer version, and the paper places them with
+\\qpfragment. Only questions not seen before are compiled: each as a small
+document of its own, in parallel on the compile pool.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import subprocess
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from .. import config
+from .compile_pool import (
+    CompilePoolFullError, compile_pool, run_command, tex_environment, tex_limits, tex_restrictions
+)
+from .format_cache import format_cache
+from .image_cache import link_into
+from .tex_log import TexLogParser
+from ..templates.question_renderer import get_renderer_version, render_fragment_document
+from ..templates.scripts import detect_scripts
+
+logger = logging.getLogger(__name__)
+
+# Questions that are not a self-contained block of lines stay inline: tables
+# continue the line they start on, images are request specific, and labels,
+# references, footnotes and page breaks need the surrounding document
+INLINE_PATTERN = re.compile(
+    r"\\begin\{tabular\}|\\includegraphics|"
+    r"\\(?:label|pageref|ref|eqref|autoref|nameref|zref\w*|cite|footnote|marginpar|"
+    r"item|newpage|clearpage|pagebreak)\b|LastPage|TotPages"
+)
+
+# Workspace directory the snippets are linked into
+FRAGMENT_DIR = "Fragments"
+
+# Snippets live in two-character shard directories of the cache; anything
+# else there (the staging directory) is never taken for a snippet
+SNIPPET_GLOB = "[0-9a-f][0-9a-f]/*.pdf"
+
+
+def is_fragment_candidate(content: Any) -> bool:
+    """
+    Check whether a question can be typeset on its own and placed as a snippet
+    """
+    return isinstance(content, str) and bool(content.strip()) and not INLINE_PATTERN.search(content)
+
+
+class FragmentCache:
+    """
+    Content-addressed store of pre-rendered question snippets with LRU eviction
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, enabled: bool = True):
+        self.cache_dir = pathlib.Path(cache_dir)
+        # Same filesystem as the shards, so finished snippets are renamed in
+        self.staging_dir = self.cache_dir / ".staging"
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.inline = 0
+        self.evictions = 0
+
+    def key(self, content: str, fonts: Optional[Dict[str, Any]]) -> str:
+        """
+        Return the cache key of a question typeset with the given font overrides
+        """
+        digest = hashlib.sha256()
+        digest.update(get_renderer_version().encode("utf-8"))
+        digest.update(json.dumps(fonts or {}, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        digest.update(content.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / key[:2] / f"{key}.pdf"
+
+    def _touch(self, path: pathlib.Path) -> None:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        snippets = []
+        total = 0
+        for snippet in self.cache_dir.glob(SNIPPET_GLOB):
+            try:
+                stat = snippet.stat()
+            except OSError:
+                continue
+            snippets.append((stat.st_mtime, stat.st_size, snippet))
+            total += stat.st_size
+
+        for _, size, snippet in sorted(snippets):
+            if total <= self.max_bytes:
+                break
+            try:
+                snippet.unlink()
+                total -= size
+                self.evictions += 1
+            except OSError:
+                pass
+
+    async def get(self, content: str, fonts: Optional[Dict[str, Any]]) -> Optional[pathlib.Path]:
+        """
+        Return the snippet of a question, compiling it on first use
+
+        Args:
+            content: Question text
+            fonts: Font overrides of the paper
+
+        Returns:
+            Path of the snippet PDF, or None if the question has to stay inline
+        """
+        key = self.key(content, fonts)
+        path = self._path(key)
+        if path.exists():
+            self.hits += 1
+            self._touch(path)
+            return path
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            self.misses += 1
+            try:
+                await self._compile(content, fonts, path)
+                result = path
+            except (RuntimeError, OSError, CompilePoolFullError, subprocess.TimeoutExpired) as e:
+                self.failures += 1
+                logger.warning(f"Could not pre-render question fragment {key[:16]}, typesetting it inline: {e}")
+                result = None
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _compile(self, content: str, fonts: Optional[Dict[str, Any]], path: pathlib.Path) -> None:
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        # Built apart from the snippets, so neither eviction nor a lookup ever
+        # sees a half-written PDF; the finished one is renamed into its shard
+        with tempfile.TemporaryDirectory(dir=self.staging_dir) as workdir:
+            workdir = pathlib.Path(workdir)
+            (workdir / "fragment.tex").write_text(
+                render_fragment_document(content, fonts, detect_scripts(content)), encoding="utf-8"
+            )
+
+            cmd = ["lualatex", "-interaction=nonstopmode", "-file-line-error", *tex_restrictions(), "fragment.tex"]
+            format_name = await format_cache.ensure()
+            if format_name:
+                cmd.insert(1, f"-fmt={format_name}")
+
+            parser = TexLogParser(fail_fast=config.LATEX_FAIL_FAST)
+            async with compile_pool.slot():
+                returncode, stdout, _ = await run_command(
+                    cmd, cwd=workdir, timeout=config.LATEX_TIMEOUT_MIN, env=tex_environment(),
+                    on_output=parser.feed, limits=tex_limits()
+                )
+            parser.finish()
+
+            pdf_file = workdir / "fragment.pdf"
+            # A question with any error, even one TeX recovers from, is left
+            # inline, where it typesets as it would without fragments
+            if parser.failed:
+                raise parser.exception()
+            if returncode != 0 or not pdf_file.exists() or pdf_file.stat().st_size == 0:
+                raise RuntimeError(f"LuaLaTeX exit code {returncode}:\n{stdout[-2000:]}")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(pdf_file, path)
+
+    async def assemble(self, data: Dict[str, Any], workdir: pathlib.Path) -> Dict[str, Any]:
+        """
+        Replace the questions of a paper with their pre-rendered snippets
+
+        Missing snippets are compiled concurrently, at most one compile pool's
+        worth at a time so a single paper cannot fill the pool queue.
+
+        Args:
+            data: Question paper data with local image paths
+            workdir: Compile workspace the snippets are linked into
+
+        Returns:
+            Copy of the data whose eligible questions are \\qpfragment calls
+        """
+        fonts = data.get("fonts") or None
+        contents: List[str] = list(dict.fromkeys(
+            content
+            for row in data.get("qp_parts") or []
+            for content in row.get("content") or []
+            if is_fragment_candidate(content)
+        ))
+
+        limiter = asyncio.Semaphore(compile_pool.concurrency)
+
+        async def limited(content: str) -> Optional[pathlib.Path]:
+            async with limiter:
+                return await self.get(content, fonts)
+
+        misses = self.misses
+        snippets = dict(zip(contents, await asyncio.gather(*(limited(content) for content in contents))))
+        if self.misses > misses:
+            await asyncio.to_thread(self._evict)
+
+        fragment_dir = workdir / FRAGMENT_DIR
+        fragment_dir.mkdir(exist_ok=True)
+        parts = []
+        for row in data.get("qp_parts") or []:
+            content = []
+            for question in row.get("content") or []:
+                snippet = snippets.get(question) if isinstance(question, str) else None
+                # A snippet evicted by a concurrent request is typeset inline as well
+                if snippet is None or not snippet.exists():
+                    self.inline += 1
+                    content.append(question)
+                    continue
+                link_into(snippet, fragment_dir / snippet.name)
+                content.append(f"\\qpfragment{{{FRAGMENT_DIR}/{snippet.name}}}")
+            parts.append({**row, "content": content})
+        return {**data, "qp_parts": parts}
+
+    def stats(self) -> dict:
+        """
+        Return cache counters
+        """
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "inline": self.inline,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+fragment_cache = FragmentCache(
+    cache_dir=config.FRAGMENT_CACHE_DIR,
+    max_bytes=config.FRAGMENT_CACHE_MB * 1024 * 1024,
+    enabled=config.FRAGMENT_CACHE_ENABLED,
+)
@@ -0,0 +1,169 @@
+"""
+Shared application-lifetime HTTP client for image downloads
+
+One pooled httpx.AsyncClient is reused for every download so keep-alive
+connections, TLS sessions and HTTP/2 multiplexing are shared across images
+and requests. Downloads are capped globally and per host, bodies are
+streamed and abandoned past HTTP_MAX_DOWNLOAD_MB, and transient failures
+are retried with exponential backoff. Slots are held per attempt, not
+during the backoff between attempts.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import urllib.parse
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+# Headers describing the encoded body, which no longer apply once read
+ENCODED_BODY_HEADERS = ("content-encoding", "content-length")
+
+_client: Optional[httpx.AsyncClient] = None
+_download_semaphore: Optional[asyncio.Semaphore] = None
+# Only hosts with downloads running or waiting have an entry
+_host_semaphores: Dict[str, asyncio.Semaphore] = {}
+_host_users: Dict[str, int] = {}
+
+
+class DownloadTooLargeError(httpx.HTTPError):
+    """
+    The response body is larger than HTTP_MAX_DOWNLOAD_MB
+    """
+
+
+def _http2_available() -> bool:
+    return config.HTTP_HTTP2 and importlib.util.find_spec("h2") is not None
+
+
+def _create_client() -> httpx.AsyncClient:
+    http2 = _http2_available()
+    logger.info(f"Creating shared HTTP client (http2={http2})")
+    return httpx.AsyncClient(
+        http2=http2,
+        follow_redirects=True,
+        timeout=httpx.Timeout(config.HTTP_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE,
+        ),
+    )
+
+
+async def start_http_client() -> None:
+    """
+    Create the shared client; called from the application lifespan
+    """
+    global _client
+    if _client is None:
+        _client = _create_client()
+
+
+async def close_http_client() -> None:
+    """
+    Close the shared client and its connection pool
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("Closed shared HTTP client")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared client, creating it lazily outside the app lifespan
+    """
+    global _client
+    if _client is None:
+        _client = _create_client()
+    return _client
+
+
+def _get_download_semaphore() -> asyncio.Semaphore:
+    global _download_semaphore
+    if _download_semaphore is None:
+        _download_semaphore = asyncio.Semaphore(config.DOWNLOAD_CONCURRENCY)
+    return _download_semaphore
+
+
+@asynccontextmanager
+async def _host_slot(url: str) -> AsyncIterator[None]:
+    host = urllib.parse.urlparse(url).netloc
+    if host not in _host_semaphores:
+        _host_semaphores[host] = asyncio.Semaphore(config.HTTP_MAX_PER_HOST)
+        _host_users[host] = 0
+    semaphore = _host_semaphores[host]
+    _host_users[host] += 1
+    try:
+        async with semaphore:
+            yield
+    finally:
+        _host_users[host] -= 1
+        if not _host_users[host]:
+            # Dropped once nobody holds or waits for it, so hosts seen once
+            # do not pile up
+            del _host_semaphores[host], _host_users[host]
+
+
+async def _get(client: httpx.AsyncClient, url: str, headers: Optional[Dict[str, str]]) -> httpx.Response:
+    limit = config.HTTP_MAX_DOWNLOAD_MB * 1024 * 1024
+    async with client.stream("GET", url, headers=headers) as response:
+        declared = response.headers.get("content-length", "")
+        if declared.isdigit() and int(declared) > limit:
+            raise DownloadTooLargeError(f"{url} is {declared} bytes, over {config.HTTP_MAX_DOWNLOAD_MB} MB")
+        body = bytearray()
+        async for chunk in response.aiter_bytes():
+            body.extend(chunk)
+            if len(body) > limit:
+                raise DownloadTooLargeError(f"{url} is over {config.HTTP_MAX_DOWNLOAD_MB} MB")
+    return httpx.Response(
+        response.status_code,
+        headers=[(key, value) for key, value in response.headers.multi_items() if key not in ENCODED_BODY_HEADERS],
+        content=bytes(body),
+        request=response.request,
+        extensions=response.extensions,
+    )
+
+
+async def fetch(url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """
+    GET a URL through the shared client with concurrency caps and retries
+    
+    Args:
+        url: URL to download
+        headers: Extra request headers (e.g. conditional request headers)
+        
+    Returns:
+        The final httpx.Response (the caller checks the status)
+        
+    Raises:
+        httpx.HTTPError: If every attempt failed at the transport level
+        DownloadTooLargeError: If the body is over HTTP_MAX_DOWNLOAD_MB
+    """
+    client = get_http_client()
+    attempts = config.HTTP_RETRIES + 1
+
+    for attempt in range(attempts):
+        try:
+            async with _get_download_semaphore(), _host_slot(url):
+                response = await _get(client, url, headers)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == attempts - 1:
+                return response
+            logger.warning(f"Retrying {url} after HTTP {response.status_code}")
+        except httpx.TransportError as e:
+            if attempt == attempts - 1:
+                raise
+            logger.warning(f"Retrying {url} after transport error: {e}")
+        # Other downloads get the slots while this one backs off
+        await asyncio.sleep(0.2 * (2 ** attempt))
+
+    raise httpx.HTTPError(f"Failed to fetch {url}")
@@ -0,0 +1,271 @@
+"""
+Persistent on-disk cache for downloaded images
+
+Image bytes are stored once by content hash; a small metadata record per URL
+remembers which blob it resolved to together with its ETag/Last-Modified
+validators. Stale entries are revalidated with conditional requests, the
+store is trimmed LRU by size, and job workspaces link to the blobs instead
+of receiving copies.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from .. import config
+from .http_client import fetch
+
+logger = logging.getLogger(__name__)
+
+
+def link_into(source: pathlib.Path, dest: pathlib.Path) -> None:
+    """
+    Place a cached file into a workspace without copying bytes when possible
+
+    Tries a hardlink and copies when the cache is on another filesystem;
+    never a symlink, which would dangle once the cache evicts the file.
+    Consumers must replace (not modify in place) linked files.
+
+    Args:
+        source: Cached file
+        dest: Path inside the job workspace
+    """
+    if dest.exists() or dest.is_symlink():
+        dest.unlink()
+    try:
+        os.link(source, dest)
+        return
+    except OSError:
+        pass
+    shutil.copyfile(source, dest)
+
+
+class ImageCache:
+    """
+    URL-keyed, content-addressed image store with revalidation and LRU eviction
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, ttl: int, enabled: bool = True):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.blob_dir = self.cache_dir / "blobs"
+        self.meta_dir = self.cache_dir / "urls"
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Running size of the blob store, scanned once on first use
+        self._total: Optional[int] = None
+        self._total_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.stale_served = 0
+        self.evictions = 0
+
+    def _meta_path(self, url: str) -> pathlib.Path:
+        return self.meta_dir / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def _load_meta(self, url: str) -> Optional[dict]:
+        try:
+            return json.loads(self._meta_path(url).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self, url: str, meta: dict) -> None:
+        self.meta_dir.mkdir(parents=True, exist_ok=True)
+        path = self._meta_path(url)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def _store_blob(self, content: bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        blob = self.blob_dir / digest
+        if not blob.exists():
+            tmp_path = blob.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_bytes(content)
+            os.replace(tmp_path, blob)
+            self._evict(len(content))
+        return digest
+
+    def _touch(self, blob: pathlib.Path) -> None:
+        try:
+            os.utime(blob)
+        except OSError:
+            pass
+
+    def _scan(self) -> list:
+        blobs = []
+        for blob in self.blob_dir.iterdir():
+            if blob.suffix == ".tmp":
+                continue
+            try:
+                stat = blob.stat()
+            except OSError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, blob))
+        return blobs
+
+    def _evict(self, added: int) -> None:
+        """
+        Account for a new blob and trim the store once it is over its limit
+
+        The directory is only listed on first use and when the running total
+        exceeds the limit, which also corrects drift from other processes.
+        URL records of evicted blobs are deleted with them.
+        """
+        with self._total_lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._scan())
+            else:
+                self._total += added
+            if self._total <= self.max_bytes:
+                return
+
+            blobs = self._scan()
+            self._total = sum(size for _, size, _ in blobs)
+            evicted = 0
+            for _, size, blob in sorted(blobs):
+                if self._total <= self.max_bytes:
+                    break
+                try:
+                    blob.unlink()
+                    self._total -= size
+                    self.evictions += 1
+                    evicted += 1
+                    logger.info(f"Evicted cached image blob: {blob.name}")
+                except OSError:
+                    pass
+            if evicted:
+                self._prune_meta()
+
+    def _prune_meta(self) -> None:
+        """
+        Delete URL records whose blob is gone
+        """
+        if not self.meta_dir.is_dir():
+            return
+        for path in self.meta_dir.glob("*.json"):
+            try:
+                blob = json.loads(path.read_text(encoding="utf-8"))["blob"]
+            except (OSError, ValueError, KeyError, TypeError):
+                blob = None
+            if blob is None or not (self.blob_dir / blob).exists():
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    async def get(self, url: str) -> pathlib.Path:
+        """
+        Return the cached blob for a URL, downloading or revalidating as needed
+
+        Args:
+            url: Image URL
+
+        Returns:
+            Path of the content-addressed blob
+
+        Raises:
+            httpx.HTTPError: If the image cannot be downloaded and nothing is cached
+        """
+        inflight = self._inflight.get(url)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        try:
+            blob = await self._get(url)
+            future.set_result(blob)
+            return blob
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(url, None)
+
+    async def _get(self, url: str) -> pathlib.Path:
+        meta = await asyncio.to_thread(self._load_meta, url)
+        blob = self.blob_dir / meta["blob"] if meta else None
+        if blob is not None and not blob.exists():
+            meta, blob = None, None
+
+        if meta and time.time() - meta.get("fetched_at", 0) < self.ttl:
+            self.hits += 1
+            self._touch(blob)
+            return blob
+
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = await fetch(url, headers=headers)
+            if response.status_code == 304 and meta:
+                self.revalidated += 1
+                meta["fetched_at"] = time.time()
+                await asyncio.to_thread(self._save_meta, url, meta)
+                self._touch(blob)
+                return blob
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            if meta:
+                self.stale_served += 1
+                logger.warning(f"Revalidation of {url} failed, serving cached copy: {e}")
+                self._touch(blob)
+                return blob
+            raise
+
+        self.misses += 1
+        digest = await asyncio.to_thread(self._store_blob, response.content)
+        meta = {
+            "url": url,
+            "blob": digest,
+            "size": len(response.content),
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "fetched_at": time.time(),
+        }
+        await asyncio.to_thread(self._save_meta, url, meta)
+        return self.blob_dir / digest
+
+    def stats(self) -> dict:
+        """
+        Return cache counters
+        """
+        lookups = self.hits + self.misses + self.revalidated
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "stale_served": self.stale_served,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.revalidated) / lookups, 4) if lookups else 0.0,
+        }
+
+
+image_cache = ImageCache(
+    cache_dir=config.IMAGE_CACHE_DIR,
+    max_bytes=config.IMAGE_CACHE_MB * 1024 * 1024,
+    ttl=config.IMAGE_CACHE_TTL,
+    enabled=config.IMAGE_CACHE_ENABLED,
+)
@@ -0,0 +1,346 @@
+"""
+Optional normalization of images before they are embedded in the PDF
+
+The template sizes every graphic to 0.3\\textwidth x 0.3\\textheight unless
+\\includegraphics gives its own width or height, so any pixels beyond the
+displayed size at the target DPI are wasted work for LuaLaTeX and bloat the
+PDF. Images are downscaled, recompressed, and converted from formats LuaTeX
+cannot embed (WebP, GIF, SVG, ...) to PNG/JPEG. Results are cached by source
+hash and display size in a size-bounded LRU store, and the work runs in a
+thread pool.
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+import math
+import os
+import pathlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from .. import config
+from .image_cache import link_into
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+try:
+    import cairosvg
+except ImportError:  # pragma: no cover - optional dependency
+    cairosvg = None
+
+# A4 with 1.4cm margins (see the geometry options of the template)
+TEXT_WIDTH_MM = 210 - 2 * 14
+TEXT_HEIGHT_MM = 297 - 2 * 14
+MAX_WIDTH_INCHES = 0.3 * TEXT_WIDTH_MM / 25.4
+MAX_HEIGHT_INCHES = 0.3 * TEXT_HEIGHT_MM / 25.4
+
+# Displayed size in inches; math.inf where it depends on the image itself
+DisplaySize = Tuple[float, float]
+DEFAULT_DISPLAY_SIZE: DisplaySize = (MAX_WIDTH_INCHES, MAX_HEIGHT_INCHES)
+
+SIZE_KEY_PATTERN = re.compile(r"\b(width|height|totalheight)\s*=\s*([^,\]]+)")
+LENGTH_PATTERN = re.compile(r"^([0-9]*\.?[0-9]+)?\s*(pt|bp|in|cm|mm|\\[a-z]+)$")
+LENGTH_INCHES = {
+    "pt": 1 / 72.27,
+    "bp": 1 / 72,
+    "in": 1.0,
+    "cm": 1 / 2.54,
+    "mm": 1 / 25.4,
+    "\\textwidth": TEXT_WIDTH_MM / 25.4,
+    "\\linewidth": TEXT_WIDTH_MM / 25.4,
+    "\\columnwidth": TEXT_WIDTH_MM / 25.4,
+    "\\hsize": TEXT_WIDTH_MM / 25.4,
+    "\\textheight": TEXT_HEIGHT_MM / 25.4,
+    "\\paperwidth": 210 / 25.4,
+    "\\paperheight": 297 / 25.4,
+}
+
+# Bump when the normalization output changes to invalidate cached results
+NORMALIZER_VERSION = "2"
+
+NATIVE_FORMATS = {"JPEG", "PNG"}
+NORMALIZE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp", ".tif", ".tiff", ".svg"}
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+# Running size of the normalized image store, scanned once on first use
+_cache_bytes: Optional[int] = None
+_cache_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=config.IMAGE_NORMALIZE_WORKERS,
+            thread_name_prefix="image-normalize"
+        )
+    return _executor
+
+
+def normalization_available() -> bool:
+    """
+    Return whether normalization is enabled and Pillow is installed
+    """
+    return config.IMAGE_NORMALIZE and Image is not None
+
+
+def _length_inches(value: str) -> float:
+    match = LENGTH_PATTERN.match(value.strip())
+    if match is None or match.group(2) not in LENGTH_INCHES:
+        # em, ex, calc expressions, ...: not worth guessing, never downscale
+        return math.inf
+    factor = float(match.group(1)) if match.group(1) else 1.0
+    return factor * LENGTH_INCHES[match.group(2)]
+
+
+def display_size(options: Optional[str]) -> DisplaySize:
+    """
+    Return the largest size an \\includegraphics call can display its image at
+
+    Args:
+        options: The optional argument, e.g. "[width=5cm]", or None
+
+    Returns:
+        (width, height) in inches; the template defaults fill in a missing
+        width or height, and math.inf marks a size that is not known
+    """
+    if not options:
+        return DEFAULT_DISPLAY_SIZE
+    if re.search(r"\b(scale|angle|natwidth|natheight|viewport|trim)\b", options):
+        return math.inf, math.inf
+    width, height = DEFAULT_DISPLAY_SIZE
+    for key, value in SIZE_KEY_PATTERN.findall(options):
+        if key == "width":
+            width = _length_inches(value)
+        else:
+            height = _length_inches(value)
+    return width, height
+
+
+def _max_pixels(size: DisplaySize) -> Tuple[float, float]:
+    dpi = config.IMAGE_NORMALIZE_DPI
+    return tuple(math.inf if inches == math.inf else max(1, int(inches * dpi)) for inches in size)
+
+
+def _render_svg(data: bytes, size: DisplaySize) -> Optional[bytes]:
+    if cairosvg is None:
+        return None
+    width, _ = _max_pixels(size)
+    if width == math.inf:
+        return cairosvg.svg2png(bytestring=data, dpi=config.IMAGE_NORMALIZE_DPI)
+    return cairosvg.svg2png(bytestring=data, output_width=width)
+
+
+def _normalize_bytes(data: bytes, suffix: str, size: DisplaySize = DEFAULT_DISPLAY_SIZE) -> Optional[tuple]:
+    """
+    Downscale and recompress image bytes
+
+    Args:
+        data: Source image bytes
+        suffix: Lower-case extension of the source file
+        size: Largest displayed size, from display_size()
+
+    Returns:
+        Tuple of (output bytes, output extension), or None to keep the source
+    """
+    if suffix == ".svg" or data.lstrip()[:5] in (b"<?xml", b"<svg "):
+        data = _render_svg(data, size)
+        if data is None:
+            logger.warning("SVG image found but cairosvg is not installed, leaving it unchanged")
+            return None
+
+    image = Image.open(io.BytesIO(data))
+    source_format = image.format
+    image.load()
+
+    max_width, max_height = _max_pixels(size)
+    resized = image.width > max_width or image.height > max_height
+    if resized:
+        image.thumbnail(
+            (min(max_width, image.width), min(max_height, image.height)), Image.LANCZOS
+        )
+
+    if source_format in NATIVE_FORMATS and not resized:
+        # Already embeddable and small enough; recompression alone rarely pays off
+        return None
+
+    has_alpha = image.mode in ("RGBA", "LA", "P") and (
+        image.mode != "P" or "transparency" in image.info
+    )
+    output = io.BytesIO()
+    dpi = (config.IMAGE_NORMALIZE_DPI, config.IMAGE_NORMALIZE_DPI)
+    photographic = source_format not in NATIVE_FORMATS and not has_alpha and image.mode == "RGB"
+    if source_format == "JPEG" or photographic:
+        image.convert("RGB").save(
+            output, "JPEG", quality=config.IMAGE_JPEG_QUALITY, optimize=True, dpi=dpi
+        )
+        extension = ".jpg" if suffix not in (".jpg", ".jpeg") else suffix
+    else:
+        if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        image.save(output, "PNG", optimize=True, dpi=dpi)
+        extension = ".png"
+    return output.getvalue(), extension
+
+
+def _add_to_cache(cache_dir: pathlib.Path, size: int) -> None:
+    """
+    Account for a new cache entry and evict least recently used ones
+    """
+    global _cache_bytes
+    limit = config.IMAGE_NORMALIZE_CACHE_MB * 1024 * 1024
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(entry.stat().st_size for entry in cache_dir.glob("[!.]*"))
+        else:
+            _cache_bytes += size
+        if _cache_bytes <= limit:
+            return
+        entries = []
+        for entry in cache_dir.glob("[!.]*"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        _cache_bytes = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry in sorted(entries):
+            if _cache_bytes <= limit:
+                break
+            try:
+                entry.unlink()
+                _cache_bytes -= entry_size
+                logger.info(f"Evicted normalized image: {entry.name}")
+            except OSError:
+                pass
+
+
+def _converted_path(path: pathlib.Path, extension: str) -> pathlib.Path:
+    """
+    Pick a name for a converted image that no other workspace file has
+
+    a.gif becomes a_gif.png rather than a.png, which may be another image
+    """
+    new_path = path.with_name(f"{path.stem}_{path.suffix[1:]}{extension}")
+    if new_path.exists():
+        digest = hashlib.sha256(path.name.encode("utf-8")).hexdigest()[:8]
+        new_path = path.with_name(f"{path.stem}_{digest}{extension}")
+    return new_path
+
+
+def _normalize_file(path: pathlib.Path, size: DisplaySize = DEFAULT_DISPLAY_SIZE) -> Optional[str]:
+    """
+    Normalize one workspace image in place (by replacement, never by writing
+    into a possibly hardlinked cache blob)
+
+    Returns:
+        New filename if the extension changed, else None
+    """
+    suffix = path.suffix.lower()
+    data = path.read_bytes()
+
+    max_width, max_height = _max_pixels(size)
+    settings = (
+        f"{NORMALIZER_VERSION}:{config.IMAGE_NORMALIZE_DPI}:{config.IMAGE_JPEG_QUALITY}:"
+        f"{max_width}x{max_height}:{suffix}:"
+    )
+    digest = hashlib.sha256(settings.encode("utf-8") + data).hexdigest()
+    cache_dir = pathlib.Path(config.IMAGE_NORMALIZE_CACHE_DIR)
+    cached = next(iter(cache_dir.glob(f"{digest}.*")), None) if cache_dir.exists() else None
+
+    added = 0
+    if cached is None:
+        result = _normalize_bytes(data, suffix, size)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        if result is None:
+            # Remember that this source needs no work so it is not decoded again
+            (cache_dir / f"{digest}.keep").touch()
+            return None
+        output, extension = result
+        cached = cache_dir / f"{digest}{extension}"
+        # Dot-prefixed so the lookup glob above never sees a partial file
+        tmp_path = cache_dir / f".{digest}.{os.getpid()}.tmp"
+        tmp_path.write_bytes(output)
+        os.replace(tmp_path, cached)
+        added = len(output)
+        logger.info(f"Normalized image {path.name}: {len(data)} -> {len(output)} bytes")
+    else:
+        try:
+            # Most recently used end of the LRU order
+            os.utime(cached)
+        except OSError:
+            pass
+
+    if cached.suffix == ".keep":
+        return None
+
+    new_path = path if cached.suffix == suffix else _converted_path(path, cached.suffix)
+    link_into(cached, new_path)
+    if added:
+        # Only once linked, so eviction cannot take the entry from under us
+        _add_to_cache(cache_dir, added)
+    if new_path != path:
+        path.unlink()
+        return new_path.name
+    return None
+
+
+async def normalize_images(
+    photo_dir: pathlib.Path,
+    display_sizes: Optional[Dict[str, DisplaySize]] = None
+) -> Dict[str, str]:
+    """
+    Normalize every image in a workspace concurrently in the thread pool
+
+    Args:
+        photo_dir: Workspace image directory
+        display_sizes: Largest displayed size per filename, from the
+            \\includegraphics options; the template default otherwise
+
+    Returns:
+        Mapping of old filename to new filename for converted images
+    """
+    if not normalization_available():
+        if config.IMAGE_NORMALIZE:
+            logger.warning("IMAGE_NORMALIZE is set but Pillow is not installed, skipping")
+        return {}
+
+    paths = [
+        path for path in photo_dir.iterdir()
+        if path.is_file() and path.suffix.lower() in NORMALIZE_EXTENSIONS
+    ]
+    if not paths:
+        return {}
+
+    display_sizes = display_sizes or {}
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                executor, _normalize_file, path,
+                # Extensionless references are collected under the stem
+                display_sizes.get(path.name) or display_sizes.get(path.stem, DEFAULT_DISPLAY_SIZE)
+            )
+            for path in paths
+        ),
+        return_exceptions=True
+    )
+
+    renames = {}
+    for path, result in zip(paths, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not normalize image {path.name}: {result}")
+        elif result:
+            renames[path.name] = result
+    return renames
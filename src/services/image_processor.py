@@ -8,69 +8,240 @@ import re
 import asyncio
 import logging
 import base64
-import shutil
-import httpx
+import hashlib
 import urllib.parse
+from typing import Any, Dict, Iterable, List, Optional
+
+from .http_client import fetch
+from .image_cache import image_cache, link_into
+from .image_normalizer import DisplaySize, display_size, normalize_images
 
 logger = logging.getLogger(__name__)
 
 
-async def extract_and_download_urls(latex_content: str, photo_dir: pathlib.Path) -> str:
+# \includegraphics with or without an optional argument, e.g.
+# \includegraphics[width=3cm]{path} or \includegraphics{path}
+INCLUDEGRAPHICS_PATTERN = re.compile(r'\\includegraphics\s*(\[[^\]]*\])?\s*\{([^}]+)\}')
+
+# Extensions graphicx tries for a file name without one under LuaTeX
+GRAPHICS_EXTENSIONS = ("", ".pdf", ".png", ".jpg", ".jpeg", ".mps", ".jbig2", ".jb2")
+
+
+def _is_url(path: str) -> bool:
+    return path.startswith('http://') or path.startswith('https://')
+
+
+def _url_filename(url: str) -> str:
     """
-    Extract image URLs from LaTeX content and download them locally
+    Derive a stable local filename for an image URL
+    """
+    filename = os.path.basename(urllib.parse.urlparse(url).path)
+    if not filename:
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        filename = f"downloaded_image_{digest}.jpg"
+    return filename
+
+
+def collect_image_urls(contents: Iterable[str]) -> List[str]:
+    """
+    Collect the distinct \\includegraphics URLs across many LaTeX strings
     
     Args:
-        latex_content: LaTeX content containing image references
-        photo_dir: Directory to save downloaded images
+        contents: LaTeX strings to scan
         
     Returns:
-        Processed LaTeX content with local image paths
+        URLs in first-seen order, without duplicates
     """
-    logger.info("Processing LaTeX content for image URLs")
-    url_pattern = r'\\includegraphics\[width=[^\]]*\]\{([^}]+)\}'
+    urls: Dict[str, None] = {}
+    for content in contents:
+        for match in INCLUDEGRAPHICS_PATTERN.finditer(content):
+            path = match.group(2).strip()
+            if _is_url(path):
+                urls[path] = None
+    return list(urls)
+
+
+def assign_filenames(urls: Iterable[str], reserved: Iterable[str] = ()) -> Dict[str, str]:
+    """
+    Map URLs to unique local filenames
+    
+    Args:
+        urls: URLs to place in the workspace
+        reserved: Filenames already taken (e.g. names from the images dict)
+        
+    Returns:
+        Mapping of URL to filename
+    """
+    taken = set(reserved)
+    filenames = {}
+    for url in urls:
+        filename = _url_filename(url)
+        if filename in taken:
+            # Same basename from a different URL: disambiguate with a hash prefix
+            digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:8]
+            filename = f"{digest}_{filename}"
+        taken.add(filename)
+        filenames[url] = filename
+    return filenames
+
+
+def collect_display_sizes(contents: Iterable[str], filenames: Dict[str, str]) -> Dict[str, DisplaySize]:
+    """
+    Find the largest size each workspace image is displayed at
+    
+    Args:
+        contents: LaTeX strings to scan
+        filenames: Mapping of URL to local filename
+        
+    Returns:
+        Mapping of local filename to (width, height) in inches
+    """
+    sizes: Dict[str, DisplaySize] = {}
+    for content in contents:
+        for match in INCLUDEGRAPHICS_PATTERN.finditer(content):
+            path = match.group(2).strip()
+            name = filenames.get(path) or os.path.basename(path)
+            size = display_size(match.group(1))
+            if name in sizes:
+                size = (max(size[0], sizes[name][0]), max(size[1], sizes[name][1]))
+            sizes[name] = size
+    return sizes
+
+
+async def download_urls(filenames: Dict[str, str], photo_dir: pathlib.Path) -> None:
+    """
+    Download many images concurrently into the workspace
     
-    urls_to_download = []
-    def find_urls(match):
-        original_path = match.group(1)
-        if original_path.startswith('http://') or original_path.startswith('https://'):
-            urls_to_download.append(original_path)
-        return match.group(0)
+    Args:
+        filenames: Mapping of URL to local filename
+        photo_dir: Directory to save the images
+    """
+    if not filenames:
+        return
+    logger.info(f"Downloading {len(filenames)} unique image URLs")
+    await asyncio.gather(
+        *(_download_single_image(url, photo_dir / filename) for url, filename in filenames.items()),
+        return_exceptions=True
+    )
+
+
+def rewrite_image_urls(
+    latex_content: str,
+    filenames: Dict[str, str],
+    photo_dir: pathlib.Path,
+    renames: Optional[Dict[str, str]] = None
+) -> str:
+    """
+    Point \\includegraphics URLs at the downloaded local copies
     
-    re.sub(url_pattern, find_urls, latex_content)
+    URLs whose download failed are left untouched. A local reference
+    without an extension (\\includegraphics{Photo/Qpbank/foo}) follows the
+    conversion of the one file with that stem, unless graphicx would find
+    another file under that name.
     
-    if urls_to_download:
-        download_tasks = []
-        for url in urls_to_download:
-            download_tasks.append(_download_single_image(url, photo_dir))
+    Args:
+        latex_content: LaTeX content containing image references
+        filenames: Mapping of URL to local filename
+        photo_dir: Directory holding the downloaded images
+        renames: Mapping of local filename to the name it was converted to
         
-        await asyncio.gather(*download_tasks, return_exceptions=True)
+    Returns:
+        LaTeX content with local image paths
+    """
+    renames = renames or {}
+    stems: Dict[str, Optional[str]] = {}
+    for old, new in renames.items():
+        stem = os.path.splitext(old)[0]
+        # Two converted files with one stem: the reference is ambiguous
+        stems[stem] = None if stem in stems else new
+    
+    def renamed(basename: str) -> Optional[str]:
+        if basename in renames:
+            return renames[basename]
+        if os.path.splitext(basename)[1] or stems.get(basename) is None:
+            return None
+        if any((photo_dir / f"{basename}{extension}").exists() for extension in GRAPHICS_EXTENSIONS):
+            return None
+        return stems[basename]
     
     def replace_with_local(match):
-        original_path = match.group(1)
-        
-        if original_path.startswith('http://') or original_path.startswith('https://'):
-            try:
-                parsed_url = urllib.parse.urlparse(original_path)
-                filename = os.path.basename(parsed_url.path)
-                
-                if not filename:
-                    filename = f"downloaded_image_{hash(original_path)}.jpg"
-                
-                local_path = photo_dir / filename
-                
-                if local_path.exists():
-                    width_spec = match.group(0).split("[")[1].split("]")[0]
-                    return f'\\includegraphics[{width_spec}]{{./Photo/Qpbank/{filename}}}'
-                else:
-                    return match.group(0)
-                    
-            except Exception as e:
-                logger.warning(f"Failed to process {original_path}: {e}")
+        options = match.group(1) or ""
+        path = match.group(2).strip()
+        filename = filenames.get(path)
+        if filename is None:
+            # Local reference: only rewrite if normalization renamed the file
+            basename = os.path.basename(path)
+            new_name = renamed(basename)
+            if new_name is None:
                 return match.group(0)
+            directory = path[:len(path) - len(basename)]
+            return f'\\includegraphics{options}{{{directory}{new_name}}}'
+        filename = renames.get(filename, filename)
+        if not (photo_dir / filename).exists():
+            return match.group(0)
+        return f'\\includegraphics{options}{{./Photo/Qpbank/{filename}}}'
+    
+    return INCLUDEGRAPHICS_PATTERN.sub(replace_with_local, latex_content)
+
+
+async def prefetch_document_assets(question_data: Dict[str, Any], photo_dir: pathlib.Path) -> Dict[str, Any]:
+    """
+    Resolve every image of a question paper in one concurrent stage
+    
+    Scans all qp_parts[*].content strings once, dedupes URLs across the whole
+    document, downloads them concurrently alongside the images dict,
+    optionally normalizes the images, and rewrites all content strings in a
+    single pass.
+    
+    Args:
+        question_data: Question paper data as received
+        photo_dir: Directory to save images
         
-        return match.group(0)
+    Returns:
+        Copy of question_data with local image paths in the content
+    """
+    parts = question_data.get('qp_parts') or []
+    images = question_data.get('images') or {}
+    
+    contents = [content for part in parts for content in part.get('content', [])]
+    urls = collect_image_urls(contents)
+    filenames = assign_filenames(urls, reserved=images.keys())
+    
+    await asyncio.gather(
+        process_images(images, photo_dir),
+        download_urls(filenames, photo_dir)
+    )
+    renames = await normalize_images(photo_dir, collect_display_sizes(contents, filenames))
+    
+    processed_data = dict(question_data)
+    processed_data['qp_parts'] = [
+        {
+            **part,
+            'content': [
+                rewrite_image_urls(content, filenames, photo_dir, renames) if filenames or renames else content
+                for content in part.get('content', [])
+            ]
+        }
+        for part in parts
+    ]
+    return processed_data
+
+
+async def extract_and_download_urls(latex_content: str, photo_dir: pathlib.Path) -> str:
+    """
+    Extract image URLs from LaTeX content and download them locally
     
-    processed_content = re.sub(url_pattern, replace_with_local, latex_content)
+    Args:
+        latex_content: LaTeX content containing image references
+        photo_dir: Directory to save downloaded images
+        
+    Returns:
+        Processed LaTeX content with local image paths
+    """
+    logger.info("Processing LaTeX content for image URLs")
+    filenames = assign_filenames(collect_image_urls([latex_content]))
+    await download_urls(filenames, photo_dir)
+    processed_content = rewrite_image_urls(latex_content, filenames, photo_dir)
     logger.info("Completed processing LaTeX content for image URLs")
     return processed_content
 
@@ -107,8 +278,9 @@ async def process_images(images: dict, photo_dir: pathlib.Path) -> None:
                 img_path.write_bytes(img_bytes)
                 logger.info(f"Processed base64 image: {img_name}")
             elif os.path.isfile(img_data):
-                shutil.copy(img_data, img_path)
-                logger.info(f"Copied local image: {img_name}")
+                # Uploaded images are already on disk: link, do not copy
+                link_into(pathlib.Path(img_data), img_path)
+                logger.info(f"Linked local image: {img_name}")
             else:
                 logger.warning(f"Image source not recognized for {img_name}: {img_data[:50]}...")
         except Exception as e:
@@ -122,29 +294,17 @@ async def process_images(images: dict, photo_dir: pathlib.Path) -> None:
         await asyncio.gather(*download_tasks, return_exceptions=True)
 
 
-async def _download_single_image(url: str, photo_dir: pathlib.Path) -> None:
+async def _download_single_image(url: str, local_path: pathlib.Path) -> None:
     """
     Download a single image asynchronously
     
     Args:
         url: URL of the image to download
-        photo_dir: Directory to save the image
+        local_path: Path to save the image at
     """
     try:
-        parsed_url = urllib.parse.urlparse(url)
-        filename = os.path.basename(parsed_url.path)
-        
-        if not filename:
-            filename = f"downloaded_image_{hash(url)}.jpg"
-        
-        local_path = photo_dir / filename
-        
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            local_path.write_bytes(response.content)
-            
-        logger.info(f"Successfully downloaded image: {filename}")
+        await _download_to(url, local_path)
+        logger.info(f"Successfully downloaded image: {local_path.name}")
         
     except Exception as e:
         logger.warning(f"Failed to download {url}: {e}")
@@ -161,12 +321,27 @@ async def _download_image_with_name(img_name: str, url: str, photo_dir: pathlib.
     """
     img_path = photo_dir / img_name
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            img_path.write_bytes(response.content)
+        await _download_to(url, img_path)
             
         logger.info(f"Successfully downloaded image: {img_name}")
         
     except Exception as e:
         logger.warning(f"Could not download image {img_name}: {e}")
+
+
+async def _download_to(url: str, dest: pathlib.Path) -> None:
+    """
+    Place the image at a URL into a workspace, going through the image cache
+    
+    Args:
+        url: URL of the image
+        dest: Destination path inside the workspace
+    """
+    if image_cache.enabled:
+        blob = await image_cache.get(url)
+        link_into(blob, dest)
+        return
+    
+    response = await fetch(url)
+    response.raise_for_status()
+    dest.write_bytes(response.content)
@@ -0,0 +1,418 @@
+"""
+Pluggable job queue for asynchronous question paper compilation
+
+POST /jobs enqueues a paper and returns immediately; compile workers (inside
+the API process or started separately with worker.py) claim jobs, run
+compile_question_paper and store the PDF. SQLite is the single-node backend,
+Redis (or any Redis-compatible server) the cluster backend.
+"""
+
+import abc
+import json
+import logging
+import os
+import pathlib
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Union
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class JobStore(abc.ABC):
+    """
+    Interface of a job queue backend
+
+    Methods are synchronous; async callers run them with asyncio.to_thread.
+    """
+
+    @abc.abstractmethod
+    def enqueue(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Add a job and return its public record
+        """
+
+    @abc.abstractmethod
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Atomically take the oldest queued job, including its payload
+        """
+
+    @abc.abstractmethod
+    def complete(self, job_id: str, pdf: Union[bytes, pathlib.Path], info: Dict[str, Any]) -> None:
+        """
+        Store the PDF (bytes or a file to take a copy of) of a finished job
+        """
+
+    @abc.abstractmethod
+    def fail(self, job_id: str, error: str) -> None:
+        """
+        Mark a job as failed
+        """
+
+    @abc.abstractmethod
+    def requeue(self, job_id: str) -> None:
+        """
+        Put a claimed job back at the head of the queue, e.g. when no
+        compile slot was free
+        """
+
+    @abc.abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the public record of a job, or None if unknown
+        """
+
+    @abc.abstractmethod
+    def get_result(self, job_id: str) -> Optional[Union[bytes, pathlib.Path]]:
+        """
+        Return the PDF of a finished job as bytes or as a file path
+        """
+
+    def purge_expired(self) -> int:
+        """
+        Delete finished jobs older than the retention period
+        """
+        return 0
+
+    @abc.abstractmethod
+    def depth(self) -> int:
+        """
+        Return the number of queued jobs
+        """
+
+
+def _new_record(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": uuid.uuid4().hex,
+        "status": JOB_QUEUED,
+        "qp_code": payload.get("qp_code"),
+        "password": bool(payload.get("password")),
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "worker": None,
+        "error": None,
+        "info": {},
+    }
+
+
+def with_timings(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Add derived queue/compile durations to a job record
+    """
+    record = dict(record)
+    created, started, finished = record.get("created_at"), record.get("started_at"), record.get("finished_at")
+    record["queue_seconds"] = round((started or time.time()) - created, 3) if created else None
+    record["run_seconds"] = round((finished or time.time()) - started, 3) if started else None
+    return record
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Single-node job store: job rows in SQLite, PDFs in a result directory
+    """
+
+    def __init__(self, db_path: str, result_dir: str, ttl: int, stale_after: int):
+        self.db_path = db_path
+        self.result_dir = pathlib.Path(result_dir)
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self._local = threading.local()
+        pathlib.Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.result_dir.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    record TEXT NOT NULL,
+                    payload TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _save(self, conn: sqlite3.Connection, record: Dict[str, Any]) -> None:
+        conn.execute(
+            "UPDATE jobs SET status = ?, record = ?, started_at = ? WHERE id = ?",
+            (record["status"], json.dumps(record), record["started_at"], record["id"]),
+        )
+
+    def enqueue(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        record = _new_record(payload)
+        self._connect().execute(
+            "INSERT INTO jobs (id, status, record, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            (record["id"], JOB_QUEUED, json.dumps(record), json.dumps(payload), record["created_at"]),
+        )
+        return record
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs whose worker died mid-compile go back to the queue
+            conn.execute(
+                "UPDATE jobs SET status = ? WHERE status = ? AND started_at < ?",
+                (JOB_QUEUED, JOB_RUNNING, time.time() - self.stale_after),
+            )
+            row = conn.execute(
+                "SELECT record, payload FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            record = json.loads(row[0])
+            record.update(status=JOB_RUNNING, started_at=time.time(), worker=worker_id)
+            self._save(conn, record)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        record["payload"] = json.loads(row[1])
+        return record
+
+    def _update(self, job_id: str, **changes: Any) -> None:
+        conn = self._connect()
+        row = conn.execute("SELECT record FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return
+        record = json.loads(row[0])
+        record.update(changes)
+        self._save(conn, record)
+        if record["status"] in (JOB_DONE, JOB_FAILED):
+            # The payload (possibly with base64 images) is no longer needed
+            conn.execute("UPDATE jobs SET payload = NULL WHERE id = ?", (job_id,))
+
+    def complete(self, job_id: str, pdf: Union[bytes, pathlib.Path], info: Dict[str, Any]) -> None:
+        path = self.result_dir / f"{job_id}.pdf"
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        if isinstance(pdf, bytes):
+            tmp_path.write_bytes(pdf)
+        else:
+            try:
+                os.link(pdf, tmp_path)
+            except OSError:
+                shutil.copyfile(pdf, tmp_path)
+        os.replace(tmp_path, path)
+        self._update(job_id, status=JOB_DONE, finished_at=time.time(), info=info)
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._update(job_id, status=JOB_FAILED, finished_at=time.time(), error=error)
+
+    def requeue(self, job_id: str) -> None:
+        # Ordered by created_at, so the job is claimed next
+        self._update(job_id, status=JOB_QUEUED, started_at=None, worker=None)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT record FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_result(self, job_id: str) -> Optional[pathlib.Path]:
+        path = self.result_dir / f"{job_id}.pdf"
+        return path if path.exists() else None
+
+    def purge_expired(self) -> int:
+        conn = self._connect()
+        cutoff = time.time() - self.ttl
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE status IN (?, ?) AND created_at < ?",
+            (JOB_DONE, JOB_FAILED, cutoff),
+        ).fetchall()
+        for (job_id,) in rows:
+            (self.result_dir / f"{job_id}.pdf").unlink(missing_ok=True)
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(rows)
+
+    def depth(self) -> int:
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_QUEUED,)
+        ).fetchone()
+        return row[0]
+
+
+class RedisJobStore(JobStore):
+    """
+    Cluster job store on Redis: a list as the queue, keys for job records
+
+    Claimed jobs move to a processing list, with their claim time in a hash,
+    so the jobs of a worker that died mid-compile go back to the queue.
+    """
+
+    QUEUE_KEY = "latextopdf:jobs:queue"
+    PROCESSING_KEY = "latextopdf:jobs:processing"
+    CLAIMS_KEY = "latextopdf:jobs:claims"
+
+    # Pop and record the claim in one step, so a crash cannot lose the job
+    CLAIM_SCRIPT = """
+        local job_id = redis.call('RPOPLPUSH', KEYS[1], KEYS[2])
+        if job_id then
+            redis.call('HSET', KEYS[3], job_id, ARGV[1])
+        end
+        return job_id
+    """
+    # The queue is consumed from the right, so RPUSH makes the job the next
+    # one; only the caller that removed it from the processing list pushes it
+    REQUEUE_SCRIPT = """
+        local removed = redis.call('LREM', KEYS[2], 0, ARGV[1])
+        redis.call('HDEL', KEYS[3], ARGV[1])
+        if removed > 0 then
+            redis.call('RPUSH', KEYS[1], ARGV[1])
+        end
+        return removed
+    """
+
+    def __init__(self, url: str, ttl: int, stale_after: int, client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("JOB_BACKEND=redis requires the 'redis' package")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self._claim = self.client.register_script(self.CLAIM_SCRIPT)
+        self._requeue = self.client.register_script(self.REQUEUE_SCRIPT)
+        self._keys = [self.QUEUE_KEY, self.PROCESSING_KEY, self.CLAIMS_KEY]
+
+    def _key(self, job_id: str, suffix: str = "") -> str:
+        return f"latextopdf:job:{job_id}{suffix}"
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self.client.set(self._key(record["id"]), json.dumps(record), ex=self.ttl)
+
+    def enqueue(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        record = _new_record(payload)
+        pipe = self.client.pipeline()
+        pipe.set(self._key(record["id"]), json.dumps(record), ex=self.ttl)
+        pipe.set(self._key(record["id"], ":payload"), json.dumps(payload), ex=self.ttl)
+        pipe.lpush(self.QUEUE_KEY, record["id"])
+        pipe.execute()
+        return record
+
+    def _requeue_stale(self) -> None:
+        # Jobs whose worker died mid-compile go back to the queue
+        cutoff = time.time() - self.stale_after
+        for job_id, claimed_at in self.client.hgetall(self.CLAIMS_KEY).items():
+            if float(claimed_at) < cutoff:
+                job_id = job_id.decode("utf-8")
+                logger.warning(f"Job {job_id} claimed {time.time() - float(claimed_at):.0f}s ago, requeueing it")
+                self.requeue(job_id)
+
+    def _unclaim(self, job_id: str) -> None:
+        pipe = self.client.pipeline()
+        pipe.lrem(self.PROCESSING_KEY, 0, job_id)
+        pipe.hdel(self.CLAIMS_KEY, job_id)
+        pipe.execute()
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        self._requeue_stale()
+        job_id = self._claim(keys=self._keys, args=[time.time()])
+        if job_id is None:
+            return None
+        job_id = job_id.decode("utf-8")
+        record = self.get(job_id)
+        payload = self.client.get(self._key(job_id, ":payload"))
+        if record is None or payload is None or record["status"] in (JOB_DONE, JOB_FAILED):
+            # Expired, or finished by a worker that was only presumed dead
+            self._unclaim(job_id)
+            return None
+        record.update(status=JOB_RUNNING, started_at=time.time(), worker=worker_id)
+        self._write(record)
+        record["payload"] = json.loads(payload)
+        return record
+
+    def _update(self, job_id: str, **changes: Any) -> None:
+        record = self.get(job_id)
+        if record is None:
+            return
+        record.update(changes)
+        self._write(record)
+        self.client.delete(self._key(job_id, ":payload"))
+        self._unclaim(job_id)
+
+    def complete(self, job_id: str, pdf: Union[bytes, pathlib.Path], info: Dict[str, Any]) -> None:
+        if not isinstance(pdf, bytes):
+            pdf = pdf.read_bytes()
+        self.client.set(self._key(job_id, ":pdf"), pdf, ex=self.ttl)
+        self._update(job_id, status=JOB_DONE, finished_at=time.time(), info=info)
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._update(job_id, status=JOB_FAILED, finished_at=time.time(), error=error)
+
+    def requeue(self, job_id: str) -> None:
+        if not self._requeue(keys=self._keys, args=[job_id]):
+            return
+        record = self.get(job_id)
+        if record is not None:
+            record.update(status=JOB_QUEUED, started_at=None, worker=None)
+            self._write(record)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.get(self._key(job_id))
+        return json.loads(raw) if raw else None
+
+    def get_result(self, job_id: str) -> Optional[bytes]:
+        return self.client.get(self._key(job_id, ":pdf"))
+
+    def depth(self) -> int:
+        return self.client.llen(self.QUEUE_KEY)
+
+
+_store: Optional[JobStore] = None
+
+
+def job_store_created() -> bool:
+    """
+    Whether get_job_store() has been called in this process
+    """
+    return _store is not None
+
+
+def get_job_store() -> JobStore:
+    """
+    Return the configured job store (JOB_BACKEND=sqlite|redis)
+    """
+    global _store
+    if _store is None:
+        if config.JOB_BACKEND == "redis":
+            _store = RedisJobStore(
+                config.JOB_REDIS_URL, ttl=config.JOB_RESULT_TTL, stale_after=config.JOB_STALE_SECONDS
+            )
+        elif config.JOB_BACKEND == "sqlite":
+            _store = SQLiteJobStore(
+                config.JOB_SQLITE_PATH,
+                config.JOB_RESULT_DIR,
+                ttl=config.JOB_RESULT_TTL,
+                stale_after=config.JOB_STALE_SECONDS,
+            )
+        else:
+            raise ValueError(f"Unknown JOB_BACKEND: {config.JOB_BACKEND}")
+        logger.info(f"Using job store backend: {config.JOB_BACKEND}")
+    return _store
@@ -2,238 +2,637 @@
 LaTeX compilation services for generating PDF documents
 """
 
+import os
+import shutil
 import subprocess
-import tempfile
 import pathlib
 import json
 import logging
 import asyncio
-from typing import Dict, Any
+import hashlib
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Collection, Dict, Any, Optional, Tuple, Union
 from datetime import datetime
 
-from .image_processor import extract_and_download_urls, process_images
-from ..templates.question_template import get_question_latex_template
+from .. import config
+from .compile_pool import compile_pool, run_command, tex_environment, tex_limits, tex_restrictions
+from .compile_sessions import session_store
+from .format_cache import format_cache
+from .fragment_cache import FRAGMENT_DIR, fragment_cache
+from .image_processor import prefetch_document_assets
+from .metrics import StageTimings, observe_pdf_size, record_failure
+from .output_area import new_output_path, release
+from .pdf_cache import compute_cache_key, pdf_cache
+from .pdf_encryption import PdfEncryptionError, pdf_encryptor
+from .tex_lint import WARNING as LINT_WARNING, lint_question_paper
+from .tex_log import ErrorLocator, LatexError, TexLogParser, question_fields
+from .tex_profiler import build_profile_report
+from .workspace_pool import workspace_pool, write_if_changed
+from ..templates.question_renderer import get_renderer_version, render_question_document
+from ..templates.question_template import get_question_latex_template, get_template_version
+from ..templates.scripts import SCRIPTS, detect_scripts, script_set_label
 
 logger = logging.getLogger(__name__)
 
 
-def encrypt_pdf_with_password(pdf_bytes: bytes, password: str) -> bytes:
+def _move_to_output_area(pdf_file: pathlib.Path) -> pathlib.Path:
     """
-    Encrypt PDF with password using pdftk or qpdf
+    Move a finished PDF out of its workspace into the output area
+    """
+    output_path = new_output_path()
+    try:
+        os.replace(pdf_file, output_path)
+    except OSError:
+        # Workspace and output area on different filesystems
+        shutil.move(str(pdf_file), str(output_path))
+    return output_path
+
+
+def _copy_to_output_area(pdf_file: pathlib.Path) -> pathlib.Path:
+    """
+    Place a PDF that stays in its workspace into the output area
+    """
+    output_path = new_output_path()
+    try:
+        # Safe to share: a recompile replaces the workspace file, never rewrites it
+        os.link(pdf_file, output_path)
+    except OSError:
+        shutil.copyfile(pdf_file, output_path)
+    return output_path
+
+
+# Log messages from LaTeX and common packages asking for another pass
+RERUN_PATTERN = re.compile(
+    r"Rerun to get|Label\(s\) may have changed|Please rerun LaTeX|"
+    r"Rerun LaTeX|\(rerunfilecheck\)|Temporary extra page"
+)
+
+# Commands whose output depends on the .aux file of a previous pass
+REFERENCE_PATTERN = re.compile(
+    r"\\(?:pageref|ref|eqref|autoref|nameref|zref|zpageref|ztotpages|cite|"
+    r"tableofcontents|listoffigures|listoftables)\b|LastPage|TotPages"
+)
+
+
+def _uses_references(*sources: str) -> bool:
+    """
+    Check whether any source text depends on cross-reference data
+    """
+    return any(REFERENCE_PATTERN.search(source) for source in sources)
+
+
+def _aux_digest(workdir: pathlib.Path, jobname: str) -> Optional[str]:
+    """
+    Hash the auxiliary files that feed the next LaTeX pass
+    """
+    digest = hashlib.sha256()
+    found = False
+    for suffix in (".aux", ".toc", ".lof", ".lot"):
+        aux_file = workdir / f"{jobname}{suffix}"
+        if aux_file.exists():
+            digest.update(aux_file.read_bytes())
+            found = True
+    return digest.hexdigest() if found else None
+
+
+def _needs_rerun(
+    workdir: pathlib.Path, jobname: str, previous_digest: Optional[str], uses_references: bool
+) -> Tuple[bool, Optional[str]]:
+    """
+    Decide latexmk-style whether another pass is needed
     
     Args:
-        pdf_bytes: Original PDF bytes
-        password: Password to encrypt with
+        workdir: Compilation directory
+        jobname: Base name of the document
+        previous_digest: Auxiliary file hash from before the last pass
+        uses_references: Whether the document reads back cross-reference data
         
     Returns:
-        Encrypted PDF bytes
-        
-    Raises:
-        RuntimeError: If encryption fails
+        Tuple of (rerun needed, auxiliary file hash after the last pass)
     """
-    logger.info("Encrypting PDF with password")
+    digest = _aux_digest(workdir, jobname)
+    if not uses_references:
+        return False, digest
     
-    with tempfile.TemporaryDirectory() as tmpdir:
-        tmpdir = pathlib.Path(tmpdir)
-        input_pdf = tmpdir / "input.pdf"
-        output_pdf = tmpdir / "output.pdf"
-        
-        input_pdf.write_bytes(pdf_bytes)
-        
-        # Try qpdf first (more commonly available)
-        try:
-            cmd = [
-                "qpdf",
-                "--encrypt", password, password, "128",
-                "--print=full", "--modify=full", "--extract=n",
-                str(input_pdf), str(output_pdf)
-            ]
-            
-            proc = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=30
-            )
-            
-            if proc.returncode == 0 and output_pdf.exists():
-                logger.info("PDF encrypted successfully using qpdf")
-                return output_pdf.read_bytes()
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            logger.warning("qpdf not available, trying pdftk")
-        
-        # Try pdftk as fallback
-        try:
-            cmd = [
-                "pdftk",
-                str(input_pdf),
-                "output", str(output_pdf),
-                "user_pw", password,
-                "owner_pw", password
-            ]
-            
-            proc = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=30
-            )
-            
-            if proc.returncode == 0 and output_pdf.exists():
-                logger.info("PDF encrypted successfully using pdftk")
-                return output_pdf.read_bytes()
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            logger.warning("pdftk not available")
+    log_file = workdir / f"{jobname}.log"
+    log_text = log_file.read_text(encoding="utf-8", errors="replace") if log_file.exists() else ""
+    return digest != previous_digest or bool(RERUN_PATTERN.search(log_text)), digest
+
+
+def compile_timeout(text_bytes: int, image_bytes: int = 0) -> float:
+    """
+    Derive the wall-clock budget of a compile from the size of the document
+    
+    Args:
+        text_bytes: Size of the document text
+        image_bytes: Size of the images it includes
         
-        # If neither tool is available, return unencrypted PDF
-        logger.warning("No PDF encryption tool available, returning unencrypted PDF")
-        return pdf_bytes
+    Returns:
+        Seconds all passes together may take
+    """
+    seconds = (
+        config.LATEX_TIMEOUT_MIN
+        + text_bytes / 1024 * config.LATEX_TIMEOUT_PER_TEXT_KB
+        + image_bytes / (1024 * 1024) * config.LATEX_TIMEOUT_PER_IMAGE_MB
+    )
+    return min(config.LATEX_TIMEOUT_MAX, seconds)
 
 
-def compile_latex(latex_source: str, engine: str = "pdflatex") -> bytes:
+def _question_paper_size(data: Dict[str, Any], workdir: pathlib.Path) -> Tuple[int, int]:
+    """
+    Return the bytes of question text and of the images and fragments in the workspace
+    """
+    text_bytes = sum(len(text.encode("utf-8")) for text in question_fields(data).values())
+    image_bytes = 0
+    for directory in (workdir / "Photo", workdir / FRAGMENT_DIR):
+        if directory.exists():
+            image_bytes += sum(path.stat().st_size for path in directory.rglob("*") if path.is_file())
+    return text_bytes, image_bytes
+
+
+@dataclass
+class CompileResult:
+    """
+    Outcome of a question paper compilation
+
+    The PDF is either held in memory (small cache hits) or is a file, which
+    is owned by the PDF cache or, for uncached results, by the output area
+    until release() is called. Results that are not_modified carry no PDF.
+    """
+    etag: str
+    pdf_bytes: Optional[bytes] = None
+    pdf_path: Optional[pathlib.Path] = None
+    cache_hit: bool = False
+    not_modified: bool = False
+    passes: int = 0
+    timings: StageTimings = field(default_factory=StageTimings)
+    profile: Optional[Dict[str, Any]] = None
+    scripts: Tuple[str, ...] = SCRIPTS
+
+    @property
+    def script_set(self) -> str:
+        return script_set_label(self.scripts)
+
+    @property
+    def pdf(self) -> Union[bytes, pathlib.Path]:
+        return self.pdf_bytes if self.pdf_bytes is not None else self.pdf_path
+
+    @property
+    def size(self) -> int:
+        if self.pdf_bytes is not None:
+            return len(self.pdf_bytes)
+        return self.pdf_path.stat().st_size
+
+    def read_bytes(self) -> bytes:
+        """
+        Return the PDF contents, reading the file if needed
+        """
+        if self.pdf_bytes is not None:
+            return self.pdf_bytes
+        return self.pdf_path.read_bytes()
+
+    def release(self) -> None:
+        """
+        Delete the PDF file if it is a per-request output file
+        """
+        release(self.pdf_path)
+
+    def _set_pdf(self, pdf: Union[bytes, pathlib.Path]) -> None:
+        if isinstance(pdf, bytes):
+            self.pdf_bytes = pdf
+        else:
+            self.pdf_path = pdf
+
+
+LATEX_ENGINES = ("pdflatex", "lualatex", "xelatex")
+
+
+async def compile_latex(
+    latex_source: str,
+    engine: str = "pdflatex",
+    session_id: Optional[str] = None,
+    timings: Optional[StageTimings] = None
+) -> CompileResult:
     """
     Compile LaTeX source code to PDF
     
     Args:
         latex_source: LaTeX source code
         engine: LaTeX engine to use (pdflatex, lualatex, xelatex)
+        session_id: Compile in the warm workspace of this session, keeping
+            .aux, .toc and other auxiliary files for the next request
+        timings: Stage timings to continue, e.g. with the request parse time
         
     Returns:
-        PDF file as bytes
+        CompileResult with the PDF file and a hash of engine and source as ETag
         
     Raises:
         ValueError: If engine is not supported
+        LatexError: If the engine reports an error
         RuntimeError: If compilation fails
+        CompilePoolFullError: If no compile slot is available
     """
     logger.info(f"Starting LaTeX compilation with engine: {engine}")
     
-    valid_engines = {"pdflatex", "lualatex", "xelatex"}
-    if engine not in valid_engines:
+    if engine not in LATEX_ENGINES:
         logger.error(f"Unsupported LaTeX engine: {engine}")
-        raise ValueError(f"Engine must be one of {valid_engines}")
+        raise ValueError(f"Engine must be one of {', '.join(LATEX_ENGINES)}")
+    
+    etag = hashlib.sha256(f"{engine}\0{latex_source}".encode("utf-8")).hexdigest()
+    result = CompileResult(etag=etag, timings=timings if timings is not None else StageTimings())
+    try:
+        if session_id is None:
+            async with workspace_pool.workspace() as workdir:
+                result.pdf_path = await _run_latex(latex_source, engine, workdir, result, warm=False)
+        else:
+            async with session_store.session(session_id) as session:
+                if session.engine != engine:
+                    # Auxiliary files of another engine are not compatible
+                    await asyncio.to_thread(session.reset)
+                    session.engine = engine
+                result.pdf_path = await _run_latex(latex_source, engine, session.workdir, result, warm=True)
+        return result
+    except Exception as e:
+        record_failure(e)
+        raise
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        tmpdir = pathlib.Path(tmpdir)
-        tex_file = tmpdir / "document.tex"
-        
-        logger.info(f"Writing LaTeX source to temporary file: {tex_file}")
-        tex_file.write_text(latex_source, encoding="utf-8")
-        
+
+async def _run_latex(
+    latex_source: str,
+    engine: str,
+    workdir: pathlib.Path,
+    result: CompileResult,
+    warm: bool
+) -> pathlib.Path:
+    """
+    Run the passes a document needs in a workspace
+    
+    In a warm (session) workspace the previous compile's .aux file is the
+    baseline, so a pass that leaves it unchanged is the last one, and an
+    unchanged document is not compiled again at all.
+    
+    Returns:
+        Path of the finished PDF in the output area
+    """
+    timings = result.timings
+    tex_file = workdir / "document.tex"
+    pdf_file = workdir / "document.pdf"
+    
+    with timings.stage("write"):
+        changed = write_if_changed(tex_file, latex_source)
+    
+    if changed or not pdf_file.exists():
+        # Replaced rather than rewritten in place: the last PDF may still be streaming
+        pdf_file.unlink(missing_ok=True)
         cmd = [
             engine,
             "-interaction=nonstopmode",
             "-halt-on-error",
+            "-file-line-error",
+            *tex_restrictions(engine),
             "document.tex",
         ]
+        env = tex_environment()
+        limits = tex_limits()
+        uses_references = _uses_references(latex_source)
+        aux_digest = _aux_digest(workdir, "document") if warm else None
+        timeout = compile_timeout(len(latex_source.encode("utf-8")))
+        deadline = time.monotonic() + timeout
         
-        for _ in range(2):
-            proc = subprocess.run(
-                cmd,
-                cwd=tmpdir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=30
-            )
-            
-            if proc.returncode != 0:
-                error_msg = f"LaTeX compilation failed:\n{proc.stdout}\n{proc.stderr}"
-                logger.error(error_msg)
-                raise RuntimeError(error_msg)
-        
-        pdf_file = tmpdir / "document.pdf"
-        if not pdf_file.exists():
-            logger.error("PDF file was not generated after compilation")
-            raise RuntimeError("PDF was not generated")
-        
-        pdf_bytes = pdf_file.read_bytes()
-        logger.info(f"LaTeX compilation successful, generated PDF: {len(pdf_bytes)} bytes")
-        return pdf_bytes
+        queued_at = time.perf_counter()
+        async with compile_pool.slot():
+            timings.add("queue", time.perf_counter() - queued_at)
+            while result.passes < config.LATEX_MAX_PASSES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+                parser = TexLogParser(fail_fast=config.LATEX_FAIL_FAST)
+                with timings.stage(f"{engine}_{result.passes + 1}", metric=f"{engine}_pass"):
+                    try:
+                        returncode, stdout, stderr = await run_command(
+                            cmd, cwd=workdir, timeout=remaining, env=env, on_output=parser.feed, limits=limits
+                        )
+                    except subprocess.TimeoutExpired:
+                        raise subprocess.TimeoutExpired(cmd, timeout) from None
+                result.passes += 1
+                parser.finish()
+                
+                if returncode != 0 or parser.failed:
+                    pdf_file.unlink(missing_ok=True)
+                    if parser.failed:
+                        raise parser.exception()
+                    error_msg = f"LaTeX compilation failed:\n{stdout[-4000:]}\n{stderr}"
+                    logger.error(error_msg)
+                    raise RuntimeError(error_msg)
+                
+                rerun, aux_digest = _needs_rerun(workdir, "document", aux_digest, uses_references)
+                if not rerun:
+                    break
+    
+    logger.info(f"LaTeX compilation finished after {result.passes} pass(es)")
+    
+    if not pdf_file.exists():
+        logger.error("PDF file was not generated after compilation")
+        raise RuntimeError("PDF was not generated")
+    
+    if warm:
+        # The session keeps its PDF for an unchanged next request
+        output_path = await asyncio.to_thread(_copy_to_output_area, pdf_file)
+    else:
+        output_path = await asyncio.to_thread(_move_to_output_area, pdf_file)
+    size = output_path.stat().st_size
+    observe_pdf_size(size)
+    logger.info(f"LaTeX compilation successful, generated PDF: {size} bytes")
+    return output_path
 
 
-async def compile_question_paper(question_data: Dict[str, Any]) -> bytes:
+async def compile_question_paper(
+    question_data: Dict[str, Any],
+    use_cache: bool = True,
+    timings: Optional[StageTimings] = None,
+    profile: bool = False,
+    trusted: bool = False,
+    known_etags: Optional[Collection[str]] = None
+) -> CompileResult:
     """
     Compile a question paper from structured data to PDF
     
     Args:
         question_data: Dictionary containing question paper structure and content
+        use_cache: Whether to serve and store the result via the PDF cache
+        timings: Stage timings to continue, e.g. with the request parse time
+        profile: Collect a LuaTeX profiling report (implies use_cache=False)
+        trusted: Built-in content such as the warm-up sample, compiled
+            without --safer so LuaLaTeX can write its font caches
+        known_etags: ETags the client already holds (If-None-Match); when
+            the cache key is one of them nothing is compiled
         
     Returns:
-        PDF file as bytes
+        CompileResult with the PDF bytes or file and its cache key as ETag,
+        or without a PDF and not_modified set
         
     Raises:
+        LatexError: If the question text has errors (lint or LuaLaTeX)
         RuntimeError: If compilation fails
+        CompilePoolFullError: If no compile slot is available
+        PdfEncryptionError: If password protection is requested but unavailable
     """
     qp_code = question_data.get('qp_code', 'unknown')
     password_enabled = question_data.get('password', False)
     logger.info(f"Starting question paper compilation for: {qp_code}, password protection: {password_enabled}")
     
-    with tempfile.TemporaryDirectory() as tmpdir:
-        tmpdir = pathlib.Path(tmpdir)
-        
-        reports_dir = tmpdir / "Reports"
-        reports_dir.mkdir()
-        
-        photo_dir = tmpdir / "Photo" / "Qpbank"
-        photo_dir.mkdir(parents=True)
+    try:
+        if password_enabled and not pdf_encryptor.available:
+            # Fail before spending a compile on output that cannot be protected
+            raise PdfEncryptionError("Password protection is unavailable: no PDF encryption backend installed")
         
-        logger.info(f"Processing images for question paper: {qp_code}")
-        await process_images(question_data.get('images', {}), photo_dir)
+        timings = timings if timings is not None else StageTimings()
+        # A queue place is taken before any preparation, so a full instance
+        # answers 503 at once; then a reset workspace from the pool, with
+        # Reports/ and Photo/Qpbank/ in place
+        async with compile_pool.reserve() as reservation, workspace_pool.workspace() as tmpdir:
+            photo_dir = tmpdir / "Photo" / "Qpbank"
+            
+            logger.info(f"Processing images for question paper: {qp_code}")
+            with timings.stage("images"):
+                processed_data = await prefetch_document_assets(question_data, photo_dir)
+            
+            if config.LATEX_LINT_ENABLED:
+                with timings.stage("lint"):
+                    issues = await asyncio.to_thread(lint_question_paper, processed_data, tmpdir)
+                for issue in issues:
+                    if issue["severity"] == LINT_WARNING:
+                        logger.warning(f"Question paper check for {qp_code} in {issue['location']}: {issue['message']}")
+                errors = [issue for issue in issues if issue["severity"] != LINT_WARNING]
+                if errors:
+                    where = f" in {errors[0]['location']}"
+                    more = f" (and {len(errors) - 1} more)" if len(errors) > 1 else ""
+                    raise LatexError(f"Question paper check failed{where}: {errors[0]['message']}{more}", errors, stage="lint")
+            
+            # The password is the current date, so protected output rotates daily
+            password = datetime.now().strftime("%Y%m%d") if password_enabled else None
+            password_key = f"{password}:{pdf_encryptor.fingerprint()}" if password else None
+            with timings.stage("cache_key"):
+                # Only the languages and fonts of the scripts in use are loaded
+                scripts = detect_scripts(processed_data) if config.SCRIPT_DETECTION_ENABLED else SCRIPTS
+                source_version = (
+                    f"{_source_version()}:{script_set_label(scripts)}:"
+                    f"{pdf_encryptor.optimize_fingerprint(protected=bool(password))}"
+                )
+                cache_key = await asyncio.to_thread(
+                    compute_cache_key, processed_data, photo_dir, source_version, password_key
+                )
+            logger.info(f"Script set for {qp_code}: {script_set_label(scripts)}")
+            
+            result = CompileResult(etag=cache_key, timings=timings, scripts=scripts)
+            if known_etags and cache_key in known_etags and not profile:
+                # Answered before taking a compile slot or touching the cache
+                logger.info(f"PDF unchanged for {qp_code}, skipping compilation")
+                result.not_modified = True
+                return result
+            if profile:
+                # Profiled runs must really compile and are not worth caching
+                use_cache = False
+                processed_data = {**processed_data, "_profile": True}
+            use_fragments = bool(question_data.get("fragment_cache")) and fragment_cache.enabled
+            
+            async def compile_fn() -> pathlib.Path:
+                data = processed_data
+                if use_fragments:
+                    # Before taking a slot: snippet compiles use the pool themselves
+                    with timings.stage("fragments"):
+                        data = await fragment_cache.assemble(processed_data, tmpdir)
+                queued_at = time.perf_counter()
+                async with compile_pool.slot(reservation):
+                    timings.add("queue", time.perf_counter() - queued_at)
+                    return await _run_question_paper_tex(
+                        data, tmpdir, qp_code, password, result, processed_data, trusted
+                    )
+            
+            if use_cache:
+                pdf, result.cache_hit = await pdf_cache.get_or_compile(cache_key, compile_fn)
+                result._set_pdf(pdf)
+            else:
+                result.pdf_path = await compile_fn()
+            return result
+    except Exception as e:
+        record_failure(e)
+        raise
+
+
+def _source_version() -> str:
+    """
+    Identify the TeX source layout for the PDF cache key
+    """
+    if _render_engine() == "python":
+        return f"python:{get_renderer_version()}"
+    return get_template_version()
+
+
+def _render_engine(profile: bool = False) -> str:
+    """
+    Return the engine producing the question paper body: "lua" (the template
+    reads question.json with dkjson) or "python" (static rendered source)
+    """
+    if config.RENDER_ENGINE not in ("lua", "python"):
+        raise ValueError(f"Unknown RENDER_ENGINE: {config.RENDER_ENGINE}")
+    # Profiling markers are printed by the Lua loop
+    return "lua" if profile else config.RENDER_ENGINE
+
+
+async def _run_question_paper_tex(
+    processed_data: Dict[str, Any],
+    tmpdir: pathlib.Path,
+    qp_code: str,
+    password: Optional[str],
+    result: CompileResult,
+    source_data: Optional[Dict[str, Any]] = None,
+    trusted: bool = False
+) -> pathlib.Path:
+    """
+    Run LuaLaTeX over a prepared question paper workspace
+    
+    Args:
+        processed_data: Question paper data with local image paths
+        tmpdir: Workspace containing Reports/ and Photo/Qpbank/
+        qp_code: Question paper code, used for logging
+        password: Password to encrypt the PDF with, or None
+        result: Compile result to record pass counts, stage timings and the
+            profiling report (when processed_data has _profile set) on
+        source_data: Question paper data to locate TeX errors in, when
+            processed_data has questions replaced by fragments
+        trusted: Run LuaLaTeX without --safer (built-in content only)
         
-        processed_data = question_data.copy()
-        for part in processed_data.get('qp_parts', []):
-            for i, content in enumerate(part.get('content', [])):
-                processed_content = await extract_and_download_urls(content, photo_dir)
-                part['content'][i] = processed_content
+    Returns:
+        Path of the finished PDF in the output area
         
+    Raises:
+        LatexError: If LuaLaTeX reports an error in the question text
+        ResourceLimitError: If LuaLaTeX exceeds its CPU, memory or output limit
+        subprocess.TimeoutExpired: If the passes exceed the compile's time budget
+        RuntimeError: If compilation fails
+    """
+    reports_dir = tmpdir / "Reports"
+    timings = result.timings
+    
+    profile = bool(processed_data.get("_profile"))
+    tex_file = tmpdir / "question.tex"
+    document = None
+    
+    if _render_engine(profile) == "python":
+        logger.info(f"Rendering TeX source for question paper: {qp_code}")
+        with timings.stage("render"):
+            document = render_question_document(processed_data, result.scripts)
+            write_if_changed(tex_file, document)
+        content_text = document.split("\\begin{document}", 1)[1]
+    else:
         logger.info(f"Writing JSON data for question paper: {qp_code}")
-        json_file = reports_dir / "question.json"
-        json_file.write_text(json.dumps(processed_data, ensure_ascii=False), encoding="utf-8")
-        
-        latex_template = get_question_latex_template()
-        tex_file = tmpdir / "question.tex"
-        tex_file.write_text(latex_template, encoding="utf-8")
-        
-        logger.info(f"Starting LuaLaTeX compilation for question paper: {qp_code}")
-        
-        cmd = [
-            "lualatex",
-            "-interaction=nonstopmode",
-            "question.tex",
-        ]
-        
-        for i in range(2):
-            proc = subprocess.run(
-                cmd,
-                cwd=tmpdir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=60
-            )
+        with timings.stage("json_write"):
+            json_file = reports_dir / "question.json"
+            content_text = json.dumps(processed_data, ensure_ascii=False)
+            json_file.write_text(content_text, encoding="utf-8")
             
-            if i == 1 and proc.returncode != 0:
-                logger.warning(f"LuaLaTeX returned non-zero exit code: {proc.returncode}")
-        
-        pdf_file = tmpdir / "question.pdf"
-        if not pdf_file.exists():
-            error_msg = f"PDF was not generated - file does not exist after compilation\nSTDOUT:\n{proc.stdout}\n\nSTDERR:\n{proc.stderr}"
-            logger.error(error_msg)
-            raise RuntimeError(error_msg)
-        
-        pdf_bytes = pdf_file.read_bytes()
-        if len(pdf_bytes) == 0:
-            error_msg = f"PDF was generated but is empty (0 bytes)\nSTDOUT:\n{proc.stdout}\n\nSTDERR:\n{proc.stderr}"
-            logger.error(error_msg)
-            raise RuntimeError(error_msg)
-        
-        # Apply password protection if requested
-        if password_enabled:
-            current_date = datetime.now().strftime("%Y%m%d")
-            logger.info(f"Applying password protection with date-based password: {current_date}")
-            pdf_bytes = encrypt_pdf_with_password(pdf_bytes, current_date)
+            latex_template = get_question_latex_template(result.scripts)
+            write_if_changed(tex_file, latex_template)
+    
+    logger.info(f"Starting LuaLaTeX compilation for question paper: {qp_code}")
+    
+    cmd = [
+        "lualatex",
+        "-interaction=nonstopmode",
+        "-file-line-error",
+        "question.tex",
+    ]
+    env = tex_environment()
+    # Profiling writes Reports/profile.json from Lua, which --safer forbids;
+    # /debug/profile is only enabled with DEBUG_ENDPOINTS_ENABLED
+    cmd[1:1] = ["-no-shell-escape"] if profile or trusted else tex_restrictions()
+    if profile:
+        # The .fls file lists every file LuaTeX opened
+        cmd.insert(1, "-recorder")
+    
+    with timings.stage("format"):
+        format_name = await format_cache.ensure()
+    if format_name:
+        logger.info(f"Using precompiled format: {format_name}")
+        cmd.insert(1, f"-fmt={format_name}")
+    
+    # Only lastpage/zref-totpages style references need the aux file of a
+    # previous pass, so most papers are done after a single run
+    uses_references = _uses_references(content_text)
+    aux_digest = None
+    
+    source_data = source_data if source_data is not None else processed_data
+    locator = ErrorLocator(source_data, document)
+    limits = tex_limits()
+    # One budget for all passes, so a runaway document cannot take it per pass
+    timeout = compile_timeout(*await asyncio.to_thread(_question_paper_size, source_data, tmpdir))
+    deadline = time.monotonic() + timeout
+    
+    while result.passes < config.LATEX_MAX_PASSES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        parser = TexLogParser(locator, fail_fast=config.LATEX_FAIL_FAST)
+        with timings.stage(f"lualatex_{result.passes + 1}", metric="lualatex_pass"):
+            try:
+                returncode, stdout, stderr = await run_command(
+                    cmd, cwd=tmpdir, timeout=remaining, env=env, on_output=parser.feed, limits=limits
+                )
+            except subprocess.TimeoutExpired:
+                raise subprocess.TimeoutExpired(cmd, timeout) from None
+        result.passes += 1
+        parser.finish()
         
-        logger.info(f"PDF generated successfully: {len(pdf_bytes)} bytes")
-        return pdf_bytes
+        if parser.fatal:
+            # Another pass would only repeat the error
+            break
+        rerun, aux_digest = _needs_rerun(tmpdir, "question", aux_digest, uses_references)
+        if not rerun:
+            break
+    
+    if parser.failed:
+        error = parser.exception()
+        # Recoverable errors still leave a PDF, as in plain nonstopmode
+        if parser.fatal or not (tmpdir / "question.pdf").exists():
+            logger.error(f"LuaLaTeX failed for {qp_code}: {error}")
+            raise error
+        logger.warning(f"LuaLaTeX reported errors for {qp_code}: {error}")
+    if returncode != 0:
+        logger.warning(f"LuaLaTeX returned non-zero exit code: {returncode}")
+    logger.info(f"LuaLaTeX finished after {result.passes} pass(es) for: {qp_code}")
+    
+    if profile:
+        result.profile = await asyncio.to_thread(build_profile_report, tmpdir, "question", processed_data)
+    
+    pdf_file = tmpdir / "question.pdf"
+    if not pdf_file.exists():
+        error_msg = f"PDF was not generated - file does not exist after compilation\nSTDOUT:\n{stdout}\n\nSTDERR:\n{stderr}"
+        logger.error(error_msg)
+        raise RuntimeError(error_msg)
+    
+    if pdf_file.stat().st_size == 0:
+        error_msg = f"PDF was generated but is empty (0 bytes)\nSTDOUT:\n{stdout}\n\nSTDERR:\n{stderr}"
+        logger.error(error_msg)
+        raise RuntimeError(error_msg)
+    
+    # Apply password protection if requested; optimization happens in the same pass
+    if password:
+        logger.info(f"Applying password protection with date-based password: {password}")
+        encrypted_file = tmpdir / "question-encrypted.pdf"
+        with timings.stage("encrypt"):
+            await pdf_encryptor.encrypt_file(pdf_file, encrypted_file, password)
+        pdf_file = encrypted_file
+    elif pdf_encryptor.optimizes(protected=False):
+        optimized_file = tmpdir / "question-optimized.pdf"
+        with timings.stage("optimize"):
+            if await pdf_encryptor.optimize_file(pdf_file, optimized_file):
+                pdf_file = optimized_file
+    
+    output_path = await asyncio.to_thread(_move_to_output_area, pdf_file)
+    size = output_path.stat().st_size
+    observe_pdf_size(size)
+    logger.info(f"PDF generated successfully: {size} bytes")
+    return output_path
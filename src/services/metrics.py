@@ -0,0 +1,181 @@
+"""
+Per-stage timing and Prometheus metrics
+
+Every compile records how long each stage took (request parsing, images,
+JSON write, each LuaLaTeX pass, encryption, response). The durations are
+sent back in a Server-Timing header and, when prometheus_client is
+installed, exported as histograms on /metrics together with pool, queue
+and cache gauges, PDF sizes and failure counts by cause.
+"""
+
+import logging
+import subprocess
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from .. import config
+from .compile_pool import CompilePoolFullError, ResourceLimitError, compile_pool
+from .fragment_cache import fragment_cache
+from .image_cache import image_cache
+from .job_queue import get_job_store, job_store_created
+from .pdf_cache import pdf_cache
+from .pdf_encryption import PdfEncryptionError, pdf_encryptor
+from .tex_log import LatexError
+
+logger = logging.getLogger(__name__)
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:  # pragma: no cover - optional dependency
+    REGISTRY = None
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PDF_SIZE_BUCKETS = (
+    10_000, 50_000, 100_000, 250_000, 500_000,
+    1_000_000, 2_500_000, 5_000_000, 10_000_000, 25_000_000,
+)
+
+
+class _ServiceCollector:
+    """
+    Exposes the counters kept by the pool, caches and job store at scrape time
+    """
+
+    def collect(self):
+        pool = compile_pool.stats()
+        yield GaugeMetricFamily("latextopdf_compiles_active", "Compiles holding a pool slot", value=pool["active"])
+        yield GaugeMetricFamily("latextopdf_compiles_waiting", "Compiles waiting for a pool slot", value=pool["waiting"])
+        yield GaugeMetricFamily("latextopdf_compile_concurrency", "Size of the compile pool", value=pool["concurrency"])
+        kills = CounterMetricFamily("latextopdf_compile_kills", "Toolchain processes killed by reason", labels=["reason"])
+        for reason, count in sorted(pool["kills"].items()):
+            kills.add_metric([reason], count)
+        yield kills
+
+        lookups = CounterMetricFamily("latextopdf_cache_lookups", "Cache lookups by cache and result", labels=["cache", "result"])
+        ratios = GaugeMetricFamily("latextopdf_cache_hit_ratio", "Cache hit ratio since start", labels=["cache"])
+        for name, stats, results in (
+            ("pdf", pdf_cache.stats(), ("hits", "misses", "coalesced")),
+            ("image", image_cache.stats(), ("hits", "misses", "revalidated", "stale_served")),
+            ("fragment", fragment_cache.stats(), ("hits", "misses", "coalesced")),
+        ):
+            for result in results:
+                lookups.add_metric([name, result], stats[result])
+            ratios.add_metric([name], stats["hit_ratio"])
+        yield lookups
+        yield ratios
+
+        pdf = pdf_encryptor.stats()
+        optimized = CounterMetricFamily("latextopdf_pdf_optimize_bytes", "PDF bytes before and after optimization", labels=["stage"])
+        optimized.add_metric(["before"], pdf["bytes_before"])
+        optimized.add_metric(["after"], pdf["bytes_after"])
+        yield optimized
+
+        if not job_store_created():
+            # Scrapes alone should not open the job store
+            return
+        try:
+            depth = get_job_store().depth()
+        except Exception as e:
+            logger.warning(f"Could not read job queue depth: {e}")
+        else:
+            yield GaugeMetricFamily("latextopdf_job_queue_depth", "Queued asynchronous jobs", value=depth)
+
+
+if REGISTRY is not None and config.METRICS_ENABLED:
+    STAGE_SECONDS = Histogram(
+        "latextopdf_stage_seconds", "Duration of compile stages", ["stage"], buckets=STAGE_BUCKETS
+    )
+    PDF_BYTES = Histogram("latextopdf_pdf_bytes", "Size of compiled PDFs", buckets=PDF_SIZE_BUCKETS)
+    FAILURES = Counter("latextopdf_compile_failures", "Failed compiles by cause", ["cause"])
+    REGISTRY.register(_ServiceCollector())
+else:
+    STAGE_SECONDS = PDF_BYTES = FAILURES = None
+
+
+def metrics_available() -> bool:
+    """
+    Return whether /metrics can be served
+    """
+    return STAGE_SECONDS is not None
+
+
+def render_metrics() -> bytes:
+    """
+    Render all metrics in the Prometheus text format
+    """
+    return generate_latest(REGISTRY)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    if STAGE_SECONDS is not None:
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_pdf_size(size: int) -> None:
+    if PDF_BYTES is not None:
+        PDF_BYTES.observe(size)
+
+
+def failure_cause(error: BaseException) -> str:
+    """
+    Classify a compile exception into a bounded set of metric labels
+    """
+    if isinstance(error, CompilePoolFullError):
+        return "pool_full"
+    if isinstance(error, subprocess.TimeoutExpired):
+        return "timeout"
+    if isinstance(error, PdfEncryptionError):
+        return "encryption"
+    if isinstance(error, ResourceLimitError):
+        return f"{error.limit}_limit"
+    if isinstance(error, LatexError) and error.stage == "lint":
+        return "lint"
+    if isinstance(error, RuntimeError):
+        return "latex_error"
+    return "internal"
+
+
+def record_failure(error: BaseException) -> None:
+    if FAILURES is not None:
+        FAILURES.labels(failure_cause(error)).inc()
+
+
+class StageTimings:
+    """
+    Ordered stage durations of one request
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float, metric: Optional[str] = None) -> None:
+        """
+        Record a stage duration
+
+        Args:
+            name: Stage name in the Server-Timing header
+            seconds: Duration in seconds
+            metric: Histogram label, when several entries share one (e.g. passes)
+        """
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        observe_stage(metric or name, seconds)
+
+    @contextmanager
+    def stage(self, name: str, metric: Optional[str] = None) -> Iterator[None]:
+        """
+        Time the enclosed block as a stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, metric)
+
+    def server_timing(self) -> str:
+        """
+        Format the stages as a Server-Timing header value
+        """
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
@@ -0,0 +1,102 @@
+"""
+Managed output area for compiled PDFs awaiting delivery
+
+Compiles hand back a file path instead of bytes. Files in this directory
+belong to a single request and are deleted once the response has been sent;
+files owned by the PDF cache live elsewhere and are never deleted here.
+"""
+
+import logging
+import os
+import pathlib
+import threading
+import time
+import uuid
+from typing import Dict, Union
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_DIR = pathlib.Path(config.OUTPUT_DIR)
+
+# Extra holders of output files shared by coalesced requests
+_holders: Dict[pathlib.Path, int] = {}
+_holders_lock = threading.Lock()
+
+
+def new_output_path() -> pathlib.Path:
+    """
+    Return a fresh, unique path inside the output area
+    """
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    return OUTPUT_DIR / f"{uuid.uuid4().hex}.pdf"
+
+
+def is_output_file(path: Union[str, pathlib.Path]) -> bool:
+    """
+    Return whether a path is a per-request file of the output area
+    """
+    return pathlib.Path(path).parent == OUTPUT_DIR
+
+
+def retain(path: Union[str, pathlib.Path], count: int = 1) -> None:
+    """
+    Register further holders of an output file
+
+    The file is only deleted once every holder, and the original owner,
+    has called release().
+    """
+    if count <= 0 or not is_output_file(path):
+        return
+    path = pathlib.Path(path)
+    with _holders_lock:
+        _holders[path] = _holders.get(path, 0) + count
+
+
+def release(path: Union[str, pathlib.Path, None]) -> None:
+    """
+    Delete a delivered file if it belongs to the output area and nobody
+    else still holds it
+    """
+    if path is None or not is_output_file(path):
+        return
+    path = pathlib.Path(path)
+    with _holders_lock:
+        holders = _holders.get(path, 0)
+        if holders:
+            if holders == 1:
+                del _holders[path]
+            else:
+                _holders[path] = holders - 1
+            return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def sweep_stale(max_age: int = 3600) -> int:
+    """
+    Remove output files left behind by crashed or aborted requests
+
+    Args:
+        max_age: Minimum age in seconds of files to remove
+
+    Returns:
+        Number of files removed
+    """
+    if not OUTPUT_DIR.exists():
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in OUTPUT_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"Removed {removed} stale output files")
+    return removed
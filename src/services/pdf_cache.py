@@ -0,0 +1,315 @@
+"""
+Content-addressed cache for compiled question paper PDFs
+
+Results are kept in a size-bounded on-disk tier, with small entries also
+held in a byte-bounded in-memory LRU tier. Concurrent requests for the same key share a
+single compile instead of each starting their own LuaLaTeX run.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from .. import config
+from .output_area import is_output_file, new_output_path, release, retain
+
+logger = logging.getLogger(__name__)
+
+
+def compute_cache_key(
+    question_data: Dict[str, Any],
+    photo_dir: pathlib.Path,
+    template_version: str,
+    password_date: Optional[str] = None,
+) -> str:
+    """
+    Build the cache key for a question paper
+
+    Args:
+        question_data: Processed question paper data (image URLs already rewritten)
+        photo_dir: Directory holding the resolved images for the paper
+        template_version: Version hash of the LaTeX template
+        password_date: Date used as the PDF password, if protection is enabled
+
+    Returns:
+        Hex digest identifying the compiled output
+    """
+    digest = hashlib.sha256()
+    digest.update(f"template:{template_version}\n".encode("utf-8"))
+    digest.update(f"password:{password_date or ''}\n".encode("utf-8"))
+
+    # Image sources are represented by the resolved bytes below, not by the
+    # (possibly huge, possibly URL) values of the images dict
+    normalized = {k: v for k, v in question_data.items() if k != "images"}
+    digest.update(json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+
+    if photo_dir.exists():
+        for image_path in sorted(photo_dir.iterdir()):
+            if not image_path.is_file():
+                continue
+            digest.update(f"\nimage:{image_path.name}:".encode("utf-8"))
+            with open(image_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+PdfSource = Union[bytes, pathlib.Path]
+
+
+class PdfCache:
+    """
+    Two-tier LRU cache of compiled PDFs with in-flight request coalescing
+
+    The disk tier holds the files themselves (hard-linked from the output
+    area, so storing costs no copy); small entries are additionally kept in
+    memory. Lookups return bytes from memory or a new output-area link to
+    the disk entry, so evicting the entry while the PDF is being sent only
+    removes the cache's name for it.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        memory_bytes: int,
+        disk_bytes: int,
+        memory_item_bytes: int,
+        enabled: bool = True
+    ):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory_item_bytes = min(memory_item_bytes, memory_bytes)
+        self.enabled = enabled
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._disk_index: Optional[Dict[str, int]] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _disk_path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / f"{key}.pdf"
+
+    def _load_disk_index(self) -> Dict[str, int]:
+        if self._disk_index is None:
+            self._disk_index = {}
+            if self.cache_dir.exists():
+                entries = sorted(self.cache_dir.glob("*.pdf"), key=lambda p: p.stat().st_mtime)
+                for path in entries:
+                    self._disk_index[path.stem] = path.stat().st_size
+        return self._disk_index
+
+    def _remember(self, key: str, pdf_bytes: bytes) -> None:
+        if len(pdf_bytes) > self.memory_item_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = pdf_bytes
+        self._memory_size += len(pdf_bytes)
+        while self._memory_size > self.memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _lookup_disk(self, key: str) -> Optional[pathlib.Path]:
+        index = self._load_disk_index()
+        if key not in index:
+            return None
+        path = self._disk_path(key)
+        pinned = new_output_path()
+        try:
+            os.link(path, pinned)
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted since the index was read, possibly by another process:
+            # a miss, so the paper is compiled again
+            index.pop(key, None)
+            if pinned.exists():
+                pinned.unlink()
+            return None
+        except OSError:
+            # Output area on another filesystem
+            pinned = path
+        # Move to the most recently used end
+        index[key] = index.pop(key)
+        return pinned
+
+    def _store_disk(self, key: str, source: pathlib.Path) -> Optional[pathlib.Path]:
+        size = source.stat().st_size
+        if size > self.disk_bytes:
+            return None
+        index = self._load_disk_index()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._disk_path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            # Different filesystem: fall back to a copy
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+        index.pop(key, None)
+        index[key] = size
+
+        total = sum(index.values())
+        for old_key in list(index):
+            if total <= self.disk_bytes:
+                break
+            total -= index.pop(old_key)
+            try:
+                self._disk_path(old_key).unlink()
+            except FileNotFoundError:
+                pass
+            logger.info(f"Evicted cached PDF from disk: {old_key}")
+        return path
+
+    async def get(self, key: str) -> Optional[PdfSource]:
+        """
+        Look up a PDF in the memory tier, then the disk tier
+
+        Args:
+            key: Cache key from compute_cache_key
+
+        Returns:
+            Cached PDF bytes, an output-area link to the cached file (which
+            the caller releases), or None
+        """
+        if not self.enabled:
+            return None
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        if self.disk_bytes > 0:
+            return await asyncio.to_thread(self._lookup_disk, key)
+        return None
+
+    async def put(self, key: str, pdf_path: pathlib.Path) -> pathlib.Path:
+        """
+        Store a compiled PDF file in the cache
+
+        Args:
+            key: Cache key from compute_cache_key
+            pdf_path: Compiled PDF in the output area
+
+        Returns:
+            pdf_path, which the caller still releases; the disk tier keeps
+            a link of its own
+        """
+        if not self.enabled:
+            return pdf_path
+        size = pdf_path.stat().st_size
+        if size <= self.memory_item_bytes:
+            self._remember(key, await asyncio.to_thread(pdf_path.read_bytes))
+        if self.disk_bytes > 0:
+            try:
+                await asyncio.to_thread(self._store_disk, key, pdf_path)
+            except OSError as e:
+                logger.warning(f"Could not write PDF cache entry {key}: {e}")
+        return pdf_path
+
+    async def get_or_compile(
+        self, key: str, compile_fn: Callable[[], Awaitable[pathlib.Path]]
+    ) -> Tuple[PdfSource, bool]:
+        """
+        Return a cached PDF or compile it, coalescing identical concurrent calls
+
+        Args:
+            key: Cache key from compute_cache_key
+            compile_fn: Coroutine factory producing a PDF file on a miss
+
+        Returns:
+            Tuple of (PDF bytes or path, whether the result came from the cache);
+            every caller releases a returned output-area path itself
+        """
+        if not self.enabled or self.disk_bytes <= 0:
+            # Without a shared copy every caller needs its own output file
+            return await compile_fn(), False
+
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            logger.info(f"PDF cache hit (memory): {key}")
+            return self._memory[key], True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            logger.info(f"Waiting on in-flight compile for: {key}")
+            # Counted so an uncached output file is retained for this caller too
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            try:
+                return await asyncio.shield(inflight), True
+            except asyncio.CancelledError:
+                if not inflight.done():
+                    self._waiters[key] -= 1
+                    raise
+                if not inflight.cancelled():
+                    if inflight.exception() is None:
+                        release(inflight.result())
+                    raise
+                # The leading request was cancelled; compile on our own
+                return await self.get_or_compile(key, compile_fn)
+
+        # Register before the first await so identical requests coalesce
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            source = await self.get(key)
+            cached = source is not None
+            if cached:
+                self.hits += 1
+                logger.info(f"PDF cache hit (disk): {key}")
+            else:
+                self.misses += 1
+                source = await self.put(key, await compile_fn())
+            # Every waiter shares the leader's output file and releases it
+            # on its own
+            waiters = self._waiters.pop(key, 0)
+            if isinstance(source, pathlib.Path) and is_output_file(source):
+                retain(source, waiters)
+            future.set_result(source)
+            return source, cached
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else is waiting
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            self._waiters.pop(key, None)
+
+    def stats(self) -> dict:
+        """
+        Return cache hit counters and tier sizes
+        """
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+        }
+
+
+pdf_cache = PdfCache(
+    cache_dir=config.PDF_CACHE_DIR,
+    memory_bytes=config.PDF_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_bytes=config.PDF_CACHE_DISK_MB * 1024 * 1024,
+    memory_item_bytes=config.PDF_CACHE_MEMORY_ITEM_KB * 1024,
+    enabled=config.PDF_CACHE_ENABLED,
+)
@@ -0,0 +1,368 @@
+"""
+Password protection and size optimization of compiled PDFs
+
+The encryption backend is chosen once at startup: pikepdf (libqpdf in
+process) when installed, otherwise the qpdf or pdftk command line tools.
+Protected output is never silently replaced by an unencrypted PDF; when no
+backend is available protected requests fail and /health reports degraded.
+
+With PDF_OPTIMIZE_ENABLED, PDFs are also linearized for fast web view and
+their objects packed into compressed object streams; pikepdf additionally
+points repeated identical images and forms at a single copy. Protected
+PDFs are optimized in the same rewrite that encrypts them.
+"""
+
+import asyncio
+import hashlib
+import logging
+import pathlib
+import shutil
+from typing import Dict, Optional, Tuple
+
+from .. import config
+from .compile_pool import run_command
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pikepdf
+except ImportError:  # pragma: no cover - optional dependency
+    pikepdf = None
+
+BACKENDS = ("pikepdf", "qpdf", "pdftk")
+
+# Backends that can linearize and write object streams
+OPTIMIZING_BACKENDS = ("pikepdf", "qpdf")
+
+
+class PdfEncryptionError(RuntimeError):
+    """
+    Raised when a protected PDF is requested but cannot be produced
+    """
+
+
+class PdfEncryptor:
+    """
+    Encrypts PDFs with the backend selected at startup
+    """
+
+    def __init__(self, preferred: str = "auto", key_bits: int = 256, required: bool = False, optimize: bool = False):
+        self.preferred = preferred
+        self.key_bits = key_bits
+        self.required = required
+        self.optimize = optimize
+        self.backend: Optional[str] = None
+        self._detected = False
+        self.encrypted = 0
+        self.failures = 0
+        self.optimized = 0
+        self.optimize_failures = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.deduplicated = 0
+
+    def _available(self, backend: str) -> bool:
+        if backend == "pikepdf":
+            return pikepdf is not None
+        return shutil.which(backend) is not None
+
+    def detect(self) -> Optional[str]:
+        """
+        Select the encryption backend
+
+        Returns:
+            Backend name, or None if protected PDFs cannot be produced
+
+        Raises:
+            PdfEncryptionError: If PDF_ENCRYPTION_REQUIRED is set and no
+                backend is available
+        """
+        if self._detected:
+            return self.backend
+        candidates = BACKENDS if self.preferred == "auto" else (self.preferred,)
+        self.backend = next((name for name in candidates if self._available(name)), None)
+        self._detected = True
+
+        if self.backend is None:
+            message = f"No PDF encryption backend available (tried: {', '.join(candidates)})"
+            if self.required:
+                raise PdfEncryptionError(message)
+            logger.error(f"{message}; password protected requests will fail")
+        else:
+            logger.info(f"Using PDF encryption backend: {self.backend} ({self.cipher})")
+            if self.backend == "pdftk" and self.key_bits == 256:
+                logger.warning("pdftk cannot write AES-256, falling back to 128-bit RC4")
+        return self.backend
+
+    @property
+    def available(self) -> bool:
+        return self.detect() is not None
+
+    @property
+    def optimizer(self) -> Optional[str]:
+        """
+        Backend optimizing unprotected PDFs, or None if optimization is off
+        or impossible
+        """
+        if not self.optimize:
+            return None
+        if self.detect() in OPTIMIZING_BACKENDS:
+            return self.backend
+        return next((name for name in OPTIMIZING_BACKENDS if self._available(name)), None)
+
+    def optimizes(self, protected: bool) -> bool:
+        """
+        Return whether output is optimized; protected PDFs only are when the
+        encryption backend can do it in the same rewrite
+        """
+        if protected:
+            return self.optimize and self.detect() in OPTIMIZING_BACKENDS
+        return self.optimizer is not None
+
+    @property
+    def cipher(self) -> str:
+        if self.backend == "pdftk":
+            return "RC4-128"
+        return f"AES-{self.key_bits}"
+
+    def fingerprint(self) -> str:
+        """
+        Identify the encryption settings, so cached protected PDFs are not
+        reused after the backend or cipher changes
+        """
+        return f"{self.detect()}:{self.cipher}"
+
+    def optimize_fingerprint(self, protected: bool) -> str:
+        """
+        Identify the optimization settings, so cached PDFs are not reused
+        after optimization is switched on or off
+        """
+        if not self.optimizes(protected):
+            return "plain"
+        return f"optimized:{self.backend if protected else self.optimizer}"
+
+    def _save_pikepdf(
+        self,
+        input_pdf: pathlib.Path,
+        output_pdf: pathlib.Path,
+        password: Optional[str],
+        optimize: bool
+    ) -> None:
+        options = {}
+        if password:
+            options["encryption"] = pikepdf.Encryption(
+                owner=password,
+                user=password,
+                R=6 if self.key_bits == 256 else 4,
+                aes=True,
+                allow=pikepdf.Permissions(extract=False),
+            )
+        with pikepdf.open(input_pdf) as pdf:
+            if optimize:
+                self.deduplicated += deduplicate_xobjects(pdf)
+                options.update(
+                    linearize=True,
+                    object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                    compress_streams=True,
+                )
+            pdf.save(output_pdf, **options)
+
+    def _command(
+        self,
+        backend: str,
+        input_pdf: pathlib.Path,
+        output_pdf: pathlib.Path,
+        password: Optional[str],
+        optimize: bool
+    ) -> list:
+        if backend == "qpdf":
+            options = ["--linearize", "--object-streams=generate", "--compress-streams=y"] if optimize else []
+            if password:
+                aes = ["--use-aes=y"] if self.key_bits == 128 else []
+                options += [
+                    "--encrypt", password, password, str(self.key_bits),
+                    "--print=full", "--modify=all", "--extract=n", *aes, "--",
+                ]
+            return ["qpdf", *options, str(input_pdf), str(output_pdf)]
+        return [
+            "pdftk",
+            str(input_pdf),
+            "output", str(output_pdf),
+            "user_pw", password,
+            "owner_pw", password,
+            "encrypt_128bit"
+        ]
+
+    async def _rewrite(
+        self,
+        backend: str,
+        input_pdf: pathlib.Path,
+        output_pdf: pathlib.Path,
+        password: Optional[str],
+        optimize: bool
+    ) -> None:
+        # The in-process backend runs in the thread pool; command line
+        # backends run as asyncio subprocesses
+        if backend == "pikepdf":
+            await asyncio.to_thread(self._save_pikepdf, input_pdf, output_pdf, password, optimize)
+            return
+        returncode, _, stderr = await run_command(
+            self._command(backend, input_pdf, output_pdf, password, optimize), timeout=30
+        )
+        # qpdf exits with 3 for warnings but still writes the file
+        if returncode not in (0, 3) or not output_pdf.exists():
+            raise PdfEncryptionError(f"{backend} exited with {returncode}: {stderr.strip()[:500]}")
+
+    def _record_sizes(self, input_pdf: pathlib.Path, output_pdf: pathlib.Path) -> None:
+        before, after = input_pdf.stat().st_size, output_pdf.stat().st_size
+        self.optimized += 1
+        self.bytes_before += before
+        self.bytes_after += after
+        logger.info(f"PDF optimized with {self.optimizer}: {before} -> {after} bytes")
+
+    async def encrypt_file(self, input_pdf: pathlib.Path, output_pdf: pathlib.Path, password: str) -> None:
+        """
+        Encrypt a PDF file with a password, optimizing it in the same pass
+        when enabled and the backend supports it
+
+        Args:
+            input_pdf: Original PDF file
+            output_pdf: Path to write the encrypted PDF to
+            password: User and owner password
+
+        Raises:
+            PdfEncryptionError: If no backend is available or encryption fails
+        """
+        if not self.available:
+            self.failures += 1
+            raise PdfEncryptionError("Password protection is unavailable: no PDF encryption backend installed")
+
+        optimize = self.optimizes(protected=True)
+        try:
+            await self._rewrite(self.backend, input_pdf, output_pdf, password, optimize)
+        except PdfEncryptionError:
+            self.failures += 1
+            raise
+        except Exception as e:
+            self.failures += 1
+            raise PdfEncryptionError(f"PDF encryption with {self.backend} failed: {e}") from e
+
+        self.encrypted += 1
+        logger.info(f"PDF encrypted successfully using {self.backend} ({self.cipher})")
+        if optimize:
+            self._record_sizes(input_pdf, output_pdf)
+
+    async def optimize_file(self, input_pdf: pathlib.Path, output_pdf: pathlib.Path) -> bool:
+        """
+        Linearize an unprotected PDF and pack its objects into object streams
+
+        Optimization is best effort: on failure the original PDF stays usable.
+
+        Args:
+            input_pdf: Original PDF file
+            output_pdf: Path to write the optimized PDF to
+
+        Returns:
+            Whether output_pdf was written
+        """
+        backend = self.optimizer
+        if backend is None:
+            return False
+        try:
+            await self._rewrite(backend, input_pdf, output_pdf, None, True)
+        except Exception as e:
+            self.optimize_failures += 1
+            logger.warning(f"PDF optimization with {backend} failed, keeping the original: {e}")
+            return False
+        self._record_sizes(input_pdf, output_pdf)
+        return True
+
+    def stats(self) -> dict:
+        """
+        Return the selected backend and counters
+        """
+        return {
+            "backend": self.detect(),
+            "cipher": self.cipher if self.backend else None,
+            "available": self.backend is not None,
+            "encrypted": self.encrypted,
+            "failures": self.failures,
+            "optimizer": self.optimizer,
+            "optimized": self.optimized,
+            "optimize_failures": self.optimize_failures,
+            "deduplicated_xobjects": self.deduplicated,
+            "bytes_before": self.bytes_before,
+            "bytes_after": self.bytes_after,
+            "size_ratio": round(self.bytes_after / self.bytes_before, 4) if self.bytes_before else None,
+        }
+
+
+def deduplicate_xobjects(pdf) -> int:
+    """
+    Point every use of identical image and form XObjects at one copy
+
+    Images are compared by their raw stream data and dictionary, forms also
+    by their resources once the XObjects inside them have been deduplicated.
+    The copies no longer referenced are not written when the PDF is saved.
+
+    Args:
+        pdf: Open pikepdf document, modified in place
+
+    Returns:
+        Number of references redirected to an earlier copy
+    """
+    canonical: Dict[str, "pikepdf.Object"] = {}
+    keys: Dict[Tuple[int, int], str] = {}
+    replaced = 0
+
+    def key(xobject) -> str:
+        if xobject.objgen not in keys:
+            digest = hashlib.sha256(xobject.read_raw_bytes())
+            for name in sorted(xobject.keys()):
+                if name == "/Length":
+                    continue
+                value = xobject[name]
+                digest.update(name.encode("latin-1"))
+                # Unresolved: indirect objects compare by reference
+                digest.update(value.unparse() if isinstance(value, pikepdf.Object) else repr(value).encode())
+            keys[xobject.objgen] = digest.hexdigest()
+        return keys[xobject.objgen]
+
+    def first_copy(xobject):
+        if "/SMask" in xobject and isinstance(xobject.SMask, pikepdf.Stream) and xobject.SMask.is_indirect:
+            xobject.SMask = first_copy(xobject.SMask)
+        return canonical.setdefault(key(xobject), xobject)
+
+    def walk(resources) -> None:
+        nonlocal replaced
+        xobjects = resources.get("/XObject") if isinstance(resources, pikepdf.Dictionary) else None
+        if not isinstance(xobjects, pikepdf.Dictionary):
+            return
+        for name in list(xobjects.keys()):
+            xobject = xobjects[name]
+            if not isinstance(xobject, pikepdf.Stream) or not xobject.is_indirect:
+                continue
+            if xobject.objgen in keys:
+                copy = canonical.get(keys[xobject.objgen], xobject)
+            else:
+                if xobject.get("/Subtype") == "/Form":
+                    # Marked first, so self-referencing forms terminate
+                    keys[xobject.objgen] = f"visiting:{xobject.objgen}"
+                    walk(xobject.get("/Resources"))
+                    del keys[xobject.objgen]
+                copy = first_copy(xobject)
+            if copy.objgen != xobject.objgen:
+                xobjects[name] = copy
+                replaced += 1
+
+    for page in pdf.pages:
+        walk(page.obj.get("/Resources"))
+    return replaced
+
+
+pdf_encryptor = PdfEncryptor(
+    preferred=config.PDF_ENCRYPTION_BACKEND,
+    key_bits=config.PDF_ENCRYPTION_KEY_BITS,
+    required=config.PDF_ENCRYPTION_REQUIRED,
+    optimize=config.PDF_OPTIMIZE_ENABLED,
+)
@@ -0,0 +1,37 @@
+"""
+Startup and shutdown shared by the API process and standalone workers
+
+Everything a compile relies on is prepared here, so a worker started with
+worker.py finds the same environment as the embedded workers of the API.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from . import output_area
+from .http_client import close_http_client, start_http_client
+from .pdf_encryption import pdf_encryptor
+from .workspace_pool import workspace_pool
+
+
+@asynccontextmanager
+async def compile_runtime() -> AsyncIterator[None]:
+    """
+    Select the encryption backend, clean up after crashed processes, create
+    the compile workspaces and the shared HTTP client, and tear them down on
+    exit
+
+    Raises:
+        PdfEncryptionError: If PDF_ENCRYPTION_REQUIRED is set and no
+            encryption backend exists
+    """
+    pdf_encryptor.detect()
+    await asyncio.to_thread(output_area.sweep_stale)
+    await asyncio.to_thread(workspace_pool.start)
+    await start_http_client()
+    try:
+        yield
+    finally:
+        await close_http_client()
+        await asyncio.to_thread(workspace_pool.stop)
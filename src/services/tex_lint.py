@@ -0,0 +1,193 @@
+"""
+Pre-compile checks of question paper text
+
+Most broken papers are broken in ways that are cheap to see in Python:
+unbalanced braces or environments, an odd number of $, a language command
+the template does not define, or an image that is not in the workspace.
+Catching these before LuaLaTeX starts saves a compile slot and lets the
+error point at the exact field. Commands that reach outside the document
+(file and shell access, catcode changes, Lua code) are reported as well.
+Only unbalanced braces and those commands reject a paper. The rest are
+warnings, since nonstopmode TeX recovers from them and such papers have
+always compiled: missing images, an odd $, undeclared languages, and
+environments, which may begin in one field and end in the next. This is a
+check for honest mistakes, not a sandbox: it is easy to get around with
+\\csname or ^^ notation. The engine restrictions in
+compile_pool.tex_restrictions are what keep documents inside the workspace.
+"""
+
+import pathlib
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .image_processor import GRAPHICS_EXTENSIONS, INCLUDEGRAPHICS_PATTERN, _is_url
+from .tex_log import PREVIEW_LENGTH, question_fields
+from ..templates.scripts import SCRIPT_LANGUAGES
+
+# Unescaped % starts a comment that runs to the end of the line
+COMMENT_PATTERN = re.compile(r"(?<!\\)((?:\\\\)*)%.*")
+
+ENVIRONMENT_PATTERN = re.compile(r"\\(begin|end)\s*\{([^{}]*)\}")
+
+FORBIDDEN_COMMANDS = (
+    "input", "include", "InputIfFileExists", "openin", "openout", "read", "readline",
+    "write", "immediate", "closein", "closeout", "endinput", "special", "shipout", "dump",
+    "catcode", "directlua", "latelua", "luaexec", "luadirect", "luacode", "usepackage",
+    "documentclass", "ShellEscape",
+)
+FORBIDDEN_PATTERN = re.compile(r"\\(" + "|".join(FORBIDDEN_COMMANDS) + r")(?![A-Za-z@])")
+
+# Polyglossia languages the template never declares: their \text<language>
+# commands and environments are undefined
+UNDECLARED_LANGUAGES = tuple(
+    language for language in (
+        "bengali", "greek", "gujarati", "hebrew", "kannada", "marathi", "persian",
+        "punjabi", "russian", "sanskrit", "tamil", "telugu", "thai", "urdu",
+    )
+    if language not in SCRIPT_LANGUAGES.values()
+)
+LANGUAGE_PATTERN = re.compile(
+    r"\\text(" + "|".join(UNDECLARED_LANGUAGES) + r")(?![A-Za-z@])|"
+    r"\\(?:begin|end)\s*\{(" + "|".join(UNDECLARED_LANGUAGES) + r")\}"
+)
+
+# Issue severities: errors reject the paper, warnings are only logged
+ERROR = "error"
+WARNING = "warning"
+
+
+def _issue(location: str, message: str, text: str = "", position: int = 0, severity: str = ERROR) -> Dict[str, Any]:
+    start = max(0, position - PREVIEW_LENGTH // 2)
+    return {
+        "location": location,
+        "message": message,
+        "context": text[start:start + PREVIEW_LENGTH],
+        "tex_line": None,
+        "severity": severity,
+    }
+
+
+def _strip_comments(text: str) -> str:
+    return COMMENT_PATTERN.sub(r"\1", text)
+
+
+def _braces(text: str) -> Iterator[Tuple[str, int]]:
+    # Unescaped braces: a backslash escapes the character after it
+    escaped = False
+    for position, char in enumerate(text):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in "{}":
+            yield char, position
+
+
+def _check_braces(location: str, text: str) -> List[Dict[str, Any]]:
+    opened: List[int] = []
+    for char, position in _braces(text):
+        if char == "{":
+            opened.append(position)
+        elif opened:
+            opened.pop()
+        else:
+            return [_issue(location, "Unbalanced braces: '}' without matching '{'", text, position)]
+    if opened:
+        return [_issue(location, f"Unbalanced braces: {len(opened)} '{{' never closed", text, opened[0])]
+    return []
+
+
+def _check_environments(location: str, text: str) -> List[Dict[str, Any]]:
+    opened: List[Tuple[str, int]] = []
+    for match in ENVIRONMENT_PATTERN.finditer(text):
+        kind, name = match.group(1), match.group(2).strip()
+        if kind == "begin":
+            opened.append((name, match.start()))
+        elif not opened:
+            return [_issue(location, f"\\end{{{name}}} without matching \\begin", text, match.start(), WARNING)]
+        elif opened[-1][0] != name:
+            return [_issue(
+                location, f"\\begin{{{opened[-1][0]}}} ended by \\end{{{name}}}", text, match.start(), WARNING
+            )]
+        else:
+            opened.pop()
+    if opened:
+        name, position = opened[-1]
+        return [_issue(location, f"\\begin{{{name}}} never ended", text, position, WARNING)]
+    return []
+
+
+def _check_math(location: str, text: str) -> List[Dict[str, Any]]:
+    dollars = [position for position, char in enumerate(text) if char == "$" and not _escaped(text, position)]
+    if len(dollars) % 2:
+        return [_issue(location, "Unbalanced math mode: odd number of '$'", text, dollars[-1], WARNING)]
+    return []
+
+
+def _escaped(text: str, position: int) -> bool:
+    backslashes = 0
+    while position > backslashes and text[position - backslashes - 1] == "\\":
+        backslashes += 1
+    return backslashes % 2 == 1
+
+
+def _check_commands(location: str, text: str) -> List[Dict[str, Any]]:
+    issues = []
+    for match in FORBIDDEN_PATTERN.finditer(text):
+        if not _escaped(text, match.start()):
+            issues.append(_issue(location, f"Command not allowed in question text: \\{match.group(1)}", text, match.start()))
+    for match in LANGUAGE_PATTERN.finditer(text):
+        if not _escaped(text, match.start()):
+            language = match.group(1) or match.group(2)
+            issues.append(_issue(location, f"Unsupported language: {language}", text, match.start(), WARNING))
+    return issues
+
+
+def _image_exists(target: str, workdir: pathlib.Path, photo_dir: pathlib.Path) -> bool:
+    for directory in (workdir, photo_dir):
+        for extension in GRAPHICS_EXTENSIONS:
+            if (directory / f"{target}{extension}").is_file():
+                return True
+    return False
+
+
+def _check_images(location: str, text: str, workdir: Optional[pathlib.Path]) -> List[Dict[str, Any]]:
+    issues = []
+    for match in INCLUDEGRAPHICS_PATTERN.finditer(text):
+        target = match.group(2).strip()
+        if _is_url(target):
+            # Downloaded images have been rewritten to local paths by now
+            message = f"Image could not be downloaded: {target}"
+        elif target.startswith(("/", "~")) or ".." in pathlib.PurePosixPath(target).parts:
+            message = f"Image path outside the workspace: {target}"
+        elif workdir is not None and not _image_exists(target, workdir, workdir / "Photo" / "Qpbank"):
+            message = f"Image not found: {target}"
+        else:
+            continue
+        # TeX leaves the space blank and carries on, as it always has
+        issues.append(_issue(location, message, text, match.start(), WARNING))
+    return issues
+
+
+def lint_question_paper(data: Dict[str, Any], workdir: Optional[pathlib.Path] = None) -> List[Dict[str, Any]]:
+    """
+    Check the text fields of a question paper for errors TeX would fail on
+
+    Args:
+        data: Question paper data with local image paths
+        workdir: Compile workspace to resolve \\includegraphics targets in;
+            image files are not checked without one
+
+    Returns:
+        Issues found, each with location, message, context and severity
+        (ERROR or WARNING), in field order
+    """
+    issues = []
+    for location, text in question_fields(data).items():
+        source = _strip_comments(text)
+        issues.extend(_check_commands(location, source))
+        issues.extend(_check_braces(location, source))
+        issues.extend(_check_environments(location, source))
+        issues.extend(_check_math(location, source))
+        issues.extend(_check_images(location, source, workdir))
+    return issues
@@ -0,0 +1,235 @@
+"""
+Streaming LuaLaTeX output parser and question-level error locations
+
+LuaLaTeX runs in nonstopmode and recovers from most errors (an undefined
+command, a missing $, a missing image) on its own, still producing the PDF.
+Fatal errors such as a runaway argument reaching the end of the file used
+to cost every pass up to the timeout before a missing PDF gave them away.
+The parser reads the -file-line-error output line by line while TeX runs,
+so the run can be killed at the first fatal error, while recoverable errors
+are only recorded. Each error is traced back to the qp_parts[i].content[j]
+(or header field) whose text produced it.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+# ./question.tex:57: Undefined control sequence.
+FILE_LINE_ERROR_PATTERN = re.compile(r"^(?:\./)?[^:\s]+\.tex:(?P<line>\d+): (?P<message>.+)$")
+# ! Emergency stop.  (errors reported without a file position)
+BANG_ERROR_PATTERN = re.compile(r"^! (?P<message>.+)$")
+# l.57 1. Explain \textbff   (the source line up to the error point)
+CONTEXT_PATTERN = re.compile(r"^l\.(?P<line>\d+) ?(?P<before>.*)$")
+# *** (job aborted, no legal \end found)
+ABORT_PATTERN = re.compile(r"^\*\*\* \((?P<message>job aborted.*)\)$")
+
+# Errors the template itself triggers on every compile: the questions sit in
+# an enumerate without \item
+TOLERATED_ERRORS = ("perhaps a missing \\item",)
+
+# Errors TeX cannot recover from; only these end a run early
+TERMINAL_ERRORS = (
+    "Emergency stop", "TeX capacity exceeded", "Fatal error occurred",
+    "File ended while scanning", "job aborted",
+)
+
+PREVIEW_LENGTH = 120
+
+
+class LatexError(RuntimeError):
+    """
+    Compilation failed on errors in the question paper text
+
+    Attributes:
+        errors: Structured errors, each with the message, the TeX context and
+            the location (e.g. "qp_parts[0].content[2]") in the request
+        stage: "lint" when found before running TeX, else "lualatex"
+    """
+
+    def __init__(self, message: str, errors: List[Dict[str, Any]], stage: str = "lualatex"):
+        super().__init__(message)
+        self.errors = errors
+        self.stage = stage
+
+
+def _tex_text(value: Any) -> str:
+    # Text as TeX echoes it: control characters in ^^ notation
+    text = value if isinstance(value, str) else str(value)
+    return "".join(f"^^{chr(ord(char) + 64)}" if ord(char) < 32 and char != "\t" else char for char in text)
+
+
+def question_fields(data: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Map the location of every typeset text field to its text
+
+    Args:
+        data: Question paper data
+
+    Returns:
+        Location ("qp_name", "qp_parts[0].content[2]", ...) -> text
+    """
+    fields = {}
+    for key in ("qp_code", "qp_name", "time", "max_marks"):
+        if isinstance(data.get(key), str):
+            fields[key] = data[key]
+    for i, row in enumerate(data.get("qp_parts") or []):
+        for key in ("part_name", "part_description"):
+            if isinstance(row.get(key), str):
+                fields[f"qp_parts[{i}].{key}"] = row[key]
+        for j, content in enumerate(row.get("content") or []):
+            if isinstance(content, str):
+                fields[f"qp_parts[{i}].content[{j}]"] = content
+        if isinstance(row.get("footer"), str):
+            fields[f"qp_parts[{i}].footer"] = row["footer"]
+    return fields
+
+
+class ErrorLocator:
+    """
+    Finds the request field an error in the TeX source or context came from
+    """
+
+    def __init__(self, data: Dict[str, Any], source: Optional[str] = None):
+        self.fields = {location: _tex_text(text) for location, text in question_fields(data).items() if text.strip()}
+        self.source_lines = source.split("\n") if source is not None else None
+
+    def _longest(self, predicate) -> Optional[str]:
+        matches = [(len(text), location) for location, text in self.fields.items() if predicate(text)]
+        # The longest matching text is the most specific field
+        return max(matches)[1] if matches else None
+
+    def locate(self, tex_line: Optional[int], before: str = "", after: str = "") -> Optional[str]:
+        """
+        Return the location of the field an error occurred in, if known
+
+        Args:
+            tex_line: Line of question.tex TeX reported
+            before: Context TeX printed up to the error point
+            after: Context TeX printed after the error point
+        """
+        if self.source_lines is not None and tex_line and 0 < tex_line <= len(self.source_lines):
+            # Static source (RENDER_ENGINE=python): every field is on a line of its own
+            source_line = self.source_lines[tex_line - 1]
+            location = self._longest(lambda text: text in source_line)
+            if location is not None:
+                return location
+
+        # Text printed by the Lua loop: search for the context instead
+        before = before.strip()
+        if before.startswith("..."):
+            before = before[3:]
+        needle = before[-40:]
+        if not needle:
+            return None
+        after = after.strip()[:20]
+        location = self._longest(lambda text: needle + after in text) if after else None
+        return location or self._longest(lambda text: needle in text)
+
+
+@dataclass
+class TexError:
+    """
+    One error reported by TeX
+    """
+    message: str
+    tex_line: Optional[int] = None
+    before: str = ""
+    after: str = ""
+    location: Optional[str] = None
+
+    @property
+    def fatal(self) -> bool:
+        return any(error in self.message for error in TERMINAL_ERRORS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        context = f"{self.before}{self.after}"
+        return {
+            "location": self.location,
+            "message": self.message,
+            "context": context if len(context) <= PREVIEW_LENGTH else context[-PREVIEW_LENGTH:],
+            "tex_line": self.tex_line,
+        }
+
+
+class TexLogParser:
+    """
+    Line-by-line parser of LuaLaTeX terminal output
+
+    feed() returns True once a fatal error has been seen (with fail_fast);
+    recoverable errors are collected and the run goes on.
+    """
+
+    def __init__(self, locator: Optional[ErrorLocator] = None, fail_fast: bool = True):
+        self.locator = locator
+        self.fail_fast = fail_fast
+        self.errors: List[TexError] = []
+        self.tolerated = 0
+        # Whether an error TeX cannot recover from was reported
+        self.fatal = False
+        self._current: Optional[TexError] = None
+        self._awaiting_after = False
+
+    @property
+    def failed(self) -> bool:
+        """
+        Whether any error, recoverable or not, was reported
+        """
+        return bool(self.errors)
+
+    def feed(self, line: str) -> bool:
+        if self._current is not None:
+            if self._awaiting_after:
+                self._current.after = line.strip()
+                self._finish()
+                return self.fail_fast and self.fatal
+            match = CONTEXT_PATTERN.match(line)
+            if match:
+                self._current.tex_line = int(match.group("line"))
+                self._current.before = match.group("before")
+                self._awaiting_after = True
+                return False
+
+        match = (
+            FILE_LINE_ERROR_PATTERN.match(line) or BANG_ERROR_PATTERN.match(line) or ABORT_PATTERN.match(line)
+        )
+        if match and not match.group("message").lstrip().startswith("==>"):
+            self.finish()
+            groups = match.groupdict()
+            self._current = TexError(
+                message=match.group("message").strip(),
+                tex_line=int(groups["line"]) if groups.get("line") else None,
+            )
+            if self._current.fatal:
+                self._finish()
+        return self.fail_fast and self.fatal
+
+    def finish(self) -> None:
+        """
+        Record an error still waiting for its context lines
+        """
+        if self._current is not None:
+            self._finish()
+
+    def _finish(self) -> None:
+        error, self._current, self._awaiting_after = self._current, None, False
+        if any(tolerated in error.message for tolerated in TOLERATED_ERRORS):
+            self.tolerated += 1
+            return
+        if self.locator is not None:
+            error.location = self.locator.locate(error.tex_line, error.before, error.after)
+        self.errors.append(error)
+        self.fatal = self.fatal or error.fatal
+
+    def exception(self) -> LatexError:
+        """
+        Build the exception describing the errors seen so far, led by the
+        first fatal one
+        """
+        first = next((error for error in self.errors if error.fatal), self.errors[0])
+        where = f" in {first.location}" if first.location else ""
+        more = f" (and {len(self.errors) - 1} more)" if len(self.errors) > 1 else ""
+        return LatexError(
+            f"LaTeX error{where}: {first.message}{more}",
+            [error.to_dict() for error in self.errors],
+        )
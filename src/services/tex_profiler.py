@@ -0,0 +1,157 @@
+"""
+LuaTeX-side profiling of question paper compiles
+
+In profiling mode the template's Lua loop prints a \\directlua marker before
+the header, every part, every question and every footer. Each marker records
+CPU and wall clock plus Lua memory while TeX typesets, and a wrapup_run
+callback dumps the markers, the loaded fonts and LuaTeX's status table to
+Reports/profile.json. This module turns that dump, the log and the
+-recorder file list into a report that names the costly question fragments.
+"""
+
+import json
+import logging
+import pathlib
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FILE = "Reports/profile.json"
+
+# Font files LuaTeX reports in the log, e.g. <.../Rachana-Regular.ttf>
+LOG_FONT_PATTERN = re.compile(r"[<{]([^<>{}\s]+\.(?:otf|ttf|ttc|pfb|pfa))[>}]", re.IGNORECASE)
+
+# LuaTeX status keys describing memory use
+MEMORY_KEYS = (
+    "luastate_bytes", "node_mem_usage", "var_used", "dyn_used", "str_ptr", "cs_count",
+    "max_buf_stack", "max_in_stack", "max_nest_stack", "max_param_stack", "max_save_stack",
+    "fix_mem_end", "lo_mem_max", "hash_extra",
+)
+
+PREVIEW_LENGTH = 120
+
+
+def _question_text(processed_data: Dict[str, Any], part: int, question: int) -> Optional[str]:
+    try:
+        text = processed_data["qp_parts"][part - 1]["content"][question - 1]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return text if len(text) <= PREVIEW_LENGTH else text[:PREVIEW_LENGTH] + "..."
+
+
+def _fragment_label(mark: Dict[str, Any]) -> str:
+    kind, part, question = mark["kind"], mark.get("part", 0), mark.get("question", 0)
+    if kind == "question":
+        return f"question {part}.{question}"
+    if kind in ("part", "footer"):
+        return f"{kind} {part}"
+    if kind == "end":
+        return "final page output"
+    return kind
+
+
+def fragment_costs(marks: List[Dict[str, Any]], processed_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Turn consecutive markers into per-fragment durations
+
+    Args:
+        marks: Markers from profile.json in typesetting order
+        processed_data: Question paper data, for question previews
+
+    Returns:
+        One entry per fragment with CPU/wall seconds and Lua memory growth
+    """
+    fragments = []
+    for mark, following in zip(marks, marks[1:]):
+        fragment = {
+            "fragment": _fragment_label(mark),
+            "kind": mark["kind"],
+            "cpu_seconds": round(following["clock"] - mark["clock"], 4),
+            "wall_seconds": round(following["wall"] - mark["wall"], 4),
+            "lua_kb_delta": round(following.get("lua_kb", 0) - mark.get("lua_kb", 0), 1),
+        }
+        if mark["kind"] == "question":
+            fragment["part"] = mark["part"]
+            fragment["question"] = mark["question"]
+            fragment["content"] = _question_text(processed_data, mark["part"], mark["question"])
+        fragments.append(fragment)
+    return fragments
+
+
+def log_fonts(log_text: str) -> List[str]:
+    """
+    List the font files named in a LuaTeX log, in load order
+    """
+    return list(dict.fromkeys(LOG_FONT_PATTERN.findall(log_text)))
+
+
+def recorder_inputs(fls_file: pathlib.Path) -> Dict[str, Any]:
+    """
+    Summarize the INPUT lines of a -recorder .fls file
+    """
+    if not fls_file.exists():
+        return {"available": False}
+    inputs = []
+    for line in fls_file.read_text(encoding="utf-8", errors="replace").splitlines():
+        if line.startswith("INPUT "):
+            inputs.append(line[len("INPUT "):].strip())
+    inputs = list(dict.fromkeys(inputs))
+    extensions = Counter(pathlib.PurePath(path).suffix.lower() or "(none)" for path in inputs)
+    return {
+        "available": True,
+        "count": len(inputs),
+        "by_extension": dict(extensions.most_common()),
+        "files": inputs,
+    }
+
+
+def build_profile_report(
+    workdir: pathlib.Path,
+    jobname: str,
+    processed_data: Dict[str, Any],
+    top: int = 10
+) -> Dict[str, Any]:
+    """
+    Assemble the profiling report of a finished compile
+
+    Args:
+        workdir: Compile workspace
+        jobname: TeX job name (base name of the .log/.fls files)
+        processed_data: Question paper data as passed to the template
+        top: Number of most expensive questions to list
+
+    Returns:
+        Report with fragment timings, fonts, memory statistics and inputs
+    """
+    report: Dict[str, Any] = {}
+
+    profile_file = workdir / PROFILE_FILE
+    try:
+        profile = json.loads(profile_file.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        logger.warning(f"No LuaTeX profile data: {e}")
+        profile = None
+
+    if profile is not None:
+        marks = profile.get("marks") or []
+        fragments = fragment_costs(marks, processed_data)
+        questions = [fragment for fragment in fragments if fragment["kind"] == "question"]
+        report["available"] = True
+        report["typeset_cpu_seconds"] = round(marks[-1]["clock"] - marks[0]["clock"], 4) if marks else None
+        report["typeset_wall_seconds"] = round(marks[-1]["wall"] - marks[0]["wall"], 4) if marks else None
+        report["slowest_questions"] = sorted(questions, key=lambda item: item["cpu_seconds"], reverse=True)[:top]
+        report["fragments"] = fragments
+        report["fonts"] = profile.get("fonts") or []
+        status = profile.get("status") or {}
+        report["memory"] = {key: status[key] for key in MEMORY_KEYS if key in status}
+        report["memory"]["lua_kb_peak"] = max((mark.get("lua_kb", 0) for mark in marks), default=None)
+    else:
+        report["available"] = False
+
+    log_file = workdir / f"{jobname}.log"
+    log_text = log_file.read_text(encoding="utf-8", errors="replace") if log_file.exists() else ""
+    report["log_fonts"] = log_fonts(log_text)
+    report["recorder"] = recorder_inputs(workdir / f"{jobname}.fls")
+    return report
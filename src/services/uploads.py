@@ -0,0 +1,277 @@
+"""
+Streaming request bodies for /convert
+
+/convert takes the question paper either as a JSON body or as
+multipart/form-data with the paper JSON in a "paper" part and images as file
+parts. File parts are written to disk chunk by chunk as the body arrives,
+so images are never held in memory whole or base64 encoded. The body, part
+and file count limits are enforced while reading, before the body is
+complete.
+"""
+
+import asyncio
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # pragma: no cover - optional dependency
+    try:
+        from multipart.multipart import MultipartParser, parse_options_header
+    except ImportError:
+        MultipartParser = parse_options_header = None
+
+UPLOAD_DIR = pathlib.Path(config.UPLOAD_DIR)
+
+# Form part holding the question paper JSON
+PAPER_FIELD = "paper"
+
+
+class UploadError(ValueError):
+    """
+    Request body rejected while reading it
+    """
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class PaperUpload:
+    """
+    Question paper JSON plus the images uploaded alongside it
+
+    Uploaded images live in a per-request directory until cleanup().
+    """
+    body: bytes
+    images: Dict[str, pathlib.Path] = field(default_factory=dict)
+    upload_dir: Optional[pathlib.Path] = None
+
+    def cleanup(self) -> None:
+        """
+        Delete the uploaded images
+        """
+        if self.upload_dir is not None:
+            shutil.rmtree(self.upload_dir, ignore_errors=True)
+            self.upload_dir = None
+
+
+def multipart_available() -> bool:
+    """
+    Return whether multipart/form-data bodies can be parsed
+    """
+    return MultipartParser is not None
+
+
+def _image_name(filename: str) -> str:
+    # Only the base name of the client's file is used, as \includegraphics name
+    name = os.path.basename(filename.replace("\\", "/")).strip()
+    if not name or name.startswith("."):
+        raise UploadError(400, f"Invalid image file name: {filename!r}")
+    return name
+
+
+class _MultipartReader:
+    """
+    Feeds body chunks to python-multipart and stores the parts as they end
+    """
+
+    def __init__(self, boundary: bytes, upload: PaperUpload, max_part_bytes: int, max_files: int):
+        self.upload = upload
+        self.max_part_bytes = max_part_bytes
+        self.max_files = max_files
+        # Parts' headers travel with their "begin" event: one chunk may hold
+        # several parts, and events are only handled after the whole chunk
+        self.events: List[Tuple[str, Any]] = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._paper: Optional[bytearray] = None
+        self._file = None
+        self._name: Optional[str] = None
+        self._part_bytes = 0
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": lambda: self._headers.clear(),
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": lambda: self.events.append(("begin", dict(self._headers))),
+            "on_part_data": lambda data, start, end: self.events.append(("data", data[start:end])),
+            "on_part_end": lambda: self.events.append(("end", b"")),
+        })
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    async def feed(self, stream: AsyncIterator[bytes], max_bytes: int) -> None:
+        received = 0
+        async for chunk in stream:
+            received += len(chunk)
+            if received > max_bytes:
+                raise UploadError(413, f"Request body exceeds {max_bytes} bytes")
+            try:
+                self.parser.write(chunk)
+            except ValueError as e:
+                raise UploadError(400, f"Malformed multipart body: {e}")
+            await self._handle_events()
+        try:
+            self.parser.finalize()
+        except ValueError as e:
+            raise UploadError(400, f"Malformed multipart body: {e}")
+        await self._handle_events()
+        if self._file is not None:
+            raise UploadError(400, "Multipart body ended inside a part")
+
+    async def _handle_events(self) -> None:
+        events, self.events = self.events, []
+        for kind, data in events:
+            if kind == "begin":
+                self._begin_part(data)
+            elif kind == "data":
+                self._part_bytes += len(data)
+                if self._part_bytes > self.max_part_bytes:
+                    raise UploadError(413, f"Form part exceeds {self.max_part_bytes} bytes")
+                if self._file is not None:
+                    await asyncio.to_thread(self._file.write, data)
+                elif self._paper is not None:
+                    self._paper.extend(data)
+            else:
+                self._end_part()
+
+    def _begin_part(self, headers: Dict[bytes, bytes]) -> None:
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = options.get(b"filename")
+        self._part_bytes = 0
+        if name == PAPER_FIELD:
+            self._paper = bytearray()
+        elif filename is not None:
+            if len(self.upload.images) >= self.max_files:
+                raise UploadError(413, f"More than {self.max_files} uploaded images")
+            self._name = _image_name(filename.decode("utf-8", errors="replace"))
+            if self._name in self.upload.images:
+                raise UploadError(400, f"Image uploaded twice: {self._name}")
+            self._file = open(self.upload.upload_dir / self._name, "wb")
+        else:
+            logger.info(f"Ignoring unexpected form field: {name}")
+
+    def _end_part(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self.upload.images[self._name] = self.upload.upload_dir / self._name
+            self._file = self._name = None
+        elif self._paper is not None:
+            self.upload.body = bytes(self._paper)
+            self._paper = None
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+async def _read_body(stream: AsyncIterator[bytes], max_bytes: int) -> bytes:
+    chunks = []
+    received = 0
+    async for chunk in stream:
+        received += len(chunk)
+        if received > max_bytes:
+            raise UploadError(413, f"Request body exceeds {max_bytes} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def read_paper_upload(
+    content_type: Optional[str],
+    content_length: Optional[str],
+    stream: AsyncIterator[bytes]
+) -> PaperUpload:
+    """
+    Read a /convert body, streaming uploaded images to disk
+
+    Args:
+        content_type: Content-Type header of the request
+        content_length: Content-Length header of the request, if any
+        stream: Body chunks as they arrive
+
+    Returns:
+        The paper JSON and the uploaded images; the caller must cleanup()
+
+    Raises:
+        UploadError: With status 400 (malformed), 413 (too large) or 415
+            (unsupported content type)
+    """
+    max_bytes = config.UPLOAD_MAX_MB * 1024 * 1024
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise UploadError(413, f"Request body exceeds {max_bytes} bytes")
+
+    media_type = (content_type or "").split(";", 1)[0].strip().lower()
+    if media_type in ("", "application/json") or media_type.endswith("+json"):
+        return PaperUpload(body=await _read_body(stream, max_bytes))
+    if media_type != "multipart/form-data":
+        raise UploadError(415, f"Unsupported content type: {media_type}")
+    if not multipart_available():
+        raise UploadError(415, "multipart/form-data bodies need python-multipart installed")
+
+    _, options = parse_options_header(content_type.encode("latin-1"))
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise UploadError(400, "Missing multipart boundary")
+
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    upload = PaperUpload(body=b"", upload_dir=pathlib.Path(tempfile.mkdtemp(dir=UPLOAD_DIR)))
+    reader = _MultipartReader(boundary, upload, config.UPLOAD_MAX_PART_MB * 1024 * 1024, config.UPLOAD_MAX_FILES)
+    try:
+        await reader.feed(stream, max_bytes)
+        if not upload.body:
+            raise UploadError(400, f"Multipart body has no '{PAPER_FIELD}' part")
+    except BaseException:
+        reader.close()
+        upload.cleanup()
+        raise
+    logger.info(f"Received multipart paper with {len(upload.images)} uploaded images")
+    return upload
+
+
+def sweep_stale_uploads(max_age: int = 3600) -> int:
+    """
+    Remove upload directories left behind by crashed or aborted requests
+
+    Args:
+        max_age: Minimum age in seconds of directories to remove
+
+    Returns:
+        Number of directories removed
+    """
+    if not UPLOAD_DIR.exists():
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in UPLOAD_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                shutil.rmtree(path)
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"Removed {removed} stale upload directories")
+    return removed
@@ -0,0 +1,186 @@
+"""
+Startup warm-up for the LaTeX toolchain
+
+Before an instance reports ready it indexes the template fonts into the
+persistent luaotfload cache, builds the precompiled format and compiles a
+built-in sample paper twice to measure cold and warm latency. A failed
+warm-up is retried with backoff; once the attempts are used up the instance
+reports ready but degraded, so it still takes traffic with cold caches.
+"""
+
+import asyncio
+import copy
+import logging
+import pathlib
+import time
+from typing import Any, Dict, List, Optional
+
+from .. import config
+from .compile_pool import run_command, tex_environment
+from .format_cache import format_cache
+from .latex_compiler import compile_question_paper
+from ..templates.question_template import get_template_fonts
+
+logger = logging.getLogger(__name__)
+
+
+SAMPLE_PAPER: Dict[str, Any] = {
+    "qp_code": "WARMUP 0001",
+    "qp_name": "\\textbf{\\Large Warm-up Paper}\\\\\\textmalayalam{സാഹിത്യവും മാനവികതയും}",
+    "qp_stream": "Warm-up",
+    "course_name": "Warm-up",
+    "admission_year": "2024",
+    "time": "1 Hour",
+    "max_marks": "10",
+    "qp_parts": [
+        {
+            "part_name": "Section A",
+            "part_title": "Scripts",
+            "part_description": "[Answer All. Each Question Carries 2 Marks]",
+            "content": [
+                "1. Explain the term \\textit{entropy} with $S = k \\log W$.",
+                "2. \\textmalayalam{ഗാന്ധിജിയുടെ} \\textmalayalam{വീക്ഷണത്തിൽ} \\textmalayalam{സത്യം}?",
+                "3. \\texthindi{सत्य और अहिंसा} का अर्थ बताइए।",
+                "4. \\textarabic{ما هو الحق؟}",
+            ],
+            "footer": "Ceiling Marks: 8",
+        },
+        {
+            "part_name": "Section B",
+            "part_title": "Tables",
+            "part_description": "[Answer Any One]",
+            "content": [
+                "5. Complete the table: \\\\ \\begin{tabular}{|c|c|} \\hline $x$ & $x^2$ \\\\ \\hline 1 & 1 \\\\ 2 & 4 \\\\ \\hline \\end{tabular}",
+            ],
+            "footer": "Ceiling Marks: 2",
+        },
+    ],
+    "images": None,
+    "password": False,
+}
+
+
+class WarmupState:
+    """
+    Readiness flag and timings recorded during warm-up
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.degraded = False
+        self.attempts = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cold_latency: Optional[float] = None
+        self.warm_latency: Optional[float] = None
+        self.steps: List[Dict[str, Any]] = []
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "ready": self.ready,
+            "degraded": self.degraded,
+            "attempts": self.attempts,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "cold_latency_seconds": self.cold_latency,
+            "warm_latency_seconds": self.warm_latency,
+            "steps": self.steps,
+            "error": self.error,
+        }
+
+
+warmup_state = WarmupState()
+
+
+async def _timed_step(name: str, coro) -> Any:
+    start = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        elapsed = round(time.perf_counter() - start, 3)
+        warmup_state.steps.append({"step": name, "seconds": elapsed})
+        logger.info(f"Warm-up step '{name}' took {elapsed}s")
+
+
+async def _index_fonts() -> None:
+    env = tex_environment()
+    returncode, _, stderr = await run_command(
+        ["luaotfload-tool", "--update"], timeout=600, env=env
+    )
+    if returncode != 0:
+        logger.warning(f"luaotfload-tool --update failed: {stderr.strip()[:500]}")
+
+    for font in get_template_fonts():
+        returncode, _, _ = await run_command(
+            ["luaotfload-tool", f"--find={font}"], timeout=120, env=env
+        )
+        if returncode != 0:
+            logger.warning(f"Template font not found by luaotfload: {font}")
+
+
+async def _warm() -> None:
+    pathlib.Path(config.TEX_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+
+    await _timed_step("font_index", _index_fonts())
+    await _timed_step("format", format_cache.ensure())
+
+    # Bypass the PDF cache so the second run measures a real warm compile.
+    # The cold run may write the font caches that --safer runs only read;
+    # the warm one runs like a request
+    start = time.perf_counter()
+    sample = copy.deepcopy(SAMPLE_PAPER)
+    result = await _timed_step("sample_cold", compile_question_paper(sample, use_cache=False, trusted=True))
+    result.release()
+    warmup_state.cold_latency = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    sample = copy.deepcopy(SAMPLE_PAPER)
+    result = await _timed_step("sample_warm", compile_question_paper(sample, use_cache=False))
+    result.release()
+    warmup_state.warm_latency = round(time.perf_counter() - start, 3)
+
+
+async def run_warmup() -> None:
+    """
+    Warm caches and compile the sample paper, then mark the instance ready
+
+    Each failed attempt is logged and retried after an exponentially growing
+    delay (WARMUP_ATTEMPTS, WARMUP_RETRY_DELAY).
+    """
+    if not config.WARMUP_ENABLED:
+        logger.info("Warm-up disabled, reporting ready immediately")
+        warmup_state.ready = True
+        return
+
+    warmup_state.started_at = time.time()
+    logger.info(f"Starting warm-up with TeX cache directory: {config.TEX_CACHE_DIR}")
+    try:
+        for attempt in range(1, config.WARMUP_ATTEMPTS + 1):
+            warmup_state.attempts = attempt
+            warmup_state.steps = []
+            try:
+                await _warm()
+            except Exception as e:
+                warmup_state.error = str(e)[:2000]
+                if attempt == config.WARMUP_ATTEMPTS:
+                    break
+                delay = config.WARMUP_RETRY_DELAY * 2 ** (attempt - 1)
+                logger.error(f"Warm-up attempt {attempt} failed, retrying in {delay:.0f}s: {e!r}")
+                await asyncio.sleep(delay)
+                continue
+            warmup_state.error = None
+            warmup_state.ready = True
+            logger.info(
+                f"Warm-up complete: cold {warmup_state.cold_latency}s, warm {warmup_state.warm_latency}s"
+            )
+            return
+
+        warmup_state.degraded = True
+        warmup_state.ready = True
+        logger.error(
+            f"Warm-up failed after {warmup_state.attempts} attempts, reporting ready but degraded: "
+            f"{warmup_state.error}"
+        )
+    finally:
+        warmup_state.finished_at = time.time()
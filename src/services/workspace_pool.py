@@ -0,0 +1,278 @@
+"""
+Pool of pre-created compile workspaces
+
+Creating a temporary directory tree per request, writing the same static
+question.tex into it and deleting it all again is fsync-heavy churn on
+overlay filesystems. Workspaces are instead created once under
+WORKSPACE_DIR (ideally a tmpfs mount) with Reports/, Photo/Qpbank/ and the
+template in place, reset after each compile and handed to the next one.
+Each process keeps its workspaces in a directory of its own, locked for its
+lifetime, so directories of crashed processes can be told apart and removed.
+"""
+
+import asyncio
+import logging
+import os
+import pathlib
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import IO, AsyncIterator, List, Optional, Set, Tuple
+
+from .. import config
+from ..templates.question_template import get_question_latex_template
+from ..templates.scripts import SCRIPTS
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+# Directories every workspace has, emptied on reset
+WORKSPACE_DIRS = ("Reports", "Photo/Qpbank")
+
+# Files kept across jobs: the next job usually writes the same contents
+KEPT_FILES = ("question.tex",)
+
+LOCK_FILE = ".lock"
+
+
+def write_if_changed(path: pathlib.Path, text: str) -> bool:
+    """
+    Write a text file unless it already has exactly this content
+
+    Returns:
+        Whether the file was written
+    """
+    try:
+        if path.read_text(encoding="utf-8") == text:
+            return False
+    except (OSError, UnicodeDecodeError):
+        pass
+    path.write_text(text, encoding="utf-8")
+    return True
+
+
+def directory_usage(path: pathlib.Path) -> int:
+    """
+    Return the bytes stored in a directory tree, not counting files linked
+    in from caches
+    """
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                stat = os.lstat(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            if stat.st_nlink == 1:
+                total += stat.st_size
+    return total
+
+
+def create_process_dir(root: pathlib.Path) -> Tuple[pathlib.Path, Optional[IO]]:
+    """
+    Create this process's directory under a shared root and lock it
+
+    Returns:
+        The directory and the open lock file, held until the process exits
+        (None without fcntl)
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    directory = root / f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    directory.mkdir()
+    lock = None
+    if fcntl is not None:
+        lock = open(directory / LOCK_FILE, "w")
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    return directory, lock
+
+
+def clear_directory(directory: pathlib.Path, kept: Set[pathlib.Path] = frozenset()) -> None:
+    """
+    Remove everything below a directory except the kept paths
+    """
+    for path in directory.iterdir():
+        if path in kept:
+            if path.is_dir():
+                clear_directory(path, kept)
+        elif path.is_dir() and not path.is_symlink():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+
+
+class WorkspacePool:
+    """
+    Hands out reset, pre-populated workspace directories
+    """
+
+    def __init__(self, root: str, size: int, max_bytes: int, enabled: bool = True):
+        self.root = pathlib.Path(root)
+        self.size = size
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._dir: Optional[pathlib.Path] = None
+        self._lock = None
+        self._idle: List[pathlib.Path] = []
+        self.active = 0
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def _process_dir(self) -> pathlib.Path:
+        if self._dir is None:
+            self._dir, self._lock = create_process_dir(self.root)
+        return self._dir
+
+    def _create(self) -> pathlib.Path:
+        workspace = self._process_dir() / uuid.uuid4().hex[:12]
+        for name in WORKSPACE_DIRS:
+            (workspace / name).mkdir(parents=True)
+        # The template of the most common script set, so most jobs find it in place
+        scripts = () if config.SCRIPT_DETECTION_ENABLED else SCRIPTS
+        (workspace / "question.tex").write_text(get_question_latex_template(scripts), encoding="utf-8")
+        self.created += 1
+        return workspace
+
+    def _reset(self, workspace: pathlib.Path) -> bool:
+        """
+        Empty a workspace for the next job
+
+        Returns:
+            Whether the workspace can be reused
+        """
+        if directory_usage(workspace) > self.max_bytes:
+            logger.info(f"Workspace {workspace.name} exceeds {self.max_bytes} bytes, discarding it")
+            return False
+        kept = {workspace / name for name in KEPT_FILES}
+        for name in WORKSPACE_DIRS:
+            path = pathlib.Path(name)
+            kept.update(workspace / parent for parent in (path, *path.parents) if parent != pathlib.Path("."))
+        try:
+            clear_directory(workspace, kept)
+        except OSError as e:
+            logger.warning(f"Could not reset workspace {workspace.name}, discarding it: {e}")
+            return False
+        return all((workspace / name).is_dir() for name in WORKSPACE_DIRS)
+
+    def _discard(self, workspace: pathlib.Path) -> None:
+        shutil.rmtree(workspace, ignore_errors=True)
+        self.discarded += 1
+
+    def start(self) -> None:
+        """
+        Remove leftovers of crashed processes and pre-create the idle workspaces
+        """
+        sweep_stale_workspaces(self.root)
+        if not self.enabled:
+            return
+        while len(self._idle) < self.size:
+            self._idle.append(self._create())
+        logger.info(f"Pre-created {len(self._idle)} workspaces in {self._process_dir()}")
+
+    def stop(self) -> None:
+        """
+        Remove this process's workspaces at shutdown
+        """
+        if self._dir is None:
+            return
+        shutil.rmtree(self._dir, ignore_errors=True)
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+        self._dir = None
+        self._idle.clear()
+
+    @asynccontextmanager
+    async def workspace(self) -> AsyncIterator[pathlib.Path]:
+        """
+        Borrow a workspace containing empty Reports/ and Photo/Qpbank/
+
+        question.tex is left over from an earlier job: write it with
+        write_if_changed.
+        """
+        if self._idle:
+            workspace = self._idle.pop()
+            self.reused += 1
+        else:
+            workspace = await asyncio.to_thread(self._create)
+
+        self.active += 1
+        try:
+            yield workspace
+        finally:
+            self.active -= 1
+            reusable = (
+                self.enabled
+                and len(self._idle) < self.size
+                and await asyncio.to_thread(self._reset, workspace)
+            )
+            if reusable:
+                self._idle.append(workspace)
+            else:
+                await asyncio.to_thread(self._discard, workspace)
+
+    def stats(self) -> dict:
+        """
+        Return pool counters
+        """
+        return {
+            "enabled": self.enabled,
+            "root": str(self.root),
+            "idle": len(self._idle),
+            "active": self.active,
+            "created": self.created,
+            "reused": self.reused,
+            "discarded": self.discarded,
+        }
+
+
+def sweep_stale_workspaces(root: pathlib.Path) -> int:
+    """
+    Remove the process directories (see create_process_dir) of processes
+    that no longer run
+
+    A process directory is stale when its lock can be taken. Without fcntl,
+    directories untouched for an hour are removed instead.
+
+    Args:
+        root: Workspace root shared by all processes
+
+    Returns:
+        Number of process directories removed
+    """
+    if not root.exists():
+        return 0
+    removed = 0
+    now = time.time()
+    for directory in root.iterdir():
+        try:
+            # Leaves directories being set up by a starting process alone
+            if not directory.is_dir() or directory.stat().st_mtime > now - 60:
+                continue
+            if fcntl is not None:
+                with open(directory / LOCK_FILE, "a") as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            elif directory.stat().st_mtime > now - 3600:
+                continue
+        except BlockingIOError:
+            continue
+        except OSError:
+            pass
+        shutil.rmtree(directory, ignore_errors=True)
+        removed += 1
+    if removed:
+        logger.info(f"Removed {removed} stale workspace directories")
+    return removed
+
+
+workspace_pool = WorkspacePool(
+    root=config.WORKSPACE_DIR,
+    size=config.WORKSPACE_POOL_SIZE,
+    max_bytes=config.WORKSPACE_MAX_MB * 1024 * 1024,
+    enabled=config.WORKSPACE_POOL_ENABLED,
+)
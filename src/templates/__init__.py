@@ -2,6 +2,7 @@
 LaTeX templates for document generation
 """
 
-from .question_template import get_question_latex_template
+from .question_renderer import render_question_document
+from .question_template import get_question_latex_template, get_template_version
 
-__all__ = ["get_question_latex_template"]
+__all__ = ["get_question_latex_template", "get_template_version", "render_question_document"]
@@ -0,0 +1,216 @@
+"""
+Python renderer for question papers (RENDER_ENGINE=python)
+
+Produces the same TeX that the Lua loop of the question template feeds to
+LuaLaTeX with tex.print, but as a static document rendered in Python. Each
+compile then skips writing question.json and decoding it with dkjson on
+every pass, and the generated source can be inspected, cached and diffed.
+"""
+
+import functools
+import hashlib
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from jinja2 import Environment, StrictUndefined
+
+from .question_template import get_question_latex_template
+from .scripts import normalize_scripts
+
+# Only needed by the Lua loop; the rendered document never runs Lua code
+LUA_ONLY_PACKAGES = (r"\usepackage{luacode}", r"\usepackage{luapackageloader}")
+
+# Mirrors the Lua loop line by line: every line here is one tex.print call.
+# Delimiters are changed so TeX braces never clash with Jinja syntax.
+BODY_TEMPLATE = r"""
+((* for family, script, scale in font_overrides *))
+((* if fonts.get(family) is lua_truthy *))
+\newfontfamily\((( family )))font[Script=((( script ))),Scale=((( fonts.get(family ~ '_scale') | lua_or(scale) | tex )))]{((( fonts.get(family) | tex )))}
+((* endif *))
+((* endfor *))
+((( data.qp_code | tex )))\hfill  Name .............................
+\begin{flushright}
+Reg.No .............................\\
+\end{flushright}
+\begin{center}
+\begin{minipage}{5in}
+\centering
+((( data.qp_name | tex )))
+\end{minipage} \\
+\vspace{0.3cm}
+\end{center}
+Time : ((( data.time | tex ))) \hfill Max marks : ((( data.max_marks | tex )))
+\begin{enumerate}
+((* for row in data.qp_parts *))
+\begin{center}
+\textbf{((( row.part_name | tex )))} \\
+\texttt{((( row.part_description | tex )))} \\
+\end{center}
+((* for part in row.content *))
+((* if '\\begin{tabular}' in part *))
+((( part | tex )))
+((* else *))
+((( part | tex ))) \\
+ \\
+((* endif *))
+((* endfor *))
+\begin{flushright}
+\texttt{\textbf{((( row.footer | tex )))}} \\
+\end{flushright}
+((* endfor *))
+\end{enumerate}
+"""
+
+# A single question typeset like an inline one, at the line width of the
+# enumerate it sits in, and shipped out as a page cropped to the text. The
+# struts give the first and last line their normal height and depth, which
+# \qpfragment in the template relies on when placing the snippet.
+FRAGMENT_TEMPLATE = r"""
+((* for family, script, scale in font_overrides *))
+((* if fonts.get(family) is lua_truthy *))
+\newfontfamily\((( family )))font[Script=((( script ))),Scale=((( fonts.get(family ~ '_scale') | lua_or(scale) | tex )))]{((( fonts.get(family) | tex )))}
+((* endif *))
+((* endfor *))
+\global\setbox\qpfragmentbox\vbox{\hsize=\dimexpr\textwidth-\leftmargini\relax
+\noindent\strut((( content | tex )))\strut\par}
+\hoffset=-1in
+\voffset=-1in
+\pagewidth=\wd\qpfragmentbox
+\pageheight=\dimexpr\ht\qpfragmentbox+\dp\qpfragmentbox\relax
+\shipout\box\qpfragmentbox
+"""
+
+# Font families the Lua loop lets question.json override: (family, script, default scale)
+FONT_OVERRIDES = (
+    ("arabic", "Arabic", "1.3"),
+    ("hindi", "Devanagari", "1.2"),
+    ("malayalam", "Malayalam", "1.2"),
+)
+
+
+def _tex_line(value: Any) -> str:
+    """
+    Text of one tex.print line: control characters do not break the line in
+    tex.print, so they are written in ^^ notation to read back identically
+    """
+    text = value if isinstance(value, str) else str(value)
+    if any(ord(char) < 32 and char != "\t" for char in text):
+        text = "".join(
+            f"^^{chr(ord(char) + 64)}" if ord(char) < 32 and char != "\t" else char
+            for char in text
+        )
+    return text
+
+
+def _lua_truthy(value: Any) -> bool:
+    # In Lua only nil and false are false; "" and 0 are true
+    return value is not None and value is not False
+
+
+def _lua_or(value: Any, default: Any) -> Any:
+    return value if _lua_truthy(value) else default
+
+
+def _build_environment() -> Environment:
+    environment = Environment(
+        block_start_string="((*",
+        block_end_string="*))",
+        variable_start_string="(((",
+        variable_end_string=")))",
+        comment_start_string="((=",
+        comment_end_string="=))",
+        trim_blocks=True,
+        lstrip_blocks=True,
+        keep_trailing_newline=True,
+        autoescape=False,
+        undefined=StrictUndefined,
+    )
+    environment.filters["tex"] = _tex_line
+    environment.filters["lua_or"] = _lua_or
+    environment.tests["lua_truthy"] = _lua_truthy
+    return environment
+
+
+@functools.lru_cache(maxsize=None)
+def _static_preamble(scripts: Optional[Tuple[str, ...]]) -> str:
+    preamble = get_question_latex_template(scripts).split("\\begin{document}", 1)[0]
+    lines = [line for line in preamble.split("\n") if line.strip() not in LUA_ONLY_PACKAGES]
+    return "\n".join(lines)
+
+
+def get_question_static_preamble(scripts: Optional[Iterable[str]] = None) -> str:
+    """
+    Returns the template preamble without the packages only the Lua loop uses
+
+    Args:
+        scripts: Non-Latin scripts to load (see templates/scripts.py); all if None
+    """
+    return _static_preamble(None if scripts is None else normalize_scripts(scripts))
+
+
+# Compiled once at import
+_ENVIRONMENT = _build_environment()
+_BODY = _ENVIRONMENT.from_string(BODY_TEMPLATE.lstrip("\n"))
+_FRAGMENT = _ENVIRONMENT.from_string(FRAGMENT_TEMPLATE.lstrip("\n"))
+_PREAMBLE = get_question_static_preamble()
+
+
+def render_question_body(data: Dict[str, Any]) -> str:
+    """
+    Render the typeset content of a question paper
+
+    Args:
+        data: Question paper data with local image paths
+
+    Returns:
+        TeX source equal to what the Lua loop prints
+    """
+    return _BODY.render(
+        data=data,
+        fonts=data.get("fonts") or {},
+        font_overrides=FONT_OVERRIDES,
+    )
+
+
+def render_question_document(data: Dict[str, Any], scripts: Optional[Iterable[str]] = None) -> str:
+    """
+    Render a complete, static question paper document
+
+    Args:
+        data: Question paper data with local image paths
+        scripts: Non-Latin scripts to load (see templates/scripts.py); all if None
+
+    Returns:
+        TeX source of the whole document
+    """
+    return f"{get_question_static_preamble(scripts)}\\begin{{document}}\n{render_question_body(data)}\\end{{document}}\n"
+
+
+def render_fragment_document(
+    content: str,
+    fonts: Optional[Dict[str, Any]] = None,
+    scripts: Optional[Iterable[str]] = None
+) -> str:
+    """
+    Render a document typesetting one question as a cropped single page
+
+    Args:
+        content: Question text, as in qp_parts[i].content
+        fonts: Font overrides of the paper (the "fonts" field)
+        scripts: Non-Latin scripts to load (see templates/scripts.py); all if None
+
+    Returns:
+        TeX source of the fragment document
+    """
+    body = _FRAGMENT.render(content=content, fonts=fonts or {}, font_overrides=FONT_OVERRIDES)
+    return f"{get_question_static_preamble(scripts)}\\begin{{document}}\n{body}\\end{{document}}\n"
+
+
+def get_renderer_version() -> str:
+    """
+    Returns a short hash identifying the rendered document layout
+    """
+    digest = hashlib.sha256()
+    digest.update(_PREAMBLE.encode("utf-8"))
+    digest.update(BODY_TEMPLATE.encode("utf-8"))
+    digest.update(FRAGMENT_TEMPLATE.encode("utf-8"))
+    return digest.hexdigest()[:16]
@@ -2,22 +2,70 @@
 LaTeX templates for document generation
 """
 
+import hashlib
+import re
+from typing import Iterable, Optional
 
-def get_question_latex_template() -> str:
+from .scripts import SCRIPT_LANGUAGES, SCRIPTS, normalize_scripts
+
+# Everything above this line of the template is dumped into the precompiled
+# LuaLaTeX format (see services/format_cache.py). Font and Lua-state dependent
+# packages stay below it because luaotfload fonts and Lua modules do not
+# survive a dump. Without a format the line expands to \relax.
+FORMAT_DUMP_MARKER = r"\csname endofdump\endcsname"
+
+
+# Font families of each script, declared after the languages in this order
+SCRIPT_FONTS = (
+    ("arabic", r"""\newfontfamily\arabicfont[
+  Script=Arabic,
+  Scale=1.3
+]{Lateef}
+"""),
+    ("devanagari", r"""\newfontfamily\devanagarifont[
+  Script=Devanagari,
+  Scale=1.2
+]{Lohit Devanagari}
+
+\newfontfamily\hindifont[
+  Script=Devanagari,
+  Scale=1.2
+]{Lohit Devanagari}
+"""),
+    ("malayalam", r"""\newfontfamily\malayalamfont[
+  Script=Malayalam,
+  Scale=1.2
+]{Rachana}
+"""),
+)
+
+
+def _script_preamble(scripts: Optional[Iterable[str]]) -> str:
+    """
+    Language and font declarations of the given scripts (all if None)
+    """
+    scripts = SCRIPTS if scripts is None else normalize_scripts(scripts)
+    languages = "".join(f"\\setotherlanguage{{{SCRIPT_LANGUAGES[script]}}}\n" for script in scripts)
+    fonts = "\n".join(declaration for script, declaration in SCRIPT_FONTS if script in scripts)
+    return f"{languages}\n\\usepackage{{fontspec}}\n\n{fonts}"
+
+
+def get_question_latex_template(scripts: Optional[Iterable[str]] = None) -> str:
     """
     Returns the LaTeX template for question paper generation
+
+    Args:
+        scripts: Non-Latin scripts to declare languages and fonts for
+            (see templates/scripts.py); all of them if None. They come after
+            the format dump point, so every script set shares one format.
     """
     return r'''\documentclass[11pt]{article}
 \usepackage[a4paper,margin=1.4cm]{geometry}
 \usepackage{zref-totpages}
 \usepackage{array}
-\usepackage{polyglossia}
-\usepackage{fontspec}
 \usepackage{tabularray}
 \usepackage{tikz}
 \usepackage{enumitem}
-\usepackage{luacode}
-\usepackage{luapackageloader}
 \usepackage{multicol}
 \usepackage{graphicx}
 \graphicspath{{./Photo/Qpbank/}}
@@ -29,33 +77,23 @@ def get_question_latex_template() -> str:
 \usepackage{booktabs}
 \usepackage{multirow}
 \usepackage{amsmath}
-
-\setdefaultlanguage{english}
-\setotherlanguage{hindi}
-\setotherlanguage{malayalam}
-\setotherlanguage{arabic}
-
+\csname endofdump\endcsname
+\usepackage{polyglossia}
 \usepackage{fontspec}
+\usepackage{luacode}
+\usepackage{luapackageloader}
 
-\newfontfamily\arabicfont[
-  Script=Arabic,
-  Scale=1.3
-]{Lateef}
-
-\newfontfamily\devanagarifont[
-  Script=Devanagari,
-  Scale=1.2
-]{Lohit Devanagari}
-
-\newfontfamily\hindifont[
-  Script=Devanagari,
-  Scale=1.2
-]{Lohit Devanagari}
-
-\newfontfamily\malayalamfont[
-  Script=Malayalam,
-  Scale=1.2
-]{Rachana}
+\setdefaultlanguage{english}
+''' + _script_preamble(scripts) + r'''
+% Pre-rendered question (services/fragment_cache.py). The snippet sits on a
+% line of normal height and depth, and a \vadjust skip makes room for the
+% rest of it, so the following lines land where the inline text would put them
+\newbox\qpfragmentbox
+\newcommand{\qpfragment}[1]{%
+  \saveimageresource{#1}%
+  \setbox\qpfragmentbox\hbox{\useimageresource\lastsavedimageresourceindex}%
+  \vadjust{\nobreak\vskip\dimexpr\ht\qpfragmentbox-\baselineskip\relax}%
+  \raisebox{\dimexpr0.7\baselineskip-\ht\qpfragmentbox\relax}[0.7\baselineskip][0.3\baselineskip]{\copy\qpfragmentbox}}
 
 
 \begin{document}
@@ -84,6 +122,42 @@ def get_question_latex_template() -> str:
         return
     end
 
+    -- Profiling mode (services/tex_profiler.py): the markers printed below
+    -- run while TeX typesets, so the time between two of them is the cost
+    -- of the fragment in between
+    qpprof = nil
+    if data._profile then
+        qpprof = {marks = {}}
+        function qpprof.mark(kind, part, question)
+            table.insert(qpprof.marks, {
+                kind = kind, part = part, question = question,
+                clock = os.clock(), wall = os.gettimeofday(), lua_kb = collectgarbage("count")
+            })
+        end
+        function qpprof.finish()
+            qpprof.mark("done", 0, 0)
+            local fonts = {}
+            for id, f in font.each() do
+                table.insert(fonts, {id = id, name = f.name, file = f.filename, size = f.size})
+            end
+            local stats = {}
+            for key, value in pairs(status.list()) do
+                if type(value) == "number" or type(value) == "string" then
+                    stats[key] = value
+                end
+            end
+            local out = io.open(lfs.currentdir() .. "/Reports/profile.json", "wb")
+            out:write(json.encode({marks = qpprof.marks, fonts = fonts, status = stats}))
+            out:close()
+        end
+        luatexbase.add_to_callback("wrapup_run", qpprof.finish, "qpprof")
+    end
+    local function profile_mark(kind, part, question)
+        if qpprof then
+            tex.print("\\directlua{qpprof.mark('" .. kind .. "'," .. part .. "," .. question .. ")}")
+        end
+    end
+
     -- Font settings from JSON if available
     local fonts = data.fonts or {}
     if fonts.arabic then
@@ -96,6 +170,7 @@ def get_question_latex_template() -> str:
         tex.print("\\newfontfamily\\malayalamfont[Script=Malayalam,Scale=" .. (fonts.malayalam_scale or "1.2") .. "]{" .. fonts.malayalam .. "}")
     end
 
+    profile_mark("header", 0, 0)
     tex.print(data.qp_code .. "\\hfill  Name .............................")
     tex.print("\\begin{flushright}")
     tex.print("Reg.No .............................\\\\")
@@ -112,11 +187,13 @@ def get_question_latex_template() -> str:
     tex.print("Time : " .. data.time .. " \\hfill " .. "Max marks : " .. data.max_marks)
     tex.print("\\begin{enumerate}")
     for i, row in ipairs(data.qp_parts) do
+        profile_mark("part", i, 0)
         tex.print("\\begin{center}")
         tex.print("\\textbf{" .. row.part_name .. "} \\\\")
         tex.print("\\texttt{" .. row.part_description .. "} \\\\")
         tex.print("\\end{center}")
         for j, part in ipairs(row.content) do
+            profile_mark("question", i, j)
             if string.find(part, "\\begin{tabular}") then
                 tex.print(part)
             else
@@ -125,13 +202,40 @@ def get_question_latex_template() -> str:
             end
         end
 
+        profile_mark("footer", i, 0)
         tex.print("\\begin{flushright}")
         tex.print("\\texttt{\\textbf{" .. row.footer .. "}} \\\\")
         tex.print("\\end{flushright}")
 
     end
     tex.print("\\end{enumerate}")
+    profile_mark("end", 0, 0)
 
 \end{luacode*}
 \end{document}
 '''
+
+
+def get_template_version() -> str:
+    """
+    Returns a short hash identifying the current question paper template
+    """
+    template = get_question_latex_template()
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+
+def get_question_format_preamble() -> str:
+    """
+    Returns the part of the template that is precompiled into the format
+    """
+    template = get_question_latex_template()
+    return template.split(FORMAT_DUMP_MARKER, 1)[0]
+
+
+def get_template_fonts() -> list:
+    """
+    Returns the font names declared with \\newfontfamily in the template
+    """
+    template = get_question_latex_template()
+    fonts = re.findall(r"\\newfontfamily\\\w+\s*\[[^\]]*\]\s*\{([^}]+)\}", template)
+    return list(dict.fromkeys(fonts))
@@ -0,0 +1,94 @@
+"""
+Writing systems a question paper may use beyond Latin
+
+Loading a polyglossia language and its fontspec font families is among the
+most expensive parts of a LuaLaTeX pass, so the template only declares the
+scripts a paper actually uses. A script is used when its characters appear
+in the text or when the text calls one of its language commands
+(\\textmalayalam, \\begin{hindi}, \\selectlanguage{arabic}, ...).
+"""
+
+import re
+from typing import Any, Iterable, Iterator, Tuple
+
+# In the order the template declares their languages
+SCRIPTS = ("devanagari", "malayalam", "arabic")
+
+# Polyglossia language of each script
+SCRIPT_LANGUAGES = {
+    "devanagari": "hindi",
+    "malayalam": "malayalam",
+    "arabic": "arabic",
+}
+
+SCRIPT_PATTERNS = {
+    "devanagari": re.compile(
+        r"[\u0900-\u097F\u1CD0-\u1CFF\uA8E0-\uA8FF]|"
+        r"\\(?:texthindi|hindifont|devanagarifont)\b|\{hindi\}"
+    ),
+    "malayalam": re.compile(
+        r"[\u0D00-\u0D7F]|"
+        r"\\(?:textmalayalam|malayalamfont)\b|\{malayalam\}"
+    ),
+    "arabic": re.compile(
+        r"[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]|"
+        r"\\(?:textarabic|arabicfont)\b|\{[Aa]rabic\}"
+    ),
+}
+
+# Fields that never reach the typeset text: image sources can be large
+# base64 strings, font overrides only matter for scripts already in use
+IGNORED_FIELDS = ("images", "fonts")
+
+
+def _texts(value: Any) -> Iterator[str]:
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            if key not in IGNORED_FIELDS:
+                yield from _texts(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _texts(item)
+
+
+def detect_scripts(data: Any) -> Tuple[str, ...]:
+    """
+    Find the non-Latin scripts used by question paper data or a text
+
+    Args:
+        data: Question paper data, or a single string
+
+    Returns:
+        Used scripts, in SCRIPTS order
+    """
+    found = set()
+    for text in _texts(data):
+        for script in SCRIPTS:
+            if script not in found and SCRIPT_PATTERNS[script].search(text):
+                found.add(script)
+        if len(found) == len(SCRIPTS):
+            break
+    return tuple(script for script in SCRIPTS if script in found)
+
+
+def normalize_scripts(scripts: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Order a collection of script names as in SCRIPTS
+
+    Raises:
+        ValueError: If a name is not a known script
+    """
+    scripts = set(scripts)
+    unknown = scripts - set(SCRIPTS)
+    if unknown:
+        raise ValueError(f"Unknown scripts: {', '.join(sorted(unknown))}")
+    return tuple(script for script in SCRIPTS if script in scripts)
+
+
+def script_set_label(scripts: Iterable[str]) -> str:
+    """
+    Name a script set for logs and headers, e.g. "latin,malayalam"
+    """
+    return ",".join(("latin", *scripts))
@@ -3,7 +3,13 @@ Helper utilities for the LaTeX to PDF converter
 """
 
 import logging
-import io
+import os
+import pathlib
+import re
+from typing import IO, AsyncIterator, Callable, Dict, Optional, Tuple, Union
+
+import anyio
+from fastapi import Response
 from fastapi.responses import StreamingResponse
 
 logger = logging.getLogger(__name__)
@@ -21,23 +27,163 @@ def setup_logging(level: int = logging.INFO) -> None:
     logger.info(f"Logging configured at level: {logging.getLevelName(level)}")
 
 
-def create_pdf_response(pdf_bytes: bytes, filename: str) -> StreamingResponse:
+RANGE_PATTERN = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$")
+
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
     """
-    Create a FastAPI StreamingResponse for PDF files
+    Parse a single-range HTTP Range header
     
     Args:
-        pdf_bytes: PDF file content as bytes
+        range_header: Value of the Range header
+        size: Size of the representation in bytes
+        
+    Returns:
+        Inclusive (start, end) byte positions, or None to send the whole body
+        
+    Raises:
+        ValueError: If the range cannot be satisfied
+    """
+    if not range_header:
+        return None
+    match = RANGE_PATTERN.match(range_header)
+    if match is None:
+        # Multiple or malformed ranges: fall back to a full response
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range {range_header} not satisfiable for {size} bytes")
+    return start, end
+
+
+async def _iter_file(handle: anyio.AsyncFile, start: int, length: int) -> AsyncIterator[bytes]:
+    await handle.seek(start)
+    remaining = length
+    while remaining > 0:
+        chunk = await handle.read(min(FILE_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+class _FileStreamingResponse(StreamingResponse):
+    """
+    Streams an open file, then closes it and calls on_close however the
+    response ends: sent, failed, or the client gone before the first chunk
+    """
+
+    def __init__(self, file: IO[bytes], start: int, length: int, on_close: Optional[Callable[[], None]], **kwargs):
+        self._file = file
+        self._on_close = on_close
+        super().__init__(_iter_file(anyio.wrap_file(file), start, length), **kwargs)
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._file.close()
+            if self._on_close is not None:
+                self._on_close()
+
+
+async def _iter_bytes(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+def create_pdf_response(
+    pdf: Union[bytes, pathlib.Path],
+    filename: str,
+    headers: Optional[Dict[str, str]] = None,
+    range_header: Optional[str] = None,
+    if_range: Optional[str] = None,
+    on_close: Optional[Callable[[], None]] = None
+) -> Response:
+    """
+    Create a FastAPI response for a PDF held in memory or on disk
+    
+    Files are streamed in chunks without loading them into memory. The
+    response always carries Content-Length and honours single byte ranges.
+    
+    Args:
+        pdf: PDF file content as bytes, or path of the PDF file
         filename: Filename for the downloaded file
+        headers: Extra response headers (e.g. ETag)
+        range_header: Value of the request's Range header
+        if_range: Value of the request's If-Range header; ranges are only
+            served when it matches the ETag
+        on_close: Called once the response is over, whether the body was
+            sent or the client went away
         
     Returns:
-        FastAPI StreamingResponse configured for PDF download
+        200 or 206 StreamingResponse, or 416 for an unsatisfiable range
     """
-    logger.info(f"Creating PDF response for file: {filename} ({len(pdf_bytes)} bytes)")
+    file = None
+    if isinstance(pdf, bytes):
+        size = len(pdf)
+    else:
+        # Opened now, so a concurrent cache eviction cannot remove the file
+        # before the body starts
+        file = open(pdf, "rb")
+        size = os.fstat(file.fileno()).st_size
+    logger.info(f"Creating PDF response for file: {filename} ({size} bytes)")
+    
+    response_headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Accept-Ranges": "bytes",
+    }
+    if headers:
+        response_headers.update(headers)
+    
+    if if_range is not None and if_range.strip() != response_headers.get("ETag"):
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        if file is not None:
+            file.close()
+        if on_close is not None:
+            on_close()
+        return Response(
+            status_code=416,
+            headers={"Content-Range": f"bytes */{size}", "Accept-Ranges": "bytes"}
+        )
+    
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range is not None:
+        start, end = byte_range
+        status_code = 206
+        response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    length = end - start + 1
+    response_headers["Content-Length"] = str(length)
+    
+    if file is not None:
+        return _FileStreamingResponse(
+            file, start, length, on_close,
+            status_code=status_code,
+            media_type="application/pdf",
+            headers=response_headers
+        )
     
+    if on_close is not None:
+        on_close()
     return StreamingResponse(
-        io.BytesIO(pdf_bytes),
+        _iter_bytes(pdf[start:end + 1]),
+        status_code=status_code,
         media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        headers=response_headers
     )
 
 
@@ -0,0 +1,173 @@
+"""
+Compile worker for the asynchronous job API
+
+Runs inside the API process (JOB_EMBEDDED_WORKERS, from its first job on) or
+standalone through worker.py, so compile capacity can be scaled separately
+from the HTTP tier.
+Both modes share compile_question_paper with the synchronous /convert path.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import subprocess
+import time
+
+from . import config
+from .services.compile_pool import CompilePoolFullError
+from .services.job_queue import JobStore, get_job_store
+from .services.latex_compiler import compile_question_paper
+from .services.runtime import compile_runtime
+from .services.warmup import run_warmup
+from .utils.helpers import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Longest pause of a worker whose jobs keep finding the compile pool full
+MAX_BACKOFF = 60.0
+
+
+async def process_job(store: JobStore, job: dict) -> None:
+    """
+    Compile one claimed job and record its outcome
+    
+    Args:
+        store: Job store the job was claimed from
+        job: Claimed job record including its payload
+        
+    Raises:
+        CompilePoolFullError: If no compile slot was free; the job is back
+            in the queue
+    """
+    job_id = job["id"]
+    logger.info(f"Worker compiling job {job_id} ({job.get('qp_code')})")
+    start = time.perf_counter()
+    try:
+        result = await compile_question_paper(job["payload"])
+        try:
+            info = {
+                "bytes": result.size,
+                "passes": result.passes,
+                "scripts": result.script_set,
+                "cache_hit": result.cache_hit,
+                "etag": result.etag,
+                "compile_seconds": round(time.perf_counter() - start, 3),
+            }
+            await asyncio.to_thread(store.complete, job_id, result.pdf, info)
+        finally:
+            result.release()
+        logger.info(f"Job {job_id} done in {info['compile_seconds']}s")
+    except CompilePoolFullError:
+        # Synchronous traffic has the pool: not the job's fault
+        logger.info(f"Compile pool full, requeueing job {job_id}")
+        await asyncio.to_thread(store.requeue, job_id)
+        raise
+    except subprocess.TimeoutExpired as e:
+        await asyncio.to_thread(store.fail, job_id, f"Compilation timed out after {e.timeout:.0f}s")
+    except Exception as e:
+        logger.warning(f"Job {job_id} failed: {e}")
+        await asyncio.to_thread(store.fail, job_id, str(e)[:4000])
+
+
+async def worker_loop(store: JobStore, worker_id: str, poll_interval: float) -> None:
+    """
+    Claim and process jobs until cancelled
+    
+    Args:
+        store: Job store to poll
+        worker_id: Identifier recorded on claimed jobs
+        poll_interval: Seconds to sleep when the queue is empty
+    """
+    last_purge = 0.0
+    backoff = 0.0
+    while True:
+        try:
+            if time.time() - last_purge > 300:
+                last_purge = time.time()
+                purged = await asyncio.to_thread(store.purge_expired)
+                if purged:
+                    logger.info(f"Purged {purged} expired jobs")
+
+            job = await asyncio.to_thread(store.claim, worker_id)
+            if job is None:
+                await asyncio.sleep(poll_interval)
+                continue
+            await process_job(store, job)
+            backoff = 0.0
+        except asyncio.CancelledError:
+            raise
+        except CompilePoolFullError as e:
+            # Doubled on every rejection in a row, so waiting workers do not
+            # keep a busy pool's queue full
+            backoff = min(MAX_BACKOFF, backoff * 2 if backoff else float(e.retry_after))
+            await asyncio.sleep(backoff)
+        except Exception as e:
+            logger.error(f"Worker {worker_id} error: {e}")
+            await asyncio.sleep(poll_interval)
+
+
+def start_workers(count: int) -> list:
+    """
+    Start worker loops as tasks on the running event loop
+    
+    Args:
+        count: Number of concurrent worker loops
+        
+    Returns:
+        List of asyncio tasks
+    """
+    store = get_job_store()
+    base_id = f"{socket.gethostname()}:{os.getpid()}"
+    return [
+        asyncio.create_task(worker_loop(store, f"{base_id}:{i}", config.JOB_POLL_INTERVAL))
+        for i in range(count)
+    ]
+
+
+_embedded_tasks: list = []
+
+
+def start_embedded_workers() -> None:
+    """
+    Start the JOB_EMBEDDED_WORKERS loops of the API process, if not running
+
+    Called on the first enqueue rather than at startup, so API processes
+    that never take a job do not open the job store or poll it.
+    """
+    if not _embedded_tasks and config.JOB_EMBEDDED_WORKERS:
+        _embedded_tasks.extend(start_workers(config.JOB_EMBEDDED_WORKERS))
+        logger.info(f"Started {len(_embedded_tasks)} embedded job workers")
+
+
+def stop_embedded_workers() -> None:
+    """
+    Cancel the embedded worker loops of the API process
+    """
+    for task in _embedded_tasks:
+        if not task.done():
+            task.cancel()
+    _embedded_tasks.clear()
+
+
+async def run_standalone() -> None:
+    """
+    Entry point of a dedicated compile worker process
+    """
+    async with compile_runtime():
+        await run_warmup()
+        tasks = start_workers(config.JOB_WORKER_CONCURRENCY)
+        logger.info(f"Compile worker started with {len(tasks)} loops on backend {config.JOB_BACKEND}")
+        await asyncio.gather(*tasks)
+
+
+def main() -> None:
+    setup_logging()
+    try:
+        asyncio.run(run_standalone())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
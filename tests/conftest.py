@@ -0,0 +1,12 @@
+"""
+Test setup: all state the services write goes to a throwaway data directory
+"""
+
+import os
+import sys
+import tempfile
+
+# Before src.config is imported, which reads it once
+os.environ.setdefault("LATEXTOPDF_DATA_DIR", tempfile.mkdtemp(prefix="latextopdf-tests-"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
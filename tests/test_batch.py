@@ -0,0 +1,54 @@
+import asyncio
+import io
+import os
+import zipfile
+
+from src.services import batch
+from src.services.batch import _ZipBuffer, _entry_name, _write_file
+
+
+def test_entry_names_are_numbered_and_safe():
+    assert _entry_name(0, {"qp_code": "QP 12/A"}) == "0001_QP_12_A.pdf"
+    assert _entry_name(9, {"qp_code": "", "password": True}) == "0010_paper_protected.pdf"
+
+
+def test_files_are_streamed_into_the_archive_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "ARCHIVE_CHUNK_SIZE", 1000)
+    pdf = tmp_path / "a.pdf"
+    pdf.write_bytes(os.urandom(4500))
+
+    async def build():
+        buffer = _ZipBuffer()
+        chunks = []
+        with zipfile.ZipFile(buffer, mode="w") as archive:
+            async for chunk in _write_file(archive, buffer, pdf, "0001_a.pdf"):
+                chunks.append(chunk)
+            archive.writestr("manifest.json", "{}")
+        chunks.append(buffer.drain())
+        return chunks
+
+    chunks = asyncio.run(build())
+    assert len(chunks) > 4
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.read("0001_a.pdf") == pdf.read_bytes()
+
+
+def test_items_give_up_on_a_pool_that_stays_full(monkeypatch):
+    attempts = []
+    sleeps = []
+
+    async def full(paper):
+        attempts.append(1)
+        raise batch.CompilePoolFullError(retry_after=30)
+
+    async def sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(batch, "compile_question_paper", full)
+    monkeypatch.setattr(batch.asyncio, "sleep", sleep)
+    monkeypatch.setattr(batch, "MAX_POOL_WAIT", 100.0)
+
+    item = asyncio.run(batch._compile_item(0, {"qp_code": "QP1"}, asyncio.Semaphore(1)))
+    assert item["status"] == "failed" and "Compile pool full" in item["error"]
+    assert sleeps == [30, 30, 30] and len(attempts) == 4
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from src.services.compile_pool import CompilePool, CompilePoolFullError
+
+
+def test_reservations_fill_the_queue_before_any_slot_is_waited_for():
+    async def run():
+        pool = CompilePool(concurrency=1, queue_size=1, retry_after=7)
+        async with pool.slot():
+            async with pool.reserve() as reservation:
+                with pytest.raises(CompilePoolFullError) as error:
+                    async with pool.reserve():
+                        pass
+                assert error.value.retry_after == 7
+                assert pool.stats()["reserved"] == 1
+            # An unused reservation is given back
+            assert pool.reserved == 0
+            async with pool.reserve():
+                pass
+
+    asyncio.run(run())
+
+
+def test_slot_takes_the_place_of_its_reservation():
+    async def run():
+        pool = CompilePool(concurrency=1, queue_size=1, retry_after=1)
+        release = asyncio.Event()
+        seen = []
+
+        async def holder():
+            async with pool.slot():
+                await release.wait()
+
+        async def reserved_compile():
+            async with pool.reserve() as reservation:
+                async with pool.slot(reservation):
+                    seen.append(pool.active)
+
+        task = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        compile_task = asyncio.create_task(reserved_compile())
+        await asyncio.sleep(0)
+        assert (pool.waiting, pool.reserved) == (1, 0)
+        release.set()
+        await asyncio.gather(task, compile_task)
+        assert seen == [1]
+        assert (pool.active, pool.waiting, pool.reserved) == (0, 0, 0)
+
+    asyncio.run(run())
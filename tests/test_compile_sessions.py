@@ -0,0 +1,84 @@
+import asyncio
+
+from src.services import compile_sessions
+from src.services.compile_sessions import SessionStore
+
+
+def _store(tmp_path, ttl=60.0, max_bytes=1024 * 1024):
+    return SessionStore(str(tmp_path / "sessions"), ttl=ttl, max_bytes=max_bytes)
+
+
+async def _compile(store, session_id, size=0):
+    async with store.session(session_id) as session:
+        (session.workdir / "document.aux").write_bytes(b"x" * size)
+        return session
+
+
+def test_a_session_keeps_its_workspace_between_compiles(tmp_path):
+    store = _store(tmp_path)
+
+    async def twice():
+        first = await _compile(store, "editor-1", size=10)
+        second = await _compile(store, "editor-1")
+        return first, second
+
+    first, second = asyncio.run(twice())
+    assert first is second and second.compiles == 2
+    assert (second.workdir / "document.aux").exists()
+    assert store.stats()["created"] == 1 and store.stats()["reused"] == 1
+    store.stop()
+
+
+def test_idle_sessions_expire_after_the_ttl(tmp_path, monkeypatch):
+    store = _store(tmp_path, ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr(compile_sessions.time, "monotonic", lambda: now[0])
+
+    async def run():
+        old = await _compile(store, "old")
+        now[0] += 50
+        await _compile(store, "recent")
+        now[0] += 20
+        await store.expire()
+        return old
+
+    old = asyncio.run(run())
+    assert not old.workdir.exists()
+    assert set(store._sessions) == {"recent"} and store.expired == 1
+    store.stop()
+
+
+def test_least_recently_used_sessions_go_beyond_the_size_bound(tmp_path, monkeypatch):
+    store = _store(tmp_path, max_bytes=2500)
+    now = [1000.0]
+    monkeypatch.setattr(compile_sessions.time, "monotonic", lambda: now[0])
+
+    async def run():
+        for session_id in ("a", "b", "c"):
+            now[0] += 1
+            await _compile(store, session_id, size=1000)
+
+    asyncio.run(run())
+    assert set(store._sessions) == {"b", "c"} and store.evicted == 1
+    assert store.stats()["bytes"] == 2000
+    store.stop()
+
+
+def test_sessions_in_use_are_never_removed(tmp_path, monkeypatch):
+    store = _store(tmp_path, ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr(compile_sessions.time, "monotonic", lambda: now[0])
+
+    async def run():
+        await _compile(store, "busy", size=1000)
+        async with store.session("busy") as session:
+            store.max_bytes = 100
+            now[0] += 3600
+            await store.expire()
+            await store._enforce_limit()
+            assert "busy" in store._sessions and session.workdir.exists()
+        # Released: now it alone exceeds the bound
+        assert "busy" not in store._sessions
+
+    asyncio.run(run())
+    store.stop()
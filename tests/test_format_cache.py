@@ -0,0 +1,74 @@
+import asyncio
+import os
+import pathlib
+
+from src.services import format_cache as format_cache_module
+from src.services.format_cache import FormatCache
+
+
+def _fake_tex(monkeypatch, version="LuaHBTeX, Version 1.17.0", build_ok=True):
+    calls = []
+
+    async def run_command(cmd, cwd=None, timeout=None, env=None):
+        calls.append(cmd)
+        if cmd[1] == "--version":
+            return 0, f"This is {version}\n", ""
+        if build_ok:
+            name = next(arg for arg in cmd if arg.startswith("-jobname=")).split("=", 1)[1]
+            (pathlib.Path(cwd) / f"{name}.fmt").write_bytes(b"fmt")
+            return 0, "", ""
+        return 1, "! I can't find file `mylatexformat.ltx'.", ""
+
+    monkeypatch.setattr(format_cache_module, "run_command", run_command)
+    return calls
+
+
+def test_format_is_built_once_and_reused(tmp_path, monkeypatch):
+    calls = _fake_tex(monkeypatch)
+    cache = FormatCache(str(tmp_path))
+
+    async def twice():
+        return await asyncio.gather(cache.ensure(), cache.ensure())
+
+    first, second = asyncio.run(twice())
+    assert first == second and first.startswith("question-")
+    assert (tmp_path / f"{first}.fmt").exists()
+    assert sum(1 for cmd in calls if "-ini" in cmd) == 1
+    assert asyncio.run(cache.ensure()) == first
+
+
+def test_format_name_follows_the_tex_version(tmp_path, monkeypatch):
+    _fake_tex(monkeypatch, version="LuaHBTeX, Version 1.17.0")
+    old = asyncio.run(FormatCache(str(tmp_path)).format_name())
+    _fake_tex(monkeypatch, version="LuaHBTeX, Version 1.18.0")
+    assert asyncio.run(FormatCache(str(tmp_path)).format_name()) != old
+
+
+def test_failed_builds_fall_back_without_retrying(tmp_path, monkeypatch):
+    calls = _fake_tex(monkeypatch, build_ok=False)
+    cache = FormatCache(str(tmp_path))
+    assert asyncio.run(cache.ensure()) is None
+    assert asyncio.run(cache.ensure()) is None
+    assert sum(1 for cmd in calls if "-ini" in cmd) == 1
+    assert len(cache.stats()["failed"]) == 1
+
+
+def test_missing_lualatex_disables_the_format(tmp_path, monkeypatch):
+    async def run_command(cmd, cwd=None, timeout=None, env=None):
+        raise FileNotFoundError("lualatex")
+
+    monkeypatch.setattr(format_cache_module, "run_command", run_command)
+    assert asyncio.run(FormatCache(str(tmp_path)).ensure()) is None
+    assert asyncio.run(FormatCache(str(tmp_path), enabled=False).ensure()) is None
+
+
+def test_only_day_old_formats_are_pruned(tmp_path, monkeypatch):
+    _fake_tex(monkeypatch)
+    stale = tmp_path / "question-stale.fmt"
+    recent = tmp_path / "question-recent.fmt"
+    for path in (stale, recent):
+        path.write_bytes(b"fmt")
+    os.utime(stale, (1, 1))
+    name = asyncio.run(FormatCache(str(tmp_path)).ensure())
+    assert not stale.exists()
+    assert recent.exists() and (tmp_path / f"{name}.fmt").exists()
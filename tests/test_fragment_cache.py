@@ -0,0 +1,25 @@
+from src.services.fragment_cache import FragmentCache, is_fragment_candidate
+
+
+def test_inline_questions_are_not_fragments():
+    assert is_fragment_candidate("1. Define entropy.")
+    assert not is_fragment_candidate("2. See \\ref{fig}")
+    assert not is_fragment_candidate("3. \\includegraphics{a.png}")
+    assert not is_fragment_candidate("   ")
+
+
+def test_eviction_never_touches_snippets_being_built(tmp_path):
+    cache = FragmentCache(str(tmp_path), max_bytes=0)
+    key = cache.key("1. Define entropy.", None)
+    snippet = cache._path(key)
+    snippet.parent.mkdir(parents=True)
+    snippet.write_bytes(b"%PDF-1.4 snippet")
+    building = cache.staging_dir / "tmp1234" / "fragment.pdf"
+    building.parent.mkdir(parents=True)
+    building.write_bytes(b"%PDF-1.4 half")
+
+    cache._evict()
+
+    assert not snippet.exists()
+    assert building.exists()
+    assert cache.evictions == 1
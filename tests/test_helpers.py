@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from src.utils.helpers import create_pdf_response, parse_range
+
+
+def test_parse_range_forms():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=-500", 100) == (0, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+
+
+def test_parse_range_falls_back_or_rejects():
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+    for header in ("bytes=100-", "bytes=9-5", "bytes=-0"):
+        with pytest.raises(ValueError):
+            parse_range(header, 100)
+
+
+def _call(response, disconnect):
+    messages = []
+
+    async def receive():
+        if disconnect:
+            return {"type": "http.disconnect"}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response({"type": "http"}, receive, send))
+    return messages
+
+
+def test_file_response_serves_ranges_and_releases(tmp_path):
+    pdf = tmp_path / "a.pdf"
+    pdf.write_bytes(b"%PDF-" + bytes(range(256)) * 1000)
+    released = []
+    response = create_pdf_response(
+        pdf, "a.pdf", {"ETag": '"x"'}, "bytes=5-", '"x"', on_close=lambda: released.append(True)
+    )
+    messages = _call(response, disconnect=False)
+    assert messages[0]["status"] == 206
+    assert b"".join(m.get("body", b"") for m in messages[1:]) == pdf.read_bytes()[5:]
+    assert released == [True]
+
+
+def test_file_is_released_when_the_body_is_never_sent(tmp_path):
+    pdf = tmp_path / "a.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    released = []
+    response = create_pdf_response(pdf, "a.pdf", on_close=lambda: released.append(True))
+    _call(response, disconnect=True)
+    assert released == [True]
+    assert response._file.closed
+
+
+def test_unsatisfiable_range_releases_at_once(tmp_path):
+    pdf = tmp_path / "a.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    released = []
+    response = create_pdf_response(pdf, "a.pdf", range_header="bytes=50-", on_close=lambda: released.append(True))
+    assert response.status_code == 416
+    assert released == [True]
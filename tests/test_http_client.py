@@ -0,0 +1,62 @@
+import asyncio
+import gzip
+
+import httpx
+import pytest
+
+from src import config
+from src.services import http_client
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    def install(handler):
+        monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        monkeypatch.setattr(http_client, "_download_semaphore", None)
+
+    return install
+
+
+def test_body_is_decoded_once(serve):
+    serve(lambda request: httpx.Response(
+        200, headers={"Content-Encoding": "gzip", "ETag": '"a"'}, content=gzip.compress(b"image" * 100)
+    ))
+    response = asyncio.run(http_client.fetch("http://images.example/a.png"))
+    assert response.content == b"image" * 100
+    assert response.headers["etag"] == '"a"'
+    response.raise_for_status()
+
+
+def test_oversized_bodies_are_abandoned(serve, monkeypatch):
+    monkeypatch.setattr(config, "HTTP_MAX_DOWNLOAD_MB", 1)
+    big = b"x" * (1024 * 1024 + 1)
+    serve(lambda request: httpx.Response(200, content=big))
+    with pytest.raises(http_client.DownloadTooLargeError):
+        asyncio.run(http_client.fetch("http://images.example/declared.png"))
+
+    async def chunks():
+        yield big[:4096]
+        yield big[4096:]
+
+    # Chunked, so only counting the streamed bytes catches it
+    serve(lambda request: httpx.Response(200, content=chunks()))
+    with pytest.raises(http_client.DownloadTooLargeError):
+        asyncio.run(http_client.fetch("http://images.example/chunked.png"))
+
+
+def test_slots_are_free_during_backoff(serve, monkeypatch):
+    monkeypatch.setattr(config, "HTTP_RETRIES", 1)
+    monkeypatch.setattr(config, "HTTP_MAX_PER_HOST", 1)
+    held = []
+
+    async def no_sleep(delay):
+        held.append(dict(http_client._host_users))
+
+    monkeypatch.setattr(http_client.asyncio, "sleep", no_sleep)
+    replies = iter([503, 200])
+    serve(lambda request: httpx.Response(next(replies)))
+    response = asyncio.run(http_client.fetch("http://images.example/a.png"))
+    assert response.status_code == 200
+    assert held == [{}]
+    # Host entries go once their downloads are done
+    assert http_client._host_semaphores == {} and http_client._host_users == {}
@@ -0,0 +1,49 @@
+import os
+
+from src.services import image_cache as image_cache_module
+from src.services.image_cache import ImageCache, link_into
+
+
+def test_link_into_copies_across_filesystems(tmp_path, monkeypatch):
+    source = tmp_path / "blob"
+    source.write_bytes(b"png")
+    dest = tmp_path / "a.png"
+
+    def no_link(src, dst):
+        raise OSError(18, "Invalid cross-device link")
+
+    monkeypatch.setattr(image_cache_module.os, "link", no_link)
+    link_into(source, dest)
+    source.unlink()
+    assert not dest.is_symlink()
+    assert dest.read_bytes() == b"png"
+
+
+def test_store_keeps_a_running_total_and_evicts_oldest(tmp_path, monkeypatch):
+    cache = ImageCache(str(tmp_path), max_bytes=10, ttl=60)
+    first = cache._store_blob(b"aaaa")
+    os.utime(cache.blob_dir / first, (1, 1))
+    scans = []
+    scan = cache._scan
+    monkeypatch.setattr(cache, "_scan", lambda: scans.append(1) or scan())
+
+    cache._store_blob(b"bbbb")
+    assert cache._total == 8 and scans == []
+    cache._store_blob(b"cccc")
+
+    assert scans == [1]
+    assert not (cache.blob_dir / first).exists()
+    assert cache._total == 8 and cache.evictions == 1
+
+
+def test_eviction_deletes_the_url_records_of_evicted_blobs(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=10, ttl=60)
+    old = cache._store_blob(b"aaaa")
+    os.utime(cache.blob_dir / old, (1, 1))
+    cache._save_meta("http://a/old.png", {"url": "http://a/old.png", "blob": old})
+    new = cache._store_blob(b"bbbb")
+    cache._save_meta("http://a/new.png", {"url": "http://a/new.png", "blob": new})
+
+    cache._store_blob(b"cccc")
+    assert cache._load_meta("http://a/old.png") is None
+    assert cache._load_meta("http://a/new.png")["blob"] == new
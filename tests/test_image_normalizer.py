@@ -0,0 +1,92 @@
+import asyncio
+import io
+import math
+
+import pytest
+
+from src import config
+from src.services import image_normalizer
+from src.services.image_normalizer import DEFAULT_DISPLAY_SIZE, display_size, normalize_images
+from src.services.image_processor import collect_display_sizes, rewrite_image_urls
+
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture
+def normalizer(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "IMAGE_NORMALIZE", True)
+    monkeypatch.setattr(config, "IMAGE_NORMALIZE_DPI", 100)
+    monkeypatch.setattr(config, "IMAGE_NORMALIZE_CACHE_DIR", str(tmp_path / "normalized"))
+    monkeypatch.setattr(image_normalizer, "_cache_bytes", None)
+    photo_dir = tmp_path / "photos"
+    photo_dir.mkdir()
+    return photo_dir
+
+
+def _image(path, size, fmt):
+    output = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(output, fmt)
+    path.write_bytes(output.getvalue())
+
+
+def test_display_size_from_options():
+    assert display_size(None) == DEFAULT_DISPLAY_SIZE
+    assert display_size("[width=2in]") == (2.0, DEFAULT_DISPLAY_SIZE[1])
+    width, height = display_size("[width=0.5\\textwidth, height=10cm]")
+    assert width == pytest.approx(0.5 * 182 / 25.4) and height == pytest.approx(10 / 2.54)
+    assert display_size("[scale=2]") == (math.inf, math.inf)
+    assert display_size("[width=3em]")[0] == math.inf
+
+
+def test_display_sizes_take_the_largest_use():
+    contents = [
+        "\\includegraphics[width=1in]{https://x/a.png} \\includegraphics{b.gif}",
+        "\\includegraphics[width=3in]{https://x/a.png}",
+    ]
+    sizes = collect_display_sizes(contents, {"https://x/a.png": "a.png"})
+    assert sizes["a.png"][0] == 3.0
+    assert sizes["b.gif"] == DEFAULT_DISPLAY_SIZE
+
+
+def test_images_are_downscaled_to_their_displayed_width(normalizer):
+    _image(normalizer / "wide.jpg", (2000, 200), "JPEG")
+    _image(normalizer / "big.jpg", (2000, 200), "JPEG")
+    renames = asyncio.run(normalize_images(normalizer, {"wide.jpg": (4.0, 10.0)}))
+    assert renames == {}
+    assert Image.open(normalizer / "wide.jpg").width == 400
+    # Template default: 0.3 of the text width at 100 dpi
+    assert Image.open(normalizer / "big.jpg").width == int(DEFAULT_DISPLAY_SIZE[0] * 100)
+
+
+def test_converted_images_never_replace_another_file(normalizer):
+    _image(normalizer / "a.gif", (50, 50), "GIF")
+    _image(normalizer / "a.png", (60, 60), "PNG")
+    renames = asyncio.run(normalize_images(normalizer))
+    assert renames == {"a.gif": "a_gif.png"}
+    assert Image.open(normalizer / "a.png").size == (60, 60)
+    assert Image.open(normalizer / "a_gif.png").size == (50, 50)
+    assert not (normalizer / "a.gif").exists()
+
+
+def test_cache_is_trimmed_to_its_size_limit(normalizer, monkeypatch):
+    monkeypatch.setattr(config, "IMAGE_NORMALIZE_CACHE_MB", 0)
+    for index in range(3):
+        _image(normalizer / f"p{index}.bmp", (40 + index, 40), "BMP")
+    asyncio.run(normalize_images(normalizer))
+    cache_dir = normalizer.parent / "normalized"
+    assert [path for path in cache_dir.iterdir() if path.suffix != ".keep"] == []
+    assert image_normalizer._cache_bytes == 0
+    assert sorted(path.name for path in normalizer.iterdir()) == ["p0_bmp.jpg", "p1_bmp.jpg", "p2_bmp.jpg"]
+    assert all(Image.open(path).width >= 40 for path in normalizer.iterdir())
+
+
+def test_extensionless_references_follow_the_conversion(tmp_path):
+    (tmp_path / "foo_webp.png").write_bytes(b"png")
+    (tmp_path / "a.png").write_bytes(b"png")
+    renames = {"foo.webp": "foo_webp.png", "a.gif": "a_gif.png"}
+    content = "\\includegraphics{Photo/foo} \\includegraphics[width=2cm]{foo.webp} \\includegraphics{a}"
+    assert rewrite_image_urls(content, {}, tmp_path, renames) == (
+        "\\includegraphics{Photo/foo_webp.png} \\includegraphics[width=2cm]{foo_webp.png} "
+        # graphicx finds a.png under this name, so it is left alone
+        "\\includegraphics{a}"
+    )
@@ -0,0 +1,54 @@
+import asyncio
+import base64
+
+from src.services import image_processor
+from src.services.image_processor import assign_filenames, collect_image_urls, prefetch_document_assets
+
+URL = "https://images.example/q/graph.png"
+OTHER = "https://cdn.example/graph.png"
+
+
+def test_urls_are_collected_once_across_the_document():
+    contents = [
+        f"\\includegraphics[width=3cm]{{{URL}}} and \\includegraphics{{{OTHER}}}",
+        f"again \\includegraphics{{ {URL} }} and a local \\includegraphics{{Photo/Qpbank/a.png}}",
+    ]
+    assert collect_image_urls(contents) == [URL, OTHER]
+
+
+def test_filenames_never_collide():
+    filenames = assign_filenames([URL, OTHER, "https://images.example/"], reserved=["logo.png"])
+    assert filenames[URL] == "graph.png"
+    assert filenames[OTHER].endswith("_graph.png") and filenames[OTHER] != "graph.png"
+    assert filenames["https://images.example/"].startswith("downloaded_image_")
+    assert assign_filenames(["https://a.example/logo.png"], reserved=["logo.png"])["https://a.example/logo.png"] != "logo.png"
+
+
+def test_prefetch_downloads_each_url_once_and_rewrites_every_part(tmp_path, monkeypatch):
+    downloads = []
+
+    async def download_to(url, dest):
+        downloads.append(url)
+        dest.write_bytes(b"png")
+
+    async def no_normalization(photo_dir, display_sizes=None):
+        return {}
+
+    monkeypatch.setattr(image_processor, "_download_to", download_to)
+    monkeypatch.setattr(image_processor, "normalize_images", no_normalization)
+    data = {
+        "qp_code": "QP1",
+        "images": {"logo.png": "data:image/png;base64," + base64.b64encode(b"logo").decode()},
+        "qp_parts": [
+            {"part_name": "A", "content": [f"1. \\includegraphics{{{URL}}}", "2. no image"]},
+            {"part_name": "B", "content": [f"3. \\includegraphics[width=2cm]{{{URL}}}"]},
+        ],
+    }
+    processed = asyncio.run(prefetch_document_assets(data, tmp_path))
+
+    assert downloads == [URL]
+    assert (tmp_path / "logo.png").read_bytes() == b"logo"
+    assert processed["qp_parts"][0]["content"] == ["1. \\includegraphics{./Photo/Qpbank/graph.png}", "2. no image"]
+    assert processed["qp_parts"][1]["content"] == ["3. \\includegraphics[width=2cm]{./Photo/Qpbank/graph.png}"]
+    # The request itself is left as it was
+    assert data["qp_parts"][0]["content"][0].endswith(f"{{{URL}}}")
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import pytest
+
+from src.services import job_queue
+from src.services.compile_pool import CompilePoolFullError
+from src.services.job_queue import JOB_DONE, JOB_QUEUED, JOB_RUNNING, RedisJobStore, SQLiteJobStore
+from src import worker
+
+PAPER = {"qp_code": "QP1", "qp_parts": []}
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteJobStore(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "results"), ttl=3600, stale_after=60)
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return RedisJobStore("", ttl=3600, stale_after=60, client=fakeredis.FakeRedis())
+
+
+def test_jobs_are_claimed_in_order_and_once(store):
+    first = store.enqueue(PAPER)
+    second = store.enqueue(dict(PAPER, qp_code="QP2"))
+    assert store.depth() == 2
+
+    claimed = store.claim("w1")
+    assert claimed["id"] == first["id"] and claimed["payload"] == PAPER
+    assert store.get(first["id"])["status"] == JOB_RUNNING
+    assert store.claim("w2")["id"] == second["id"]
+    assert store.claim("w3") is None
+
+
+def test_complete_stores_the_pdf(store):
+    job = store.enqueue(PAPER)
+    store.claim("w1")
+    store.complete(job["id"], b"%PDF-1.4", {"bytes": 8})
+    assert store.get(job["id"])["status"] == JOB_DONE
+    result = store.get_result(job["id"])
+    assert (result if isinstance(result, bytes) else result.read_bytes()) == b"%PDF-1.4"
+    assert store.claim("w1") is None
+
+
+def test_requeued_job_is_claimed_next(store):
+    first = store.enqueue(PAPER)
+    store.enqueue(dict(PAPER, qp_code="QP2"))
+    store.claim("w1")
+    store.requeue(first["id"])
+    assert store.get(first["id"])["status"] == JOB_QUEUED
+    assert store.claim("w2")["id"] == first["id"]
+
+
+def test_jobs_of_dead_workers_are_requeued(store, monkeypatch):
+    job = store.enqueue(PAPER)
+    store.claim("w1")
+    assert store.claim("w2") is None
+    later = time.time() + 120
+    monkeypatch.setattr(job_queue.time, "time", lambda: later)
+    assert store.claim("w2")["id"] == job["id"]
+
+
+def test_pool_full_requeues_instead_of_failing(store, monkeypatch):
+    async def full(payload):
+        raise CompilePoolFullError(retry_after=1)
+
+    monkeypatch.setattr(worker, "compile_question_paper", full)
+    job = store.enqueue(PAPER)
+    with pytest.raises(CompilePoolFullError):
+        asyncio.run(worker.process_job(store, store.claim("w1")))
+    assert store.get(job["id"])["status"] == JOB_QUEUED
+    assert store.claim("w2")["id"] == job["id"]
+
+
+def test_backends_must_implement_the_whole_interface():
+    class Partial(job_queue.JobStore):
+        def enqueue(self, payload):
+            return {}
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_embedded_workers_start_on_the_first_job_only(monkeypatch):
+    started = []
+
+    async def idle(store, worker_id, poll_interval):
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(worker, "get_job_store", lambda: None)
+    monkeypatch.setattr(worker, "worker_loop", idle)
+    monkeypatch.setattr(worker.config, "JOB_EMBEDDED_WORKERS", 2)
+
+    async def main():
+        worker.start_embedded_workers()
+        started.append(len(worker._embedded_tasks))
+        worker.start_embedded_workers()
+        started.append(len(worker._embedded_tasks))
+        tasks = list(worker._embedded_tasks)
+        worker.stop_embedded_workers()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(task.cancelled() for task in tasks)
+
+    asyncio.run(main())
+    assert started == [2, 2]
+    assert worker._embedded_tasks == []
@@ -0,0 +1,69 @@
+import asyncio
+import pathlib
+
+import pytest
+
+from src import config
+from src.services import latex_compiler
+from src.services.latex_compiler import CompileResult, _needs_rerun, _uses_references
+from src.services.output_area import release
+
+
+def _write(workdir, aux="", log=""):
+    (workdir / "question.aux").write_text(aux)
+    (workdir / "question.log").write_text(log)
+
+
+def test_only_reference_commands_need_the_aux_file():
+    assert _uses_references("Page \\thepage{} of \\pageref{LastPage}")
+    assert _uses_references("see \\ref{q2}")
+    assert not _uses_references("1. Define \\textbf{work}. $x^2$")
+    assert not _uses_references("\\references are not \\refs")
+
+
+def test_rerun_when_the_aux_file_changed_or_the_log_asks(tmp_path):
+    _write(tmp_path, aux="\\newlabel{LastPage}{{}{3}}")
+    rerun, digest = _needs_rerun(tmp_path, "question", None, True)
+    assert rerun and digest
+    # Stable aux file and a quiet log: done
+    assert _needs_rerun(tmp_path, "question", digest, True) == (False, digest)
+
+    _write(tmp_path, aux="\\newlabel{LastPage}{{}{3}}", log="Label(s) may have changed. Rerun to get cross-references right.")
+    assert _needs_rerun(tmp_path, "question", digest, True)[0]
+
+
+def test_documents_without_references_never_rerun(tmp_path):
+    _write(tmp_path, aux="\\relax", log="Rerun to get cross-references right.")
+    rerun, digest = _needs_rerun(tmp_path, "question", None, False)
+    assert not rerun and digest
+
+
+@pytest.mark.parametrize("max_passes, aux_changes, expected", [(3, True, 3), (5, False, 2), (1, True, 1)])
+def test_passes_stop_at_a_stable_aux_file_or_the_cap(tmp_path, monkeypatch, max_passes, aux_changes, expected):
+    runs = []
+
+    async def run_command(cmd, cwd=None, timeout=None, env=None, on_output=None, limits=None):
+        runs.append(cmd)
+        cwd = pathlib.Path(cwd)
+        (cwd / "question.aux").write_text(f"\\newlabel{{LastPage}}{{{{}}{{{len(runs) if aux_changes else 1}}}}}")
+        (cwd / "question.log").write_text("")
+        (cwd / "question.pdf").write_bytes(b"%PDF-1.4")
+        return 0, "", ""
+
+    async def no_format():
+        return None
+
+    monkeypatch.setattr(config, "LATEX_MAX_PASSES", max_passes)
+    monkeypatch.setattr(config, "RENDER_ENGINE", "lua")
+    monkeypatch.setattr(latex_compiler, "run_command", run_command)
+    monkeypatch.setattr(latex_compiler.format_cache, "ensure", no_format)
+    monkeypatch.setattr(latex_compiler.pdf_encryptor, "optimizes", lambda protected: False)
+    (tmp_path / "Reports").mkdir()
+
+    data = {"qp_code": "QP1", "qp_parts": [{"part_name": "A", "content": ["Page \\pageref{LastPage}"]}]}
+    result = CompileResult(etag="k")
+    pdf = asyncio.run(latex_compiler._run_question_paper_tex(data, tmp_path, "QP1", None, result))
+    try:
+        assert result.passes == len(runs) == expected
+    finally:
+        release(pdf)
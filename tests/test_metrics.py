@@ -0,0 +1,47 @@
+import subprocess
+
+import pytest
+
+from src.services import metrics
+from src.services.compile_pool import CompilePoolFullError, ResourceLimitError, ResourceLimits
+from src.services.metrics import StageTimings, failure_cause
+from src.services.pdf_encryption import PdfEncryptionError
+from src.services.tex_log import LatexError
+
+
+def test_stages_keep_their_order_and_add_up(monkeypatch):
+    observed = []
+    monkeypatch.setattr(metrics, "observe_stage", lambda stage, seconds: observed.append(stage))
+    timings = StageTimings()
+    timings.add("parse", 0.002)
+    with timings.stage("lualatex_1", metric="lualatex_pass"):
+        pass
+    timings.add("lualatex_2", 0.25, metric="lualatex_pass")
+    timings.add("parse", 0.001)
+
+    assert list(timings.stages) == ["parse", "lualatex_1", "lualatex_2"]
+    assert timings.stages["parse"] == pytest.approx(0.003)
+    assert observed == ["parse", "lualatex_pass", "lualatex_pass", "parse"]
+    header = timings.server_timing()
+    assert header.startswith("parse;dur=3.0, lualatex_1;dur=")
+    assert header.endswith("lualatex_2;dur=250.0")
+
+
+def test_failed_stages_are_still_timed():
+    timings = StageTimings()
+    with pytest.raises(ValueError):
+        with timings.stage("encrypt"):
+            raise ValueError("broken")
+    assert "encrypt" in timings.stages
+
+
+def test_failure_causes_are_a_bounded_set():
+    limits = ResourceLimits(cpu_seconds=10, memory_bytes=1024 * 1024, output_bytes=1024 * 1024)
+    assert failure_cause(CompilePoolFullError(retry_after=1)) == "pool_full"
+    assert failure_cause(subprocess.TimeoutExpired(["lualatex"], 5)) == "timeout"
+    assert failure_cause(PdfEncryptionError("no backend")) == "encryption"
+    assert failure_cause(ResourceLimitError("memory", limits)) == "memory_limit"
+    assert failure_cause(LatexError("bad", [], stage="lint")) == "lint"
+    assert failure_cause(LatexError("bad", [])) == "latex_error"
+    assert failure_cause(RuntimeError("PDF was not generated")) == "latex_error"
+    assert failure_cause(KeyError("qp_parts")) == "internal"
@@ -0,0 +1,72 @@
+import asyncio
+
+from src.services.output_area import is_output_file, new_output_path, release
+from src.services.pdf_cache import PdfCache
+
+
+def _cache(tmp_path, disk_bytes):
+    return PdfCache(str(tmp_path / "cache"), memory_bytes=0, disk_bytes=disk_bytes, memory_item_bytes=0)
+
+
+async def _compile_shared(cache, callers):
+    compiles = []
+
+    async def compile_fn():
+        compiles.append(1)
+        await asyncio.sleep(0.05)
+        path = new_output_path()
+        path.write_bytes(b"%PDF-1.4 shared")
+        return path
+
+    results = await asyncio.gather(*(cache.get_or_compile("k", compile_fn) for _ in range(callers)))
+    return [source for source, _ in results], len(compiles)
+
+
+def test_coalesced_callers_share_one_compile(tmp_path):
+    cache = _cache(tmp_path, disk_bytes=1024 * 1024)
+    sources, compiles = asyncio.run(_compile_shared(cache, 3))
+    assert compiles == 1
+    assert len(set(sources)) == 1 and is_output_file(sources[0])
+    assert (tmp_path / "cache" / "k.pdf").exists()
+    assert cache.coalesced == 2
+    for source in sources:
+        release(source)
+    assert not sources[0].exists()
+
+
+def test_uncached_output_file_lives_until_every_caller_released_it(tmp_path):
+    # Too small for the disk tier: all callers get the leader's output file
+    cache = _cache(tmp_path, disk_bytes=4)
+    sources, compiles = asyncio.run(_compile_shared(cache, 3))
+    assert compiles == 1
+    path = sources[0]
+    assert all(source == path for source in sources)
+    release(path)
+    release(path)
+    assert path.exists()
+    release(path)
+    assert not path.exists()
+
+
+def test_hits_survive_eviction_while_being_sent(tmp_path):
+    cache = _cache(tmp_path, disk_bytes=1024 * 1024)
+    sources, _ = asyncio.run(_compile_shared(cache, 1))
+    release(sources[0])
+
+    hit = asyncio.run(cache.get("k"))
+    (tmp_path / "cache" / "k.pdf").unlink()
+    assert hit.read_bytes() == b"%PDF-1.4 shared"
+    release(hit)
+
+
+def test_entry_removed_behind_the_index_is_compiled_again(tmp_path):
+    cache = _cache(tmp_path, disk_bytes=1024 * 1024)
+    sources, _ = asyncio.run(_compile_shared(cache, 1))
+    release(sources[0])
+    # Evicted by another process sharing the cache directory
+    (tmp_path / "cache" / "k.pdf").unlink()
+
+    sources, compiles = asyncio.run(_compile_shared(cache, 1))
+    assert compiles == 1
+    assert cache.misses == 2 and cache.hits == 0
+    assert sources[0].read_bytes() == b"%PDF-1.4 shared"
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from src.services import pdf_encryption
+from src.services.pdf_encryption import PdfEncryptionError, PdfEncryptor
+
+
+def _installed(monkeypatch, *tools, pikepdf=True):
+    if not pikepdf:
+        monkeypatch.setattr(pdf_encryption, "pikepdf", None)
+    monkeypatch.setattr(pdf_encryption.shutil, "which", lambda name: f"/usr/bin/{name}" if name in tools else None)
+
+
+@pytest.mark.parametrize("tools, pikepdf, expected", [
+    (("qpdf", "pdftk"), True, "pikepdf"),
+    (("qpdf", "pdftk"), False, "qpdf"),
+    (("pdftk",), False, "pdftk"),
+    ((), False, None),
+])
+def test_auto_prefers_the_in_process_backend(monkeypatch, tools, pikepdf, expected):
+    _installed(monkeypatch, *tools, pikepdf=pikepdf)
+    encryptor = PdfEncryptor()
+    assert encryptor.detect() == expected
+    assert encryptor.available is (expected is not None)
+
+
+def test_backend_is_selected_once(monkeypatch):
+    _installed(monkeypatch, "qpdf", pikepdf=False)
+    encryptor = PdfEncryptor()
+    assert encryptor.detect() == "qpdf"
+    _installed(monkeypatch, pikepdf=False)
+    assert encryptor.detect() == "qpdf"
+
+
+def test_a_named_backend_is_not_substituted(monkeypatch):
+    _installed(monkeypatch, "pdftk")
+    assert PdfEncryptor(preferred="qpdf").detect() is None
+    assert PdfEncryptor(preferred="pdftk").detect() == "pdftk"
+
+
+def test_missing_backend_fails_protected_requests(monkeypatch, tmp_path):
+    _installed(monkeypatch, pikepdf=False)
+    with pytest.raises(PdfEncryptionError):
+        PdfEncryptor(required=True).detect()
+
+    encryptor = PdfEncryptor()
+    with pytest.raises(PdfEncryptionError):
+        asyncio.run(encryptor.encrypt_file(tmp_path / "in.pdf", tmp_path / "out.pdf", "01012024"))
+    assert encryptor.failures == 1 and not (tmp_path / "out.pdf").exists()
+
+
+def test_cipher_and_fingerprint_follow_the_backend(monkeypatch):
+    _installed(monkeypatch, "pdftk", pikepdf=False)
+    pdftk = PdfEncryptor()
+    assert pdftk.fingerprint() == "pdftk:RC4-128"
+    _installed(monkeypatch, "qpdf", pikepdf=False)
+    assert PdfEncryptor().fingerprint() == "qpdf:AES-256"
+    assert PdfEncryptor(key_bits=128).fingerprint() == "qpdf:AES-128"
+
+
+def test_qpdf_uses_aes_at_either_key_length(tmp_path):
+    command = PdfEncryptor()._command("qpdf", tmp_path / "in.pdf", tmp_path / "out.pdf", "pw", False)
+    assert command[:5] == ["qpdf", "--encrypt", "pw", "pw", "256"]
+    assert "--use-aes=y" not in command
+    command = PdfEncryptor(key_bits=128)._command("qpdf", tmp_path / "in.pdf", tmp_path / "out.pdf", "pw", False)
+    assert "128" in command and "--use-aes=y" in command
+
+
+def test_pikepdf_writes_aes_256(tmp_path):
+    pikepdf = pytest.importorskip("pikepdf")
+    source = tmp_path / "in.pdf"
+    pdf = pikepdf.new()
+    pdf.add_blank_page()
+    pdf.save(source)
+
+    encryptor = PdfEncryptor(preferred="pikepdf")
+    asyncio.run(encryptor.encrypt_file(source, tmp_path / "out.pdf", "01012024"))
+    with pytest.raises(pikepdf.PasswordError):
+        pikepdf.open(tmp_path / "out.pdf")
+    with pikepdf.open(tmp_path / "out.pdf", password="01012024") as encrypted:
+        assert encrypted.encryption.R == 6 and encrypted.encryption.bits == 256
+    assert encryptor.encrypted == 1
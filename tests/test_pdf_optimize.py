@@ -0,0 +1,62 @@
+import pytest
+
+from src.services.pdf_encryption import deduplicate_xobjects
+
+pikepdf = pytest.importorskip("pikepdf")
+
+
+def _image(pdf, data=b"\xff\x00\x00" * 4):
+    return pdf.make_indirect(pikepdf.Stream(pdf, data, Type=pikepdf.Name.XObject, Subtype=pikepdf.Name.Image,
+                                            Width=2, Height=2, ColorSpace=pikepdf.Name.DeviceRGB, BitsPerComponent=8))
+
+
+def _page(pdf, xobjects):
+    pdf.add_blank_page()
+    pdf.pages[-1].obj.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(xobjects))
+
+
+def test_identical_images_share_one_copy():
+    pdf = pikepdf.new()
+    first, second, other = _image(pdf), _image(pdf), _image(pdf, b"\x00" * 12)
+    _page(pdf, {"/Im1": first, "/Im2": other})
+    _page(pdf, {"/Im1": second})
+
+    assert deduplicate_xobjects(pdf) == 1
+    assert pdf.pages[1].obj.Resources.XObject.Im1.objgen == first.objgen
+    assert pdf.pages[0].obj.Resources.XObject.Im2.objgen == other.objgen
+
+
+def test_forms_are_compared_after_their_images():
+    pdf = pikepdf.new()
+    forms = []
+    for _ in range(2):
+        form = pdf.make_indirect(pikepdf.Stream(pdf, b"/Im1 Do", Type=pikepdf.Name.XObject,
+                                                Subtype=pikepdf.Name.Form, BBox=[0, 0, 1, 1]))
+        form.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im1=_image(pdf)))
+        forms.append(form)
+    _page(pdf, {"/Fm1": forms[0]})
+    _page(pdf, {"/Fm1": forms[1]})
+
+    # The second form's image, then the second form itself
+    assert deduplicate_xobjects(pdf) == 2
+    assert pdf.pages[1].obj.Resources.XObject.Fm1.objgen == forms[0].objgen
+
+
+def test_images_differing_only_in_their_dictionary_are_kept():
+    pdf = pikepdf.new()
+    first, second = _image(pdf), _image(pdf)
+    second.Decode = [1, 0, 1, 0, 1, 0]
+    _page(pdf, {"/Im1": first, "/Im2": second})
+
+    assert deduplicate_xobjects(pdf) == 0
+    assert pdf.pages[0].obj.Resources.XObject.Im2.objgen == second.objgen
+
+
+def test_self_referencing_forms_terminate():
+    pdf = pikepdf.new()
+    form = pdf.make_indirect(pikepdf.Stream(pdf, b"/Fm1 Do", Type=pikepdf.Name.XObject,
+                                            Subtype=pikepdf.Name.Form, BBox=[0, 0, 1, 1]))
+    form.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Fm1=form))
+    _page(pdf, {"/Fm1": form})
+
+    assert deduplicate_xobjects(pdf) == 0
@@ -0,0 +1,77 @@
+import json
+import re
+
+import pytest
+
+from src.templates.question_renderer import render_fragment_document, render_question_body, render_question_document
+from src.templates.question_template import get_question_latex_template
+
+lupa = pytest.importorskip("lupa")
+
+LUA_LOOP_PATTERN = re.compile(r"\\begin\{luacode\*\}(.*?)\\end\{luacode\*\}", re.DOTALL)
+
+PAPER = {
+    "qp_code": "MTM ML 1001",
+    "qp_name": "Mathematics \\& Physics",
+    "time": "3 hrs",
+    "max_marks": "80",
+    "fonts": {"malayalam": "Manjari", "malayalam_scale": "1.1", "arabic": ""},
+    "qp_parts": [
+        {
+            "part_name": "Part A",
+            "part_description": "Answer all",
+            "content": [
+                "1. Find $x$ if $x^2 = 4$.",
+                "2. \\begin{tabular}{|c|c|} a & b \\\\ \\end{tabular}",
+                "3. ഊർജ്ജം നിർവചിക്കുക",
+            ],
+            "footer": "(5 x 2 = 10)",
+        },
+        {"part_name": "Part B", "part_description": "", "content": ["4. Bell\x07 and tab\tinside"], "footer": ""},
+    ],
+}
+
+
+def _lua_output(data, tmp_path):
+    """
+    Run the Lua loop of the template as LuaLaTeX would, collecting tex.print lines
+    """
+    (tmp_path / "Reports").mkdir(exist_ok=True)
+    (tmp_path / "Reports" / "question.json").write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    lua = lupa.LuaRuntime(unpack_returned_tuples=True)
+    printed = []
+
+    def decode(text, *args):
+        return lua.table_from(json.loads(text), recursive=True), None, None
+
+    lua.globals().tex = lua.table_from({"print": printed.append})
+    lua.globals().lfs = lua.table_from({"currentdir": lambda: str(tmp_path)})
+    dkjson = lua.table_from({"decode": decode})
+    modules = {"dkjson": dkjson, "lfs": lua.globals().lfs}
+    lua.globals().require = lambda name: modules[name]
+    code = LUA_LOOP_PATTERN.search(get_question_latex_template()).group(1)
+    lua.execute(code)
+    return "".join(f"{line}\n" for line in printed)
+
+
+def _tex_lines(text):
+    # tex.print keeps control characters inside one line; TeX reads them as ^^ notation
+    return "".join(f"^^{chr(ord(char) + 64)}" if ord(char) < 32 and char not in "\t\n" else char for char in text)
+
+
+def test_body_matches_the_lua_loop(tmp_path):
+    assert render_question_body(PAPER) == _tex_lines(_lua_output(PAPER, tmp_path))
+
+
+def test_body_matches_without_font_overrides(tmp_path):
+    paper = {key: value for key, value in PAPER.items() if key != "fonts"}
+    assert render_question_body(paper) == _tex_lines(_lua_output(paper, tmp_path))
+
+
+def test_document_drops_only_the_lua_packages():
+    document = render_question_document(PAPER)
+    assert "luacode" not in document.split("\\begin{document}")[0]
+    assert document.endswith("\\end{enumerate}\n\\end{document}\n")
+    assert "\\newfontfamily\\malayalamfont[Script=Malayalam,Scale=1.1]{Manjari}" in document
+    fragment = render_fragment_document("1. Define work.", fonts=PAPER["fonts"])
+    assert "\\noindent\\strut1. Define work.\\strut\\par}" in fragment
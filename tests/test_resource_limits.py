@@ -0,0 +1,79 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from src import config
+from src.services.compile_pool import ResourceLimitError, ResourceLimits, _exceeded_limit, run_command
+from src.services.latex_compiler import compile_timeout
+
+LIMITS = ResourceLimits(cpu_seconds=10, memory_bytes=64 * 1024 * 1024, output_bytes=1024 * 1024)
+
+
+def test_limits_are_told_apart_by_how_the_process_ended():
+    assert _exceeded_limit(-signal.SIGXCPU, "", "", LIMITS) == "cpu"
+    assert _exceeded_limit(-signal.SIGXFSZ, "", "", LIMITS) == "output"
+    assert _exceeded_limit(1, "! TeX capacity exceeded", "lua: not enough memory", LIMITS) == "memory"
+    assert _exceeded_limit(1, "Undefined control sequence", "", LIMITS) is None
+    assert _exceeded_limit(0, "out of memory", "", LIMITS) is None
+    # Limits that are off are never blamed
+    assert _exceeded_limit(-signal.SIGXCPU, "", "", ResourceLimits()) is None
+    assert _exceeded_limit(-signal.SIGXCPU, "", "", None) is None
+
+
+def test_timeout_grows_with_the_document_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(config, "LATEX_TIMEOUT_MIN", 30.0)
+    monkeypatch.setattr(config, "LATEX_TIMEOUT_PER_TEXT_KB", 0.5)
+    monkeypatch.setattr(config, "LATEX_TIMEOUT_PER_IMAGE_MB", 1.0)
+    monkeypatch.setattr(config, "LATEX_TIMEOUT_MAX", 120.0)
+    assert compile_timeout(0) == 30.0
+    assert compile_timeout(20 * 1024, 10 * 1024 * 1024) == 30.0 + 10.0 + 10.0
+    assert compile_timeout(10 * 1024 * 1024, 0) == 120.0
+
+
+def _python(code):
+    return [sys.executable, "-c", code]
+
+
+@pytest.mark.skipif(not hasattr(os, "killpg"), reason="process groups")
+def test_output_limit_kills_the_process():
+    limits = ResourceLimits(output_bytes=64 * 1024)
+    with pytest.raises(ResourceLimitError) as error:
+        asyncio.run(run_command(_python("while True: print('x' * 1000)"), timeout=30, limits=limits))
+    assert error.value.limit == "output" and error.value.status_code == 413
+
+
+@pytest.mark.skipif(not hasattr(os, "killpg"), reason="process groups")
+def test_cpu_limit_ends_a_busy_loop():
+    pytest.importorskip("resource")
+    with pytest.raises(ResourceLimitError) as error:
+        asyncio.run(run_command(_python("while True: pass"), timeout=30, limits=ResourceLimits(cpu_seconds=1)))
+    assert error.value.limit == "cpu" and error.value.status_code == 408
+
+
+@pytest.mark.skipif(not hasattr(os, "killpg"), reason="process groups")
+def test_timeout_kills_the_whole_process_group(tmp_path):
+    pid_file = tmp_path / "child.pid"
+    code = (
+        "import subprocess, sys, time\n"
+        f"child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+        f"open({str(pid_file)!r}, 'w').write(str(child.pid))\n"
+        "time.sleep(60)\n"
+    )
+    with pytest.raises(subprocess.TimeoutExpired):
+        asyncio.run(run_command(_python(code), timeout=1))
+    child = int(pid_file.read_text())
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            os.kill(child, 0)
+        except ProcessLookupError:
+            break
+        # Reaped by init once its parent is gone
+        time.sleep(0.05)
+    else:
+        pytest.fail("child process survived the timeout")
@@ -0,0 +1,33 @@
+import pytest
+
+from src.templates.scripts import SCRIPTS, detect_scripts, normalize_scripts, script_set_label
+
+
+def test_latin_only_paper_uses_no_extra_scripts():
+    assert detect_scripts({"qp_name": "Physics", "qp_parts": [{"content": ["1. Define $E = mc^2$."]}]}) == ()
+
+
+def test_scripts_are_found_by_characters_and_commands():
+    assert detect_scripts("ഗാന്ധിജി") == ("malayalam",)
+    assert detect_scripts("\\texthindi{x}") == ("devanagari",)
+    assert detect_scripts("\\begin{Arabic} x \\end{Arabic}") == ("arabic",)
+    paper = {"qp_parts": [{"content": ["ما هو", "सत्य"]}], "qp_name": "\\textmalayalam{x}"}
+    assert detect_scripts(paper) == SCRIPTS
+
+
+def test_images_and_fonts_are_not_scanned():
+    paper = {"qp_parts": [], "images": {"a.png": "സാഹിത്യം"}, "fonts": {"malayalam": "\\malayalamfont"}}
+    assert detect_scripts(paper) == ()
+
+
+def test_script_sets_are_ordered_and_labelled():
+    assert normalize_scripts(["arabic", "devanagari"]) == ("devanagari", "arabic")
+    with pytest.raises(ValueError):
+        normalize_scripts(["tamil"])
+    assert script_set_label(("malayalam",)) == "latin,malayalam"
+
+
+def test_language_switches_count_and_longer_command_names_do_not():
+    assert detect_scripts("\\selectlanguage{arabic} x") == ("arabic",)
+    assert detect_scripts(["\\begin{malayalam}", "\\end{malayalam}"]) == ("malayalam",)
+    assert detect_scripts("\\texthindifoo{x} \\arabicfontsize") == ()
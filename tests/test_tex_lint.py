@@ -0,0 +1,67 @@
+from src.services.tex_lint import ERROR, WARNING, lint_question_paper
+
+
+def _paper(*content):
+    return {"qp_code": "QP1", "qp_name": "Physics", "qp_parts": [{"part_name": "Part A", "content": list(content)}]}
+
+
+def _messages(*content, workdir=None):
+    return [(issue["location"], issue["message"]) for issue in lint_question_paper(_paper(*content), workdir)]
+
+
+def _severities(*content, workdir=None):
+    return [issue["severity"] for issue in lint_question_paper(_paper(*content), workdir)]
+
+
+def test_clean_paper_has_no_issues():
+    assert _messages("1. Find $x$ if $x^2 = 4$.", "2. \\begin{tabular}{c} a \\\\ \\end{tabular}", "3. 50\\% of {it}") == []
+
+
+def test_unbalanced_braces_math_and_environments():
+    issues = _messages("1. \\textbf{open", "2. $x", "3. \\begin{center} x \\end{tabular}")
+    assert [location for location, _ in issues] == [
+        "qp_parts[0].content[0]", "qp_parts[0].content[1]", "qp_parts[0].content[2]",
+    ]
+    assert "never closed" in issues[0][1]
+    assert "odd number of '$'" in issues[1][1]
+    assert "ended by \\end{tabular}" in issues[2][1]
+    # Only the braces reject the paper: TeX recovers from the other two
+    assert _severities("1. \\textbf{open", "2. $x", "3. \\begin{center} x \\end{tabular}") == [
+        ERROR, WARNING, WARNING,
+    ]
+
+
+def test_environments_may_span_fields():
+    assert _severities("1. \\begin{tabular}{c} a \\\\", "2. b \\end{tabular}") == [WARNING, WARNING]
+
+
+def test_escapes_and_comments_are_ignored():
+    assert _messages("1. costs \\$5 and \\{x\\}", "2. text % \\input{x} {") == []
+
+
+def test_forbidden_commands_and_undeclared_languages():
+    issues = _messages("1. \\directlua{os.exit()}", "2. \\texttamil{x}", "3. \\inputenc")
+    assert issues == [
+        ("qp_parts[0].content[0]", "Command not allowed in question text: \\directlua"),
+        ("qp_parts[0].content[1]", "Unsupported language: tamil"),
+    ]
+    assert _severities("1. \\directlua{os.exit()}", "2. \\texttamil{x}") == [ERROR, WARNING]
+
+
+def test_images_are_checked_against_the_workspace(tmp_path):
+    (tmp_path / "Photo" / "Qpbank").mkdir(parents=True)
+    (tmp_path / "Photo" / "Qpbank" / "a.png").write_bytes(b"png")
+    issues = _messages(
+        "1. \\includegraphics{./Photo/Qpbank/a.png}",
+        "2. \\includegraphics[width=2cm]{Photo/Qpbank/missing}",
+        "3. \\includegraphics{../../etc/passwd}",
+        "4. \\includegraphics{https://example.com/a.png}",
+        workdir=tmp_path,
+    )
+    assert [message.split(":")[0] for _, message in issues] == [
+        "Image not found", "Image path outside the workspace", "Image could not be downloaded",
+    ]
+    # TeX leaves a blank space for a missing image, so none of these reject the paper
+    assert {issue["severity"] for issue in lint_question_paper(_paper("\\includegraphics{nope}"), tmp_path)} == {
+        WARNING,
+    }
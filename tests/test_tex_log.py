@@ -0,0 +1,98 @@
+from src.services.tex_log import ErrorLocator, TexLogParser, question_fields
+
+PAPER = {
+    "qp_code": "QP1",
+    "qp_name": "Physics",
+    "qp_parts": [
+        {"part_name": "Part A", "content": ["1. Define work.", "2. Explain \\textbff{entropy} in detail"]},
+    ],
+}
+
+
+def _feed(parser, lines):
+    return [parser.feed(line) for line in lines]
+
+
+def test_question_fields_are_addressed_by_location():
+    fields = question_fields(PAPER)
+    assert fields["qp_name"] == "Physics"
+    assert fields["qp_parts[0].content[1]"].startswith("2. Explain")
+    assert "qp_parts[0].footer" not in fields
+
+
+def test_first_error_is_located_in_the_question():
+    parser = TexLogParser(ErrorLocator(PAPER))
+    _feed(parser, [
+        "(./question.tex",
+        "./question.tex:130: Undefined control sequence.",
+        "l.130 2. Explain \\textbff",
+        "{entropy} in detail",
+    ])
+    error = parser.exception()
+    assert error.errors[0]["location"] == "qp_parts[0].content[1]"
+    assert error.errors[0]["tex_line"] == 130
+    assert "qp_parts[0].content[1]" in str(error)
+
+
+def test_tolerated_errors_do_not_fail():
+    parser = TexLogParser()
+    _feed(parser, [
+        "./question.tex:57: LaTeX Error: Something's wrong--perhaps a missing \\item.",
+        "l.57 \\end{enumerate}",
+        "",
+    ])
+    parser.finish()
+    assert not parser.failed
+    assert parser.tolerated == 1
+
+
+def test_recoverable_errors_do_not_stop_the_run():
+    parser = TexLogParser(ErrorLocator(PAPER))
+    stops = _feed(parser, [
+        "./question.tex:130: Undefined control sequence.",
+        "l.130 2. Explain \\textbff",
+        "{entropy} in detail",
+        "./question.tex:131: Missing $ inserted.",
+        "<inserted text>",
+        "l.131 x^",
+        "2",
+        "./question.tex:140: Package luaotfload Error: Could not find file 'a.png'.",
+        "./question.tex:141: Package fontspec Error: The font \"Manjari\" cannot be found.",
+        "(./question.aux)",
+    ])
+    parser.finish()
+    assert not any(stops)
+    assert parser.failed and not parser.fatal
+    assert len(parser.errors) == 4
+
+
+def test_fatal_errors_stop_the_run_at_once():
+    for lines in (
+        ["! Emergency stop."],
+        ["! TeX capacity exceeded, sorry [main memory size=5000000]."],
+        ["Runaway argument?", "./question.tex:9: File ended while scanning use of \\textbf."],
+        ["*** (job aborted, no legal \\end found)"],
+    ):
+        parser = TexLogParser()
+        _feed(parser, ["./question.tex:3: Undefined control sequence.", "l.3 \\foo", ""])
+        assert not parser.fatal
+        assert _feed(parser, lines)[-1] is True
+        assert parser.fatal
+        # The fatal error leads the report, not the earlier recoverable one
+        assert "Undefined control sequence" not in str(parser.exception()).split(" (and")[0]
+
+
+def test_without_fail_fast_errors_are_only_collected():
+    parser = TexLogParser(fail_fast=False)
+    stops = _feed(parser, ["! Emergency stop.", "./question.tex:3: Missing $ inserted."])
+    parser.finish()
+    assert stops == [False, False]
+    assert [error.message for error in parser.errors] == ["Emergency stop.", "Missing $ inserted."]
+
+
+def test_pending_error_is_recorded_on_finish():
+    parser = TexLogParser()
+    parser.feed("./question.tex:9: Undefined control sequence.")
+    assert not parser.failed
+    parser.finish()
+    assert parser.failed
@@ -0,0 +1,57 @@
+import json
+
+from src.services.tex_profiler import PROFILE_FILE, build_profile_report
+
+PAPER = {"qp_code": "QP1", "qp_parts": [{"part_name": "A", "content": ["1. Define work.", "2. " + "x" * 200]}]}
+
+MARKS = [
+    {"kind": "header", "clock": 0.0, "wall": 0.0, "lua_kb": 1000},
+    {"kind": "part", "part": 1, "clock": 0.1, "wall": 0.1, "lua_kb": 1000},
+    {"kind": "question", "part": 1, "question": 1, "clock": 0.2, "wall": 0.25, "lua_kb": 1010},
+    {"kind": "question", "part": 1, "question": 2, "clock": 0.3, "wall": 0.35, "lua_kb": 1500},
+    {"kind": "footer", "part": 1, "clock": 1.3, "wall": 1.4, "lua_kb": 1200},
+    {"kind": "end", "clock": 1.4, "wall": 1.5, "lua_kb": 1200},
+]
+
+
+def _workspace(tmp_path, profile=True):
+    (tmp_path / "Reports").mkdir()
+    if profile:
+        (tmp_path / PROFILE_FILE).write_text(json.dumps({
+            "marks": MARKS, "fonts": ["Rachana"], "status": {"node_mem_usage": "42", "ignored": 1},
+        }))
+    (tmp_path / "question.log").write_text(
+        "(./question.tex <fonts/Rachana-Regular.ttf> {texmf/lm/lmr10.pfb} <fonts/Rachana-Regular.ttf>)"
+    )
+    (tmp_path / "question.fls").write_text(
+        "PWD /w\nINPUT /texmf/a.sty\nINPUT /texmf/a.sty\nINPUT /fonts/b.ttf\nOUTPUT question.pdf\n"
+    )
+    return tmp_path
+
+
+def test_report_ranks_questions_by_cpu_time(tmp_path):
+    report = build_profile_report(_workspace(tmp_path), "question", PAPER, top=1)
+    assert report["available"]
+    assert report["typeset_cpu_seconds"] == 1.4 and report["typeset_wall_seconds"] == 1.5
+    slowest = report["slowest_questions"]
+    assert [item["fragment"] for item in slowest] == ["question 1.2"]
+    assert slowest[0]["cpu_seconds"] == 1.0 and slowest[0]["lua_kb_delta"] == -300
+    assert slowest[0]["content"].endswith("...") and len(slowest[0]["content"]) == 123
+    assert [item["fragment"] for item in report["fragments"]] == [
+        "header", "part 1", "question 1.1", "question 1.2", "footer 1",
+    ]
+    assert report["memory"] == {"node_mem_usage": "42", "lua_kb_peak": 1500}
+
+
+def test_log_fonts_and_recorder_inputs_are_deduplicated(tmp_path):
+    report = build_profile_report(_workspace(tmp_path), "question", PAPER)
+    assert report["log_fonts"] == ["fonts/Rachana-Regular.ttf", "texmf/lm/lmr10.pfb"]
+    assert report["recorder"]["count"] == 2
+    assert report["recorder"]["by_extension"] == {".sty": 1, ".ttf": 1}
+
+
+def test_missing_profile_data_still_reports_the_log(tmp_path):
+    report = build_profile_report(_workspace(tmp_path, profile=False), "question", PAPER)
+    assert report["available"] is False
+    assert report["log_fonts"]
+    assert build_profile_report(tmp_path / "Reports", "question", PAPER)["recorder"] == {"available": False}
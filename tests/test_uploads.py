@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import pytest
+
+from src.services.uploads import UploadError, read_paper_upload
+
+BOUNDARY = "testboundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+PAPER = {"qp_code": "QP1", "qp_parts": []}
+
+
+def _part(name, data, filename=None, content_type="application/octet-stream"):
+    disposition = f'form-data; name="{name}"'
+    if filename is not None:
+        disposition += f'; filename="{filename}"'
+    return (
+        f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\nContent-Type: {content_type}\r\n\r\n".encode()
+        + data + b"\r\n"
+    )
+
+
+def _body(*parts):
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+async def _chunks(body, size):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def _read(body, chunk_size):
+    return asyncio.run(read_paper_upload(CONTENT_TYPE, str(len(body)), _chunks(body, chunk_size)))
+
+
+@pytest.mark.parametrize("chunk_size", [1 << 20, 7])
+def test_parts_keep_their_own_headers(chunk_size):
+    body = _body(
+        _part("paper", json.dumps(PAPER).encode(), content_type="application/json"),
+        _part("images", b"\x89PNG first", filename="a.png"),
+        _part("images", b"\x89PNG second", filename="b.png"),
+    )
+    upload = _read(body, chunk_size)
+    try:
+        assert json.loads(upload.body) == PAPER
+        assert sorted(upload.images) == ["a.png", "b.png"]
+        assert upload.images["a.png"].read_bytes() == b"\x89PNG first"
+        assert upload.images["b.png"].read_bytes() == b"\x89PNG second"
+    finally:
+        upload.cleanup()
+
+
+def test_duplicate_image_is_rejected():
+    body = _body(
+        _part("paper", json.dumps(PAPER).encode()),
+        _part("images", b"one", filename="a.png"),
+        _part("images", b"two", filename="dir/a.png"),
+    )
+    with pytest.raises(UploadError) as error:
+        _read(body, 1 << 20)
+    assert error.value.status_code == 400
+
+
+def test_missing_paper_part_is_rejected():
+    with pytest.raises(UploadError) as error:
+        _read(_body(_part("images", b"one", filename="a.png")), 1 << 20)
+    assert error.value.status_code == 400
+
+
+def test_json_body_is_read_whole():
+    body = json.dumps(PAPER).encode()
+    upload = asyncio.run(read_paper_upload("application/json", None, _chunks(body, 5)))
+    assert upload.body == body and upload.images == {}
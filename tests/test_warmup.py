@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from src import config
+from src.services import warmup
+
+
+@pytest.fixture
+def state(monkeypatch):
+    monkeypatch.setattr(config, "WARMUP_ENABLED", True)
+    monkeypatch.setattr(config, "WARMUP_ATTEMPTS", 3)
+    monkeypatch.setattr(config, "WARMUP_RETRY_DELAY", 0.0)
+    monkeypatch.setattr(warmup, "warmup_state", warmup.WarmupState())
+    return warmup.warmup_state
+
+
+def _fail_times(monkeypatch, failures):
+    calls = []
+
+    async def warm():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise ValueError(f"failure {len(calls)}")
+
+    monkeypatch.setattr(warmup, "_warm", warm)
+    return calls
+
+
+def test_failed_attempts_are_retried(state, monkeypatch):
+    calls = _fail_times(monkeypatch, 2)
+    asyncio.run(warmup.run_warmup())
+    assert len(calls) == 3
+    assert state.ready and not state.degraded and state.error is None
+    assert state.to_dict()["attempts"] == 3
+
+
+def test_exhausted_attempts_report_ready_but_degraded(state, monkeypatch):
+    calls = _fail_times(monkeypatch, 5)
+    asyncio.run(warmup.run_warmup())
+    assert len(calls) == 3
+    assert state.ready and state.degraded
+    assert state.error == "failure 3"
@@ -0,0 +1,92 @@
+import asyncio
+import os
+
+from src.services import workspace_pool as workspace_pool_module
+from src.services.workspace_pool import WorkspacePool, sweep_stale_workspaces, write_if_changed
+
+
+def _pool(tmp_path, size=1, max_bytes=1024 * 1024):
+    return WorkspacePool(str(tmp_path / "workspaces"), size=size, max_bytes=max_bytes)
+
+
+def test_reset_keeps_the_layout_and_the_template(tmp_path):
+    pool = _pool(tmp_path)
+    workspace = pool._create()
+    template = (workspace / "question.tex").read_text()
+    (workspace / "Reports" / "question.json").write_text("{}")
+    (workspace / "Photo" / "Qpbank" / "a.png").write_bytes(b"png")
+    (workspace / "Photo" / "extra").mkdir()
+    (workspace / "question.aux").write_text("\\relax")
+    (workspace / "question.pdf").write_bytes(b"%PDF")
+
+    assert pool._reset(workspace)
+    assert sorted(str(path.relative_to(workspace)) for path in workspace.rglob("*")) == [
+        "Photo", "Photo/Qpbank", "Reports", "question.tex",
+    ]
+    assert not write_if_changed(workspace / "question.tex", template)
+
+
+def test_oversized_workspaces_are_discarded(tmp_path):
+    pool = _pool(tmp_path)
+    workspace = pool._create()
+    pool.max_bytes = (workspace / "question.tex").stat().st_size + 100
+    (workspace / "question.pdf").write_bytes(os.urandom(200))
+    assert not pool._reset(workspace)
+
+    # Files hard-linked in from a cache do not count
+    cached = tmp_path / "blob"
+    cached.write_bytes(os.urandom(200))
+    (workspace / "question.pdf").unlink()
+    os.link(cached, workspace / "Photo" / "Qpbank" / "a.png")
+    assert pool._reset(workspace)
+
+
+def test_workspaces_are_reused_up_to_the_pool_size(tmp_path):
+    pool = _pool(tmp_path, size=1)
+    pool.start()
+
+    async def borrow_two():
+        async with pool.workspace() as first:
+            async with pool.workspace() as second:
+                (second / "Reports" / "question.json").write_text("{}")
+                return first, second
+
+    first, second = asyncio.run(borrow_two())
+    # The pre-created workspace went out first; the one returned first is kept
+    assert pool.stats()["idle"] == 1 and pool.reused == 1 and pool.discarded == 1
+    assert second.exists() and not first.exists()
+    assert not (second / "Reports" / "question.json").exists()
+    pool.stop()
+    assert not second.exists()
+
+
+def test_sweep_removes_only_directories_of_dead_processes(tmp_path):
+    live = _pool(tmp_path)
+    live.start()
+    root = live.root
+    dead = root / "999999-deadbeef"
+    (dead / "abc" / "Reports").mkdir(parents=True)
+    (dead / ".lock").write_text("")
+    starting = root / "999998-cafecafe"
+    starting.mkdir()
+    old = 1_000_000
+    for directory in (live._dir, dead):
+        os.utime(directory, (old, old))
+
+    assert sweep_stale_workspaces(root) == 1
+    assert not dead.exists()
+    # Locked by a running process, or too new to tell
+    assert live._dir.exists() and starting.exists()
+    live.stop()
+
+
+def test_sweep_without_locks_goes_by_age(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace_pool_module, "fcntl", None)
+    root = tmp_path / "workspaces"
+    recent, old = root / "1-recent", root / "2-old"
+    for directory in (recent, old):
+        directory.mkdir(parents=True)
+    os.utime(recent, (os.path.getmtime(recent) - 600,) * 2)
+    os.utime(old, (1_000_000, 1_000_000))
+    assert sweep_stale_workspaces(root) == 1
+    assert recent.exists() and not old.exists()
@@ -0,0 +1,9 @@
+"""
+LaTeX to PDF Converter - Standalone compile worker entry point
+Processes jobs submitted through POST /jobs (see src/worker.py)
+"""
+
+from src.worker import main
+
+if __name__ == "__main__":
+    main()